@@ -1,43 +1,227 @@
+import asyncio
 import logging
-from typing import Optional, Dict, Any
-import google.generativeai as genai
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterator, AsyncIterator, Tuple
 from config import Config
+from deadlines import DeadlineExceeded, remaining, upstream_timeout
+from generation_profiles import DEFAULT_PROFILE, PROFILES, REST_CONFIGS, max_output_tokens
+from metrics import metrics
+from prompts import SystemPrompts, estimate_tokens
+from rate_limiter import OutboundLimiter, RateLimitExceeded, prompt_priority
+from shared_store import SharedStore
+from upstream_pool import UpstreamPool, UpstreamError, build_payload
 
 logger = logging.getLogger(__name__)
 
-class GeminiClient:
-    """Handles Gemini 1.5 Flash model interactions with enhanced error handling"""
+class UpstreamBusyError(RateLimitExceeded):
+    """Raised when no upstream slot frees up before the admission deadline"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(retry_after, f"No upstream slot available, retry after {retry_after:.0f}s")
+
+class GenerationBackend:
+    """Interface ResponseHandler generates answers through
+
+    name labels the backend on /status and source is the response source of
+    its answers. A backend set up in the background reports 'warming' until
+    it sets _ready. The async methods are only used under the ASGI app.
+    """
+
+    name = ''
+    source = ''
 
     def __init__(self):
+        self.init_seconds: Optional[float] = None
+        self._ready = threading.Event()
+
+    def is_available(self) -> bool:
+        """Check if the backend can generate at all"""
+        raise NotImplementedError
+
+    def is_healthy(self) -> bool:
+        """Check if a call is worth trying right now"""
+        return self.get_state() != 'unavailable'
+
+    def get_state(self) -> str:
+        """'warming' until initialization has finished, then 'ready' or 'unavailable'"""
+        if not self._ready.is_set():
+            return 'warming'
+        return 'ready' if self.is_available() else 'unavailable'
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until initialization has finished; False on timeout"""
+        return self._ready.wait(timeout)
+
+    def _wait_init(self, deadline: Optional[float] = None) -> None:
+        """Hold a request that arrives during warm-up until the backend is set up"""
+        if not self._ready.is_set():
+            left = remaining(deadline)
+            self._ready.wait(Config.INIT_WAIT_TIMEOUT if left is None else min(left, Config.INIT_WAIT_TIMEOUT))
+
+    def generate_response(self, prompt: str, deadline: Optional[float] = None,
+                          profile: Optional[str] = None) -> Optional[str]:
+        raise NotImplementedError
+
+    def stream_response(self, prompt: str, deadline: Optional[float] = None,
+                        profile: Optional[str] = None) -> Iterator[str]:
+        raise NotImplementedError
+
+    async def generate_response_async(self, prompt: str, deadline: Optional[float] = None,
+                                      profile: Optional[str] = None) -> Optional[str]:
+        raise NotImplementedError
+
+    def stream_response_async(self, prompt: str, deadline: Optional[float] = None,
+                              profile: Optional[str] = None) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    def get_status(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+class BackendHealth:
+    """Consecutive-failure breaker that sends answers to the fallback backend while open"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """closed, open or half_open"""
+        if self.consecutive_failures < self.threshold:
+            return 'closed'
+        return 'open' if time.time() < self.open_until else 'half_open'
+
+    def allows(self) -> bool:
+        """Check if calls should go to the backend; half-open lets them through as probes"""
+        return self.state != 'open'
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.threshold:
+                self.open_until = time.time() + self.cooldown
+
+class GeminiClient(GenerationBackend):
+    """Handles Gemini 1.5 Flash model interactions with enhanced error handling"""
+
+    name = 'gemini'
+    source = 'gemini_ai'
+
+    def __init__(self, background: bool = Config.BACKGROUND_INIT):
+        super().__init__()
         self.model = None
+        # One model object per generation profile, built once at startup
+        self.models: Dict[str, Any] = {}
+        self.pool: Optional[UpstreamPool] = None
         self.model_name = Config.GEMINI_MODEL
-        self._initialize_client()
+        self.limiter = OutboundLimiter.from_config(len(Config.GEMINI_API_KEYS) or 1, SharedStore.from_config())
+        if background:
+            # Importing the SDK alone takes about a second; routes can serve meanwhile
+            threading.Thread(target=self._initialize_client, name='gemini-init', daemon=True).start()
+        else:
+            self._initialize_client()
 
     def _initialize_client(self) -> None:
         """Initialize the Gemini client"""
+        start = time.perf_counter()
         try:
             Config.validate_config()
+            if Config.UPSTREAM_POOL_ENABLED:
+                self.pool = UpstreamPool.from_config()
+                logger.info(f"✅ Initialized Gemini upstream pool with {len(self.pool.endpoints)} endpoints")
+                return
+            import google.generativeai as genai
             genai.configure(api_key=Config.GEMINI_API_KEY)
-            self.model = genai.GenerativeModel(
-                self.model_name,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=Config.TEMPERATURE,
-                    top_p=Config.TOP_P,
-                    top_k=Config.TOP_K,
-                    max_output_tokens=Config.MAX_TOKENS,
+            self.models = {
+                name: genai.GenerativeModel(
+                    self.model_name,
+                    generation_config=genai.types.GenerationConfig(**profile),
+                    # Sent once per model instead of being prepended to every prompt
+                    system_instruction=SystemPrompts.MAIN_SYSTEM_PROMPT
                 )
-            )
-            logger.info(f"✅ Successfully initialized Gemini client: {self.model_name}")
+                for name, profile in PROFILES.items()
+            }
+            self.model = self.models[DEFAULT_PROFILE]
+            logger.info(f"✅ Successfully initialized Gemini client: {self.model_name} "
+                        f"in {(time.perf_counter() - start) * 1000:.0f} ms")
         except Exception as e:
             logger.error(f"❌ Failed to initialize Gemini client: {e}")
             self.model = None
+        finally:
+            self.init_seconds = time.perf_counter() - start
+            self._ready.set()
 
     def is_available(self) -> bool:
         """Check if client is available"""
-        return self.model is not None
+        return self.model is not None or self.pool is not None
+
+    def is_healthy(self) -> bool:
+        """Check if a call can go out now: set up, and with the pool, some endpoint open to traffic"""
+        if self.pool is not None:
+            now = time.time()
+            return any(endpoint.is_available(now) for endpoint in self.pool.endpoints)
+        return self.get_state() != 'unavailable'
+
+    def _model_for(self, profile: Optional[str]) -> Any:
+        """SDK model object of a generation profile"""
+        return self.models.get(profile or DEFAULT_PROFILE, self.model)
+
+    @staticmethod
+    def _rest_generation_config(profile: Optional[str] = None) -> Dict[str, Any]:
+        """Generation settings in REST API form for the upstream pool"""
+        return REST_CONFIGS[profile or DEFAULT_PROFILE]
+
+    @staticmethod
+    def _quota_cost(prompt: str, profile: Optional[str] = None) -> Tuple[int, int]:
+        """Estimated tokens (prompt plus expected answer) and queue priority for a call"""
+        tokens = estimate_tokens(prompt) + min(Config.RATE_LIMIT_OUTPUT_TOKENS, max_output_tokens(profile))
+        return tokens, prompt_priority(tokens)
+
+    def _admit(self, prompt: str, deadline: Optional[float] = None, profile: Optional[str] = None,
+               queue: bool = True) -> None:
+        """Wait for room in the RPM/TPM quota, at most until the deadline; raises RateLimitExceeded
+
+        With queue=False the call is admitted only if it can go right now, so
+        it never takes a queue slot ahead of a waiting request.
+        """
+        tokens, priority = self._quota_cost(prompt, profile)
+        if not queue:
+            if not self.limiter.try_acquire(tokens):
+                raise RateLimitExceeded(1.0)
+            return
+        try:
+            self.limiter.acquire(tokens, priority, timeout=remaining(deadline))
+        except RateLimitExceeded:
+            logger.warning(f"⏳ Gemini quota exhausted, request rejected ({tokens} tokens)")
+            raise
+
+    def generate_response(self, prompt: str, deadline: Optional[float] = None,
+                          profile: Optional[str] = None, queue: bool = True) -> Optional[str]:
+        """Generate response using Gemini 1.5 Flash with improved error handling
+
+        deadline is a time.monotonic() value; the upstream call is abandoned
+        when it passes. profile names the generation settings to use (see
+        generation_profiles.py, "detailed" by default). Raises RateLimitExceeded when the call does not fit the
+        Gemini quota in time (at once when queue is False), and DeadlineExceeded when the deadline passes.
+        """
+        self._wait_init(deadline)
+        if self.is_available() and prompt and prompt.strip():
+            self._admit(prompt, deadline, profile, queue)
+
+        if self.pool is not None:
+            return self._generate_with_pool(prompt, deadline, profile)
 
-    def generate_response(self, prompt: str) -> Optional[str]:
-        """Generate response using Gemini 1.5 Flash with improved error handling"""
         if not self.model:
             logger.error("Gemini model not available")
             return None
@@ -48,24 +232,302 @@ class GeminiClient:
                 logger.error("Empty prompt provided")
                 return None
 
-            response = self.model.generate_content(prompt)
+            start = time.perf_counter()
+            response = self._model_for(profile).generate_content(
+                prompt, request_options={'timeout': upstream_timeout(deadline)}
+            )
+            metrics.observe_upstream(profile or DEFAULT_PROFILE, start)
             
             if response and response.text:
-                logger.info("✅ Gemini response generated successfully")
+                logger.debug("✅ Gemini response generated successfully")
                 return response.text.strip()
             else:
                 logger.warning("Gemini returned empty response")
                 return None
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
+            self._check_deadline(deadline, e)
+            logger.error(f"❌ Error generating response: {e}")
+            return None
+
+    @staticmethod
+    def _check_deadline(deadline: Optional[float], error: Exception) -> None:
+        """Report an upstream failure as DeadlineExceeded when the deadline is what cut it short"""
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceeded("Request deadline exceeded") from error
+
+    def _generate_with_pool(self, prompt: str, deadline: Optional[float] = None,
+                            profile: Optional[str] = None) -> Optional[str]:
+        """Generate through the multi-key upstream pool"""
+        if not prompt or len(prompt.strip()) == 0:
+            logger.error("Empty prompt provided")
+            return None
+
+        try:
+            start = time.perf_counter()
+            text = self.pool.generate(build_payload(prompt, self._rest_generation_config(profile)), deadline)
+            metrics.observe_upstream(profile or DEFAULT_PROFILE, start)
+        except UpstreamError as e:
             logger.error(f"❌ Error generating response: {e}")
             return None
 
+        if text and text.strip():
+            logger.debug("✅ Gemini response generated successfully")
+            return text.strip()
+        logger.warning("Gemini returned empty response")
+        return None
+
+    def stream_response(self, prompt: str, deadline: Optional[float] = None,
+                        profile: Optional[str] = None) -> Iterator[str]:
+        """Stream response text from Gemini chunk by chunk as it is generated"""
+        self._wait_init(deadline)
+        if self.is_available() and prompt and prompt.strip():
+            self._admit(prompt, deadline, profile)
+
+        if self.pool is not None and prompt and prompt.strip():
+            yield from self._stream_with_pool(prompt, deadline, profile)
+            return
+
+        if not self.model:
+            logger.error("Gemini model not available")
+            return
+
+        if not prompt or len(prompt.strip()) == 0:
+            logger.error("Empty prompt provided")
+            return
+
+        start = time.perf_counter()
+        first_token_at = None
+        try:
+            response = self._model_for(profile).generate_content(
+                prompt, stream=True, request_options={'timeout': upstream_timeout(deadline)}
+            )
+            for chunk in response:
+                text = chunk.text
+                if not text:
+                    continue
+                remaining(deadline)
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    metrics.observe('upstream_first_token', start)
+                    logger.info(f"⚡ Gemini time to first token: {(first_token_at - start) * 1000:.0f} ms")
+                yield text
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            self._check_deadline(deadline, e)
+            logger.error(f"❌ Error streaming response: {e}")
+            raise
+
+        if first_token_at is None:
+            logger.warning("Gemini returned empty stream")
+        else:
+            logger.info(f"✅ Gemini stream completed in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def _stream_with_pool(self, prompt: str, deadline: Optional[float] = None,
+                          profile: Optional[str] = None) -> Iterator[str]:
+        """Stream through the multi-key upstream pool, logging time to first token"""
+        start = time.perf_counter()
+        first_token_at = None
+        try:
+            for text in self.pool.stream(build_payload(prompt, self._rest_generation_config(profile)), deadline):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    metrics.observe('upstream_first_token', start)
+                    logger.info(f"⚡ Gemini time to first token: {(first_token_at - start) * 1000:.0f} ms")
+                yield text
+        except UpstreamError as e:
+            logger.error(f"❌ Error streaming response: {e}")
+            raise
+
     def get_status(self) -> Dict[str, Any]:
         """Get client status information"""
-        return {
+        status = {
             'available': self.is_available(),
+            'state': self.get_state(),
+            'init_ms': round(self.init_seconds * 1000) if self.init_seconds is not None else None,
             'model': self.model_name,
             'type': 'gemini_1_5_flash',
-            'api_key_set': bool(Config.GEMINI_API_KEY)
+            'api_key_set': bool(Config.GEMINI_API_KEYS)
+        }
+        if self.pool is not None:
+            status['pool'] = self.pool.get_status()
+        status['quota'] = self.limiter.get_stats()
+        latency = metrics.upstream_summary()
+        status['profiles'] = {
+            name: {'max_output_tokens': profile['max_output_tokens'], 'temperature': profile['temperature'],
+                   **latency.get(name, {})}
+            for name, profile in PROFILES.items()
+        }
+        return status
+
+class AsyncGeminiClient(GeminiClient):
+    """Asyncio Gemini client with a bounded number of in-flight upstream calls"""
+
+    def __init__(self, background: bool = Config.BACKGROUND_INIT):
+        super().__init__(background)
+        self.max_concurrency = Config.ASYNC_MAX_CONCURRENT_UPSTREAM
+        self.slot_timeout = Config.ASYNC_SLOT_TIMEOUT
+        self.in_flight = 0
+        self.rejected = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        # Quota waits block, so queued callers park on these threads; the queue bounds their number
+        # Pool calls use blocking HTTP; give them one thread per upstream slot instead of the
+        # loop's default executor, which is sized by CPU count
+        self._upstream_workers = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                    thread_name_prefix='upstream')
+        self._quota_waiters = ThreadPoolExecutor(max_workers=max(1, Config.RATE_LIMIT_QUEUE_SIZE),
+                                                 thread_name_prefix='quota')
+
+    async def _wait_init_async(self, deadline: Optional[float] = None) -> None:
+        """Like _wait_init, on a worker thread so the event loop keeps serving"""
+        if not self._ready.is_set():
+            await asyncio.get_running_loop().run_in_executor(self._quota_waiters, self._wait_init, deadline)
+
+    async def _admit_async(self, prompt: str, deadline: Optional[float] = None,
+                           profile: Optional[str] = None) -> None:
+        """Async quota admission: immediate when there is room, else wait off the event loop"""
+        tokens, priority = self._quota_cost(prompt, profile)
+        # A take from the shared store is a socket round trip, so that one always goes to a waiter thread
+        if self.limiter.shared is None and self.limiter.try_acquire(tokens):
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._quota_waiters, self._admit, prompt, deadline, profile)
+
+    async def _acquire_slot(self) -> None:
+        """Wait for an upstream slot, failing fast once the deadline passes"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.slot_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"⏳ Upstream busy: {self.in_flight} calls in flight, request rejected")
+            raise UpstreamBusyError(retry_after=max(1.0, self.slot_timeout))
+        self.in_flight += 1
+
+    def _release_slot(self) -> None:
+        """Return an upstream slot"""
+        self.in_flight -= 1
+        self._slots.release()
+
+    async def generate_response_async(self, prompt: str, deadline: Optional[float] = None,
+                                      profile: Optional[str] = None) -> Optional[str]:
+        """Generate a response without blocking the event loop"""
+        await self._wait_init_async(deadline)
+        if not self.model and self.pool is None:
+            logger.error("Gemini model not available")
+            return None
+
+        if not prompt or len(prompt.strip()) == 0:
+            logger.error("Empty prompt provided")
+            return None
+
+        await self._admit_async(prompt, deadline, profile)
+
+        if self.pool is not None:
+            await self._acquire_slot()
+            try:
+                # The worker thread enforces the deadline itself through its HTTP timeouts
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._upstream_workers, self._generate_with_pool,
+                                                  prompt, deadline, profile)
+            finally:
+                self._release_slot()
+
+        await self._acquire_slot()
+        try:
+            start = time.perf_counter()
+            response = await asyncio.wait_for(
+                self._model_for(profile).generate_content_async(
+                    prompt, request_options={'timeout': upstream_timeout(deadline)}
+                ),
+                timeout=remaining(deadline)
+            )
+            metrics.observe_upstream(profile or DEFAULT_PROFILE, start)
+
+            if response and response.text:
+                logger.debug("✅ Gemini response generated successfully")
+                return response.text.strip()
+            else:
+                logger.warning("Gemini returned empty response")
+                return None
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            self._check_deadline(deadline, e)
+            logger.error(f"❌ Error generating response: {e}")
+            return None
+        finally:
+            self._release_slot()
+
+    async def stream_response_async(self, prompt: str, deadline: Optional[float] = None,
+                                    profile: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream response text chunk by chunk without blocking the event loop"""
+        await self._wait_init_async(deadline)
+        if not self.model and self.pool is None:
+            logger.error("Gemini model not available")
+            return
+
+        if not prompt or len(prompt.strip()) == 0:
+            logger.error("Empty prompt provided")
+            return
+
+        await self._admit_async(prompt, deadline, profile)
+
+        if self.pool is not None:
+            # The pool streams over blocking HTTP, so pull each chunk on a worker thread
+            await self._acquire_slot()
+            chunks = self._stream_with_pool(prompt, deadline, profile)
+            end = object()
+            try:
+                loop = asyncio.get_running_loop()
+                while True:
+                    text = await loop.run_in_executor(self._upstream_workers, next, chunks, end)
+                    if text is end:
+                        break
+                    yield text
+            finally:
+                chunks.close()
+                self._release_slot()
+            return
+
+        await self._acquire_slot()
+        start = time.perf_counter()
+        first_token_at = None
+        try:
+            response = await self._model_for(profile).generate_content_async(
+                prompt, stream=True, request_options={'timeout': upstream_timeout(deadline)}
+            )
+            async for chunk in response:
+                text = chunk.text
+                if not text:
+                    continue
+                remaining(deadline)
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    metrics.observe('upstream_first_token', start)
+                    logger.info(f"⚡ Gemini time to first token: {(first_token_at - start) * 1000:.0f} ms")
+                yield text
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            self._check_deadline(deadline, e)
+            logger.error(f"❌ Error streaming response: {e}")
+            raise
+        finally:
+            self._release_slot()
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get client status including upstream concurrency"""
+        status = super().get_status()
+        status['concurrency'] = {
+            'max_in_flight': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'slot_timeout': self.slot_timeout,
+            'rejected': self.rejected
         }
+        return status
@@ -0,0 +1,326 @@
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+from config import Config
+from language import detect_language
+
+logger = logging.getLogger(__name__)
+
+# Zero-width characters that Telugu keyboards insert between conjunct parts
+_ZERO_WIDTH = dict.fromkeys(map(ord, '\u200b\u200c\u200d\u2060\ufeff'))
+
+# Telugu dependent signs: candrabindu/anusvara/visarga, nukta, vowel signs,
+# virama, length marks and vocalic vowel signs
+_TELUGU_SIGNS = frozenset(
+    [chr(cp) for cp in range(0x0C00, 0x0C05)]
+    + ['\u0c3c']
+    + [chr(cp) for cp in range(0x0C3E, 0x0C57)]
+    + ['\u0c62', '\u0c63']
+)
+_TELUGU_NUKTA = '\u0c3c'
+
+
+def _is_telugu_base(char: str) -> bool:
+    """Check if a character can carry a Telugu dependent sign"""
+    return '\u0c05' <= char <= '\u0c39' or '\u0c58' <= char <= '\u0c61'
+
+
+def normalize_question(text: str) -> str:
+    """Normalize a user question into a stable cache key
+
+    Applies NFC, removes zero-width joiners, drops orphaned or repeated
+    Telugu vowel signs, case folds and collapses punctuation/whitespace.
+    """
+    if not text:
+        return ''
+
+    text = unicodedata.normalize('NFC', text).translate(_ZERO_WIDTH)
+
+    chars = []
+    prev = ''
+    for char in text:
+        if char in _TELUGU_SIGNS:
+            # Skip stray nuktas, signs without a base letter and doubled signs
+            if char == _TELUGU_NUKTA or char == prev:
+                continue
+            if not (_is_telugu_base(prev) or prev in _TELUGU_SIGNS):
+                continue
+        elif unicodedata.category(char)[0] in ('P', 'S'):
+            char = ' '
+        chars.append(char)
+        prev = char
+
+    return ' '.join(''.join(chars).casefold().split())
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with per-entry expiry and a memory cap"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[str, Tuple[float, Dict[str, Any], int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_size(key: str, value: Dict[str, Any]) -> int:
+        """Approximate memory footprint of a cache entry"""
+        return sys.getsizeof(key) + sum(sys.getsizeof(v) for v in value.values())
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a live entry and mark it as recently used"""
+        entry = self.entry(key)
+        return entry[0] if entry is not None else None
+
+    def entry(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Like get, but along with the expiry time"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, size = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self.total_bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return value, expires_at
+
+    def set(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        """Store an entry, evicting least recently used ones when over limits"""
+        size = self._entry_size(key, value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[2]
+            self._entries[key] = (expires_at, value, size)
+            self.total_bytes += size
+
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self.total_bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCacheBackend:
+    """SQLite-backed cache so answers survive restarts"""
+
+    name = 'disk'
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS answers ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+            'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS answers_lru ON answers (accessed_at)')
+        conn.commit()
+        return conn
+
+    def reopen(self) -> None:
+        """Open a fresh connection; SQLite connections must not be shared across fork"""
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return a live entry from disk along with its expiry time"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM answers WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute('DELETE FROM answers WHERE key = ?', (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute('UPDATE answers SET accessed_at = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        """Persist an entry and trim the table to the entry limit"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO answers (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), expires_at, time.time())
+            )
+            cursor = self._conn.execute(
+                'DELETE FROM answers WHERE key IN ('
+                'SELECT key FROM answers ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Drop all entries"""
+        with self._lock:
+            self._conn.execute('DELETE FROM answers')
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM answers').fetchone()[0]
+
+
+class AnswerCache:
+    """Answer cache keyed on normalized questions, with optional shared and disk tiers
+
+    The shared tier is the store launcher.py runs for its workers (see
+    shared_store.SharedStore), so an answer generated by one worker is
+    served by all of them.
+    """
+
+    def __init__(self, memory: Optional[MemoryCacheBackend] = None,
+                 disk: Optional[DiskCacheBackend] = None,
+                 ttl_seconds: int = Config.CACHE_TTL_SECONDS,
+                 enabled: bool = True,
+                 shared=None):
+        self.memory = memory or MemoryCacheBackend(Config.CACHE_MAX_ENTRIES, Config.CACHE_MAX_BYTES)
+        self.shared = shared
+        self.disk = disk
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.disk_hits = 0
+
+    @classmethod
+    def from_config(cls, shared=None) -> 'AnswerCache':
+        """Build the cache described by Config, on top of the shared store if there is one"""
+        disk = None
+        if Config.CACHE_ENABLED and Config.CACHE_DISK_PATH:
+            try:
+                disk = DiskCacheBackend(Config.CACHE_DISK_PATH, Config.CACHE_DISK_MAX_ENTRIES)
+                logger.info(f"✅ Answer cache persisted at {Config.CACHE_DISK_PATH}")
+            except sqlite3.Error as e:
+                logger.error(f"❌ Failed to open answer cache on disk: {e}")
+        return cls(disk=disk, enabled=Config.CACHE_ENABLED, shared=shared)
+
+    @staticmethod
+    def make_key(user_message: str, language: Optional[str] = None) -> str:
+        """Build the cache key for a question: language label (detected unless given) plus normalized text"""
+        return f"{language or detect_language(user_message)}|{normalize_question(user_message)}"
+
+    def get(self, user_message: str, language: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Look up a cached response for a question"""
+        if not self.enabled:
+            return None
+
+        key = self.make_key(user_message, language)
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            try:
+                entry = self.shared.get(key)
+            except OSError as e:
+                logger.warning(f"Answer cache shared read failed: {e}")
+                entry = None
+            if entry is not None:
+                value, expires_at = entry
+                self.shared_hits += 1
+                self.memory.set(key, value, expires_at)
+        if value is None and self.disk is not None:
+            try:
+                entry = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Answer cache disk read failed: {e}")
+                entry = None
+            if entry is not None:
+                value, expires_at = entry
+                self.disk_hits += 1
+                self.memory.set(key, value, expires_at)
+
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, user_message: str, response: Dict[str, Any]) -> None:
+        """Store a successful response for a question"""
+        if not self.enabled:
+            return
+
+        key = self.make_key(user_message)
+        if key.endswith('|'):
+            return
+        expires_at = time.time() + self.ttl_seconds
+        self.memory.set(key, response, expires_at)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, response, expires_at)
+            except OSError as e:
+                logger.warning(f"Answer cache shared write failed: {e}")
+        if self.disk is not None:
+            try:
+                self.disk.set(key, response, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"Answer cache disk write failed: {e}")
+
+    def clear(self) -> None:
+        """Drop all cached answers"""
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def reopen(self) -> None:
+        """Reopen the disk tier in a freshly forked worker"""
+        if self.disk is not None:
+            self.disk.reopen()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': len(self.memory),
+            'bytes': self.memory.total_bytes,
+            'evictions': self.memory.evictions,
+            'shared': {
+                'path': self.shared.path,
+                'hits': self.shared_hits,
+            } if self.shared is not None else None,
+            'disk': {
+                'path': self.disk.path,
+                'hits': self.disk_hits,
+                'evictions': self.disk.evictions,
+            } if self.disk is not None else None
+        }
@@ -1,28 +1,195 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+import json
 import logging
+import math
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from config import Config
+from deadlines import deadline_from_header
+from generation_profiles import PROFILES
+from job_queue import PENDING_STATES, callback_allowed
+from log_pipeline import begin_request, configure_logging, end_request, get_stats as get_logging_stats
+from metrics import metrics
+from profiler import SamplingProfiler, SlowRequestRecorder, admin_allowed
 from response_handler import ResponseHandler
-from templates import HTMLTemplate
+from prompts import SystemPrompts
+from rate_limiter import InboundLimiter, RateLimitExceeded, client_address
+from static_assets import StaticAssets
 
 # Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+def validate_chat_data(data) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Validate a decoded chat payload, returning (message, None) or (None, error body)"""
+    if not data or not isinstance(data, dict):
+        return None, {
+            'error': 'Invalid JSON data',
+            'status': 'error'
+        }
+
+    user_message = data.get('message', '')
+    if isinstance(user_message, str):
+        user_message = user_message.strip()
+
+    if not user_message or not isinstance(user_message, str):
+        return None, {
+            'error': 'దయచేసి మీ ప్రశ్న టైప్ చేయండి (Please type your question)',
+            'status': 'error'
+        }
+
+    # Validate message length
+    if len(user_message) > 500:
+        return None, {
+            'error': 'ప్రశ్న చాలా పెద్దది. దయచేసి చిన్నగా అడగండి (Question too long. Please keep it shorter)',
+            'status': 'error'
+        }
+
+    error = profile_error(data)
+    if error:
+        return None, error
+
+    return user_message, None
+
+def profile_error(data) -> Optional[Dict[str, Any]]:
+    """Error body when a payload names an unknown generation profile"""
+    profile = data.get('profile')
+    if profile is None or profile in PROFILES:
+        return None
+    return {
+        'error': f"Unknown profile (choose one of: {', '.join(PROFILES)})",
+        'status': 'error'
+    }
+
+def callback_error(data) -> Optional[Dict[str, Any]]:
+    """Error body when a job payload names a webhook outside JOB_CALLBACK_HOSTS"""
+    url = data.get('callback_url')
+    if url is None or (isinstance(url, str) and callback_allowed(url)):
+        return None
+    return {
+        'error': f"callback_url must be an http(s) URL on {', '.join(Config.JOB_CALLBACK_HOSTS)}",
+        'status': 'error'
+    }
+
+def job_reply(job: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """Body and headers describing a chat job; pending jobs carry a poll hint"""
+    poll = f"/chat/jobs/{job['job_id']}"
+    headers = {'Location': poll}
+    if job['state'] in PENDING_STATES:
+        headers['Retry-After'] = str(max(1, round(Config.JOB_POLL_INTERVAL)))
+    return {**job, 'poll': poll, 'status': 'success'}, headers
+
+def profile_seconds(value: Optional[str]) -> Optional[float]:
+    """Duration of an /admin/profile run from its ?seconds= argument (default 10); None if invalid"""
+    try:
+        seconds = float(value) if value is not None else 10.0
+    except ValueError:
+        return None
+    return seconds if math.isfinite(seconds) and seconds > 0 else None
+
+def requested_profile(data) -> Optional[str]:
+    """Generation profile named in a chat or batch payload; None lets the server choose"""
+    return (data.get('profile') if isinstance(data, dict) else None) or None
+
+def session_id_from(header: Optional[str], data) -> Optional[str]:
+    """Conversation id from the X-Session-Id header or the session_id field, if any"""
+    session_id = header or (data.get('session_id') if isinstance(data, dict) else None)
+    return str(session_id)[:128] if session_id else None
+
+def validate_batch_data(data) -> Tuple[Optional[List[Optional[str]]], Optional[List[Optional[Dict[str, Any]]]],
+                                       Optional[Dict[str, Any]]]:
+    """Validate a batch payload with the /chat rules applied to each item
+
+    Returns (messages, item_errors, None), where an invalid item has a None
+    message and an error body, or (None, None, error body) for a bad batch.
+    """
+    questions = data.get('questions') if isinstance(data, dict) else None
+    if not isinstance(questions, list) or not questions:
+        return None, None, {
+            'error': 'questions must be a non-empty list',
+            'status': 'error'
+        }
+
+    if len(questions) > Config.BATCH_MAX_ITEMS:
+        return None, None, {
+            'error': f'Too many questions (max {Config.BATCH_MAX_ITEMS} per batch)',
+            'status': 'error'
+        }
+
+    # One profile applies to the whole batch
+    error = profile_error(data)
+    if error:
+        return None, None, error
+
+    messages, item_errors = [], []
+    for item in questions:
+        # Items may be plain strings or objects shaped like a /chat body
+        message, error = validate_chat_data(item if isinstance(item, dict) else {'message': item})
+        messages.append(message)
+        item_errors.append({**error, 'source': 'validation_error'} if error else None)
+    return messages, item_errors, None
+
+def batch_items(messages: List[Optional[str]], item_errors: List[Optional[Dict[str, Any]]],
+                answered: Iterable[Tuple[int, Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+    """Tag batch results with their input index: invalid items first, then answers as they complete"""
+    for index, error in enumerate(item_errors):
+        if error:
+            yield {'index': index, **error}
+    valid = [index for index, message in enumerate(messages) if message is not None]
+    for position, result in answered:
+        yield {'index': valid[position], **result}
+
+def wants_ndjson(data: Dict[str, Any], accept: Optional[str]) -> bool:
+    """Check if a batch client asked for results streamed as NDJSON"""
+    return bool(data.get('stream')) or 'application/x-ndjson' in (accept or '')
+
 class GovernmentHelperApp:
     """Main Flask application class with enhanced error handling"""
 
-    def __init__(self):
-        self.app = Flask(__name__)
+    def __init__(self, start_jobs: bool = True):
+        # Static files come from StaticAssets, so Flask's own /static route is disabled
+        self.app = Flask(__name__, static_folder=None)
+        self.static_assets = StaticAssets()
         self.response_handler = ResponseHandler()
+        self.inbound_limiter = InboundLimiter(self.response_handler.shared)
+        # Both None unless enabled, leaving nothing on the request path
+        self.profiler = SamplingProfiler.from_config()
+        self.slow_requests = SlowRequestRecorder.from_config()
+        self._setup_request_logging()
         self._setup_routes()
+        # launcher.py starts job workers in each forked worker instead
+        if start_jobs and self.response_handler.jobs is not None:
+            self.response_handler.jobs.start()
         
         # Log startup status
         status = self.response_handler.ai_client.get_status()
         logger.info(f"🚀 Application started with AI status: {status}")
 
+    def _setup_request_logging(self):
+        """Give every request an id (X-Request-Id) and an access log line once it completes"""
+
+        @self.app.before_request
+        def open_request_log():
+            g.request_log = begin_request(request.headers.get('X-Request-Id'))
+            if self.slow_requests is not None:
+                self.slow_requests.begin(g.request_log)
+
+        @self.app.after_request
+        def close_request_log(response):
+            context = g.get('request_log')
+            if context is None:
+                return response
+            response.headers['X-Request-Id'] = context.request_id
+            method, path, status = request.method, request.path, response.status_code
+            # A streamed body is still being produced here, so log when the server closes it
+            response.call_on_close(lambda: self._close_request_log(context, method, path, status))
+            return response
+
+    def _close_request_log(self, context, method: str, path: str, status: int) -> None:
+        end_request(context, method, path, status)
+        if self.slow_requests is not None:
+            self.slow_requests.end(context, method, path, status)
+
     def _setup_routes(self):
         """Setup Flask routes"""
 
@@ -30,16 +197,104 @@ class GovernmentHelperApp:
         def home():
             """Serve the main interface"""
             try:
-                return render_template_string(HTMLTemplate.MAIN_TEMPLATE)
+                return self._asset_response(self.static_assets.index)
             except Exception as e:
                 logger.error(f"Error serving home page: {e}")
                 return f"Error loading application: {e}", 500
 
+        @self.app.route('/static/<name>')
+        def static_asset(name):
+            """Serve fingerprinted CSS/JS with long-lived caching"""
+            asset = self.static_assets.assets.get(name)
+            if asset is None:
+                return 'Not found', 404
+            return self._asset_response(asset)
+
         @self.app.route('/chat', methods=['POST'])
         def chat():
             """Handle chat messages with comprehensive error handling"""
+            request_start = metrics.request_started()
+            deadline = self._deadline()
+            source = None
+            try:
+                stage_start = time.perf_counter()
+                user_message, error = self._parse_chat_request()
+                metrics.observe('parse', stage_start)
+                if error:
+                    source = 'validation_error'
+                    return error
+                session_id = self._session_id()
+                self._check_inbound_limits(session_id)
+
+                # Get response from handler
+                result = self.response_handler.get_response(user_message, session_id, deadline,
+                                                            requested_profile(request.get_json()))
+                source = result['source']
+                
+                # Return success response
+                stage_start = time.perf_counter()
+                response = jsonify(result)
+                metrics.observe('serialize', stage_start)
+                return response
+
+            except RateLimitExceeded as e:
+                source = 'rate_limited'
+                return self._rate_limited_response(e)
+            except Exception as e:
+                source = 'server_error'
+                logger.error(f"Error in chat endpoint: {e}")
+                return jsonify({
+                    'error': 'దయచేసి మళ్ళీ ప్రయత్నించండి (Please try again)',
+                    'status': 'error',
+                    'details': str(e) if Config.DEBUG else None
+                }), 500
+            finally:
+                metrics.request_finished(request_start, source)
+
+        @self.app.route('/chat/stream', methods=['POST'])
+        def chat_stream():
+            """Stream chat responses as Server-Sent Events"""
+            request_start = metrics.request_started()
+            deadline = self._deadline()
+            try:
+                stage_start = time.perf_counter()
+                user_message, error = self._parse_chat_request()
+                metrics.observe('parse', stage_start)
+                if error:
+                    metrics.request_finished(request_start, 'validation_error')
+                    return error
+                session_id = self._session_id()
+                self._check_inbound_limits(session_id)
+
+                events = self.response_handler.stream_response(user_message, session_id, deadline,
+                                                               requested_profile(request.get_json()))
+                # The request is closed by _format_sse once the stream ends
+                return Response(
+                    stream_with_context(self._format_sse(events, request_start)),
+                    mimetype='text/event-stream',
+                    headers={
+                        'Cache-Control': 'no-cache',
+                        'X-Accel-Buffering': 'no'
+                    }
+                )
+
+            except RateLimitExceeded as e:
+                metrics.request_finished(request_start, 'rate_limited')
+                return self._rate_limited_response(e)
+            except Exception as e:
+                metrics.request_finished(request_start, 'server_error')
+                logger.error(f"Error in chat stream endpoint: {e}")
+                return jsonify({
+                    'error': 'దయచేసి మళ్ళీ ప్రయత్నించండి (Please try again)',
+                    'status': 'error',
+                    'details': str(e) if Config.DEBUG else None
+                }), 500
+
+        @self.app.route('/chat/batch', methods=['POST'])
+        def chat_batch():
+            """Answer a list of questions, in input order or streamed as NDJSON"""
+            deadline = self._deadline()
             try:
-                # Validate request
                 if not request.is_json:
                     return jsonify({
                         'error': 'Content-Type must be application/json',
@@ -47,41 +302,113 @@ class GovernmentHelperApp:
                     }), 400
 
                 data = request.get_json()
-                if not data:
-                    return jsonify({
-                        'error': 'Invalid JSON data',
-                        'status': 'error'
-                    }), 400
+                messages, item_errors, error = validate_batch_data(data)
+                if error:
+                    return jsonify(error), 400
+                self._check_inbound_limits(self._session_id())
 
-                user_message = data.get('message', '').strip()
-                
-                if not user_message:
-                    return jsonify({
-                        'error': 'దయచేసి మీ ప్రశ్న టైప్ చేయండి (Please type your question)',
-                        'status': 'error'
-                    }), 400
+                answered = self.response_handler.get_batch_responses([m for m in messages if m is not None],
+                                                                     deadline, requested_profile(data))
+                items = batch_items(messages, item_errors, answered)
+                if wants_ndjson(data, request.headers.get('Accept')):
+                    return Response(
+                        stream_with_context(self._format_ndjson(items)),
+                        mimetype='application/x-ndjson',
+                        headers={'X-Accel-Buffering': 'no'}
+                    )
 
-                # Validate message length
-                if len(user_message) > 500:
-                    return jsonify({
-                        'error': 'ప్రశ్న చాలా పెద్దది. దయచేసి చిన్నగా అడగండి (Question too long. Please keep it shorter)',
-                        'status': 'error'
-                    }), 400
+                results = sorted(items, key=lambda item: item['index'])
+                return jsonify({
+                    'results': results,
+                    'count': len(results),
+                    'status': 'success'
+                })
 
-                # Get response from handler
-                result = self.response_handler.get_response(user_message)
-                
-                # Return success response
-                return jsonify(result)
+            except RateLimitExceeded as e:
+                return self._rate_limited_response(e)
+            except Exception as e:
+                logger.error(f"Error in chat batch endpoint: {e}")
+                return jsonify({
+                    'error': 'దయచేసి మళ్ళీ ప్రయత్నించండి (Please try again)',
+                    'status': 'error',
+                    'details': str(e) if Config.DEBUG else None
+                }), 500
+
+        @self.app.route('/chat/jobs', methods=['POST'])
+        def submit_job():
+            """Queue a question and return its job id at once; poll for the answer or get a webhook"""
+            jobs = self.response_handler.jobs
+            if jobs is None:
+                return jsonify({'error': 'Job queue disabled', 'status': 'error'}), 404
+            try:
+                user_message, error = self._parse_chat_request()
+                if error:
+                    return error
+                data = request.get_json()
+                error = callback_error(data)
+                if error:
+                    return jsonify(error), 400
+                session_id = self._session_id()
+                self._check_inbound_limits(session_id)
+
+                job = jobs.submit(user_message, session_id, requested_profile(data), data.get('callback_url'))
+                body, headers = job_reply(job)
+                return jsonify(body), 202, headers
 
+            except RateLimitExceeded as e:
+                return self._rate_limited_response(e)
             except Exception as e:
-                logger.error(f"Error in chat endpoint: {e}")
+                logger.error(f"Error in job submit endpoint: {e}")
                 return jsonify({
                     'error': 'దయచేసి మళ్ళీ ప్రయత్నించండి (Please try again)',
                     'status': 'error',
                     'details': str(e) if Config.DEBUG else None
                 }), 500
 
+        @self.app.route('/chat/jobs/<job_id>')
+        def get_job(job_id):
+            """Poll a chat job; the answer is under 'result' once its state is done or failed"""
+            jobs = self.response_handler.jobs
+            if jobs is None:
+                return jsonify({'error': 'Job queue disabled', 'status': 'error'}), 404
+            job = jobs.get(job_id)
+            if job is None:
+                return jsonify({'error': 'Job not found', 'status': 'error'}), 404
+            body, headers = job_reply(job)
+            return jsonify(body), 200, headers
+
+        @self.app.route('/metrics')
+        def get_metrics():
+            """Prometheus-style latency histograms and counters"""
+            if not metrics.enabled:
+                return 'Metrics disabled', 404
+            return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+        @self.app.route('/admin/profile')
+        def admin_profile():
+            """Sample every thread's stack for ?seconds=N; returns collapsed stacks for flamegraphs"""
+            if self.profiler is None:
+                return 'Profiler disabled', 404
+            if not admin_allowed(request.headers.get('X-Admin-Token')):
+                return 'Forbidden', 403
+            seconds = profile_seconds(request.args.get('seconds'))
+            if seconds is None:
+                return 'seconds must be a positive number', 400
+            result = self.profiler.profile(seconds)
+            if result is None:
+                return 'A profile is already running', 409
+            stacks, samples = result
+            return Response(stacks, mimetype='text/plain', headers={'X-Profile-Samples': str(samples)})
+
+        @self.app.route('/admin/slow-requests')
+        def admin_slow_requests():
+            """Recent requests slower than SLOW_REQUEST_MS with stage timings and a stack snapshot"""
+            if self.slow_requests is None:
+                return 'Slow request recording disabled', 404
+            if not admin_allowed(request.headers.get('X-Admin-Token')):
+                return 'Forbidden', 403
+            return jsonify({**self.slow_requests.get_stats(), 'requests': self.slow_requests.get_entries()})
+
         @self.app.route('/health')
         def health_check():
             """Health check endpoint"""
@@ -89,6 +416,8 @@ class GovernmentHelperApp:
                 status = self.response_handler.ai_client.get_status()
                 return jsonify({
                     'status': 'healthy',
+                    'state': 'ready' if self.response_handler.is_ready() else 'warming',
+                    'components': self.response_handler.readiness(),
                     'timestamp': status,
                     'ai_available': status['available'],
                     'model': status['model'],
@@ -101,6 +430,13 @@ class GovernmentHelperApp:
                     'error': str(e)
                 }), 500
 
+        @self.app.route('/ready')
+        def readiness_check():
+            """Readiness probe: 503 until background warm-up has finished"""
+            ready = self.response_handler.is_ready()
+            body = jsonify({'ready': ready, 'components': self.response_handler.readiness()})
+            return (body, 200) if ready else (body, 503, {'Retry-After': '1'})
+
         @self.app.route('/status')
         def get_status():
             """Get detailed application status"""
@@ -110,9 +446,34 @@ class GovernmentHelperApp:
                     'application': 'Government Helper',
                     'version': '3.0.0',
                     'ai_client': ai_status,
+                    'cache': self.response_handler.cache.get_stats(),
+                    'coalescing': self.response_handler.get_coalescing_stats(),
+                    'prompts': SystemPrompts.stats.get_stats(),
+                    'knowledge_base': (self.response_handler.knowledge_base.get_stats()
+                                       if self.response_handler.knowledge_base else None),
+                    'faq': (self.response_handler.faq.get_stats()
+                            if self.response_handler.faq else None),
+                    'routing': self.response_handler.get_routing_stats(),
+                    'prefetch': self.response_handler.get_prefetch_stats(),
+                    'failover': self.response_handler.get_failover_stats(),
+                    'rate_limits': self.inbound_limiter.get_stats(),
+                    'sessions': (self.response_handler.sessions.get_stats()
+                                 if self.response_handler.sessions else None),
+                    'logging': get_logging_stats(),
+                    'profiling': {
+                        'profiler': self.profiler.get_stats() if self.profiler else None,
+                        'slow_requests': self.slow_requests.get_stats() if self.slow_requests else None
+                    },
+                    'jobs': (self.response_handler.jobs.get_stats()
+                             if self.response_handler.jobs else None),
                     'endpoints': {
                         'chat': '/chat',
+                        'chat_stream': '/chat/stream',
+                        'chat_batch': '/chat/batch',
+                        'chat_jobs': '/chat/jobs',
+                        'metrics': '/metrics',
                         'health': '/health',
+                        'ready': '/ready',
                         'status': '/status'
                     }
                 })
@@ -120,6 +481,74 @@ class GovernmentHelperApp:
                 logger.error(f"Error getting status: {e}")
                 return jsonify({'error': str(e)}), 500
 
+    @staticmethod
+    def _asset_response(asset):
+        """Send a precompressed asset, or 304 when the browser copy is current"""
+        status, body, headers = StaticAssets.respond(
+            asset, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+        return Response(body, status=status, headers=headers)
+
+    @staticmethod
+    def _parse_chat_request():
+        """Validate a chat request, returning (message, None) or (None, error response)"""
+        if not request.is_json:
+            return None, (jsonify({
+                'error': 'Content-Type must be application/json',
+                'status': 'error'
+            }), 400)
+
+        user_message, error = validate_chat_data(request.get_json())
+        if error:
+            return None, (jsonify(error), 400)
+        return user_message, None
+
+    @staticmethod
+    def _deadline() -> float:
+        """Deadline of the current request from its X-Request-Timeout header (seconds)"""
+        return deadline_from_header(request.headers.get('X-Request-Timeout'))
+
+    @staticmethod
+    def _session_id() -> Optional[str]:
+        """Conversation id of the current request"""
+        return session_id_from(request.headers.get('X-Session-Id'), request.get_json(silent=True))
+
+    def _check_inbound_limits(self, session_id: Optional[str]) -> None:
+        """Apply per-IP and per-session limits; raises RateLimitExceeded"""
+        self.inbound_limiter.check(
+            client_address(request.remote_addr, request.headers.get('X-Forwarded-For')),
+            session_id
+        )
+
+    @staticmethod
+    def _rate_limited_response(error: RateLimitExceeded):
+        """429 with a Retry-After hint for clients or quota over their limit"""
+        response = jsonify({
+            'error': 'చాలా అభ్యర్థనలు వచ్చాయి. దయచేసి కొద్దిసేపటి తర్వాత మళ్ళీ ప్రయత్నించండి (Too many requests. Please try again shortly)',
+            'status': 'error',
+            'retry_after': error.retry_after_header
+        })
+        response.headers['Retry-After'] = error.retry_after_header
+        return response, 429
+
+    @staticmethod
+    def _format_sse(events, request_start: Optional[float] = None):
+        """Serialize response events into Server-Sent Events frames"""
+        source = None
+        try:
+            for event in events:
+                name = event.pop('event')
+                if name == 'done':
+                    source = event['source']
+                yield f"event: {name}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            metrics.request_finished(request_start, source)
+
+    @staticmethod
+    def _format_ndjson(items):
+        """Serialize batch items as newline-delimited JSON"""
+        for item in items:
+            yield json.dumps(item, ensure_ascii=False) + '\n'
+
     def run(self):
         """Run the Flask application"""
         logger.info(f"🌐 Starting server on {Config.HOST}:{Config.PORT}")
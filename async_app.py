@@ -0,0 +1,495 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from ai_client import AsyncGeminiClient, UpstreamBusyError
+from app import (validate_chat_data, validate_batch_data, wants_ndjson, session_id_from, requested_profile,
+                 callback_error, job_reply, profile_seconds)
+from config import Config
+from deadlines import deadline_from_header
+from log_pipeline import begin_request, end_request, get_stats as get_logging_stats
+from metrics import metrics
+from profiler import SamplingProfiler, SlowRequestRecorder, admin_allowed
+from response_handler import ResponseHandler
+from prompts import SystemPrompts
+from rate_limiter import InboundLimiter, RateLimitExceeded, client_address
+from static_assets import StaticAssets
+
+logger = logging.getLogger(__name__)
+
+class RequestLogMiddleware:
+    """Give every request an id (X-Request-Id) and an access log line once its body is sent"""
+
+    def __init__(self, app, slow_requests: Optional[SlowRequestRecorder] = None):
+        self.app = app
+        self.slow_requests = slow_requests
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        request_id = dict(scope['headers']).get(b'x-request-id')
+        context = begin_request(request_id.decode('latin-1') if request_id else None)
+        if self.slow_requests is not None:
+            self.slow_requests.begin(context)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-request-id', context.request_id.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            end_request(context, scope['method'], scope['path'], status)
+            if self.slow_requests is not None:
+                self.slow_requests.end(context, scope['method'], scope['path'], status)
+
+class AsyncGovernmentHelperApp:
+    """ASGI application with non-blocking Gemini calls and bounded upstream concurrency"""
+
+    def __init__(self, start_jobs: bool = True):
+        self.static_assets = StaticAssets()
+        self.response_handler = ResponseHandler(ai_client=AsyncGeminiClient())
+        self.inbound_limiter = InboundLimiter(self.response_handler.shared)
+        # Both None unless enabled, leaving nothing on the request path
+        self.profiler = SamplingProfiler.from_config()
+        self.slow_requests = SlowRequestRecorder.from_config()
+        self.app = Starlette(debug=Config.DEBUG, routes=self._setup_routes(),
+                             middleware=[Middleware(RequestLogMiddleware, slow_requests=self.slow_requests)])
+        # launcher.py starts job workers in each forked worker instead
+        if start_jobs and self.response_handler.jobs is not None:
+            self.response_handler.jobs.start()
+
+        # Log startup status
+        status = self.response_handler.ai_client.get_status()
+        logger.info(f"🚀 Async application started with AI status: {status}")
+
+    def _setup_routes(self):
+        """Setup ASGI routes mirroring the Flask app"""
+        return [
+            Route('/', self.home),
+            Route('/static/{name}', self.static_asset),
+            Route('/chat', self.chat, methods=['POST']),
+            Route('/chat/stream', self.chat_stream, methods=['POST']),
+            Route('/chat/batch', self.chat_batch, methods=['POST']),
+            Route('/chat/jobs', self.submit_job, methods=['POST']),
+            Route('/chat/jobs/{job_id}', self.get_job),
+            Route('/metrics', self.get_metrics),
+            Route('/admin/profile', self.admin_profile),
+            Route('/admin/slow-requests', self.admin_slow_requests),
+            Route('/health', self.health_check),
+            Route('/ready', self.readiness_check),
+            Route('/status', self.get_status),
+        ]
+
+    async def home(self, request: Request) -> Response:
+        """Serve the main interface"""
+        try:
+            return self._asset_response(request, self.static_assets.index)
+        except Exception as e:
+            logger.error(f"Error serving home page: {e}")
+            return PlainTextResponse(f"Error loading application: {e}", status_code=500)
+
+    async def static_asset(self, request: Request) -> Response:
+        """Serve fingerprinted CSS/JS with long-lived caching"""
+        asset = self.static_assets.assets.get(request.path_params['name'])
+        if asset is None:
+            return PlainTextResponse('Not found', status_code=404)
+        return self._asset_response(request, asset)
+
+    @staticmethod
+    def _asset_response(request: Request, asset) -> Response:
+        """Send a precompressed asset, or 304 when the browser copy is current"""
+        status, body, headers = StaticAssets.respond(
+            asset, request.headers.get('accept-encoding'), request.headers.get('if-none-match'))
+        return Response(body, status_code=status, headers=headers)
+
+    async def chat(self, request: Request) -> Response:
+        """Handle chat messages without holding a thread during the Gemini call"""
+        request_start = metrics.request_started()
+        deadline = deadline_from_header(request.headers.get('x-request-timeout'))
+        source = None
+        try:
+            stage_start = time.perf_counter()
+            user_message, error = await self._parse_chat_request(request)
+            metrics.observe('parse', stage_start)
+            if error:
+                source = 'validation_error'
+                return error
+            session_id = await self._session_id(request)
+            await self._check_inbound_limits(request, session_id)
+
+            result = await self.response_handler.get_response_async(user_message, session_id, deadline,
+                                                                    requested_profile(await request.json()))
+            source = result['source']
+            stage_start = time.perf_counter()
+            response = JSONResponse(result)
+            metrics.observe('serialize', stage_start)
+            return response
+
+        except UpstreamBusyError as e:
+            source = 'upstream_busy'
+            return self._busy_response(e)
+        except RateLimitExceeded as e:
+            source = 'rate_limited'
+            return self._rate_limited_response(e)
+        except Exception as e:
+            source = 'server_error'
+            logger.error(f"Error in chat endpoint: {e}")
+            return JSONResponse({
+                'error': 'దయచేసి మళ్ళీ ప్రయత్నించండి (Please try again)',
+                'status': 'error',
+                'details': str(e) if Config.DEBUG else None
+            }, status_code=500)
+        finally:
+            metrics.request_finished(request_start, source)
+
+    async def chat_stream(self, request: Request) -> Response:
+        """Stream chat responses as Server-Sent Events"""
+        request_start = metrics.request_started()
+        deadline = deadline_from_header(request.headers.get('x-request-timeout'))
+        try:
+            stage_start = time.perf_counter()
+            user_message, error = await self._parse_chat_request(request)
+            metrics.observe('parse', stage_start)
+            if error:
+                metrics.request_finished(request_start, 'validation_error')
+                return error
+            session_id = await self._session_id(request)
+            await self._check_inbound_limits(request, session_id)
+
+            events = self.response_handler.stream_response_async(user_message, session_id, deadline,
+                                                                 requested_profile(await request.json()))
+            # The request is closed by _format_sse once the stream ends
+            return StreamingResponse(
+                self._format_sse(events, request_start),
+                media_type='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'
+                }
+            )
+
+        except RateLimitExceeded as e:
+            metrics.request_finished(request_start, 'rate_limited')
+            return self._rate_limited_response(e)
+        except Exception as e:
+            metrics.request_finished(request_start, 'server_error')
+            logger.error(f"Error in chat stream endpoint: {e}")
+            return JSONResponse({
+                'error': 'దయచేసి మళ్ళీ ప్రయత్నించండి (Please try again)',
+                'status': 'error',
+                'details': str(e) if Config.DEBUG else None
+            }, status_code=500)
+
+    async def chat_batch(self, request: Request) -> Response:
+        """Answer a list of questions, in input order or streamed as NDJSON"""
+        deadline = deadline_from_header(request.headers.get('x-request-timeout'))
+        error = self._content_type_error(request)
+        if error:
+            return error
+        try:
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            messages, item_errors, error = validate_batch_data(data)
+            if error:
+                return JSONResponse(error, status_code=400)
+            await self._check_inbound_limits(request, session_id_from(request.headers.get('x-session-id'), data))
+
+            items = self._batch_items(messages, item_errors, deadline, requested_profile(data))
+            if wants_ndjson(data, request.headers.get('accept')):
+                return StreamingResponse(
+                    self._format_ndjson(items),
+                    media_type='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'}
+                )
+
+            results = sorted([item async for item in items], key=lambda item: item['index'])
+            return JSONResponse({
+                'results': results,
+                'count': len(results),
+                'status': 'success'
+            })
+
+        except RateLimitExceeded as e:
+            return self._rate_limited_response(e)
+        except Exception as e:
+            logger.error(f"Error in chat batch endpoint: {e}")
+            return JSONResponse({
+                'error': 'దయచేసి మళ్ళీ ప్రయత్నించండి (Please try again)',
+                'status': 'error',
+                'details': str(e) if Config.DEBUG else None
+            }, status_code=500)
+
+    async def _batch_items(self, messages, item_errors, deadline: Optional[float] = None,
+                           profile: Optional[str] = None):
+        """Tag batch results with their input index: invalid items first, then answers as they complete"""
+        for index, error in enumerate(item_errors):
+            if error:
+                yield {'index': index, **error}
+        valid = [index for index, message in enumerate(messages) if message is not None]
+        async for position, result in self.response_handler.get_batch_responses_async(
+                [messages[index] for index in valid], deadline, profile):
+            yield {'index': valid[position], **result}
+
+    async def submit_job(self, request: Request) -> Response:
+        """Queue a question and return its job id at once; poll for the answer or get a webhook"""
+        jobs = self.response_handler.jobs
+        if jobs is None:
+            return JSONResponse({'error': 'Job queue disabled', 'status': 'error'}, status_code=404)
+        try:
+            user_message, error = await self._parse_chat_request(request)
+            if error:
+                return error
+            data = await request.json()
+            error = callback_error(data)
+            if error:
+                return JSONResponse(error, status_code=400)
+            session_id = await self._session_id(request)
+            await self._check_inbound_limits(request, session_id)
+
+            # SQLite writes can wait on a busy WAL writer, so they stay off the event loop
+            job = await self.response_handler.run_blocking(jobs.submit, user_message, session_id,
+                                                           requested_profile(data), data.get('callback_url'))
+            body, headers = job_reply(job)
+            return JSONResponse(body, status_code=202, headers=headers)
+
+        except RateLimitExceeded as e:
+            return self._rate_limited_response(e)
+        except Exception as e:
+            logger.error(f"Error in job submit endpoint: {e}")
+            return JSONResponse({
+                'error': 'దయచేసి మళ్ళీ ప్రయత్నించండి (Please try again)',
+                'status': 'error',
+                'details': str(e) if Config.DEBUG else None
+            }, status_code=500)
+
+    async def get_job(self, request: Request) -> Response:
+        """Poll a chat job; the answer is under 'result' once its state is done or failed"""
+        jobs = self.response_handler.jobs
+        if jobs is None:
+            return JSONResponse({'error': 'Job queue disabled', 'status': 'error'}, status_code=404)
+        job = await self.response_handler.run_blocking(jobs.get, request.path_params['job_id'])
+        if job is None:
+            return JSONResponse({'error': 'Job not found', 'status': 'error'}, status_code=404)
+        body, headers = job_reply(job)
+        return JSONResponse(body, headers=headers)
+
+    async def get_metrics(self, request: Request) -> Response:
+        """Prometheus-style latency histograms and counters"""
+        if not metrics.enabled:
+            return PlainTextResponse('Metrics disabled', status_code=404)
+        return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+    async def admin_profile(self, request: Request) -> Response:
+        """Sample every thread's stack for ?seconds=N; returns collapsed stacks for flamegraphs"""
+        if self.profiler is None:
+            return PlainTextResponse('Profiler disabled', status_code=404)
+        if not admin_allowed(request.headers.get('x-admin-token')):
+            return PlainTextResponse('Forbidden', status_code=403)
+        seconds = profile_seconds(request.query_params.get('seconds'))
+        if seconds is None:
+            return PlainTextResponse('seconds must be a positive number', status_code=400)
+        # Sampled from a worker thread, so the event loop keeps serving (and shows up in the profile)
+        result = await asyncio.get_running_loop().run_in_executor(None, self.profiler.profile, seconds)
+        if result is None:
+            return PlainTextResponse('A profile is already running', status_code=409)
+        stacks, samples = result
+        return PlainTextResponse(stacks, headers={'X-Profile-Samples': str(samples)})
+
+    async def admin_slow_requests(self, request: Request) -> Response:
+        """Recent requests slower than SLOW_REQUEST_MS with stage timings and a stack snapshot"""
+        if self.slow_requests is None:
+            return PlainTextResponse('Slow request recording disabled', status_code=404)
+        if not admin_allowed(request.headers.get('x-admin-token')):
+            return PlainTextResponse('Forbidden', status_code=403)
+        return JSONResponse({**self.slow_requests.get_stats(), 'requests': self.slow_requests.get_entries()})
+
+    async def health_check(self, request: Request) -> Response:
+        """Health check endpoint"""
+        try:
+            status = self.response_handler.ai_client.get_status()
+            return JSONResponse({
+                'status': 'healthy',
+                'state': 'ready' if self.response_handler.is_ready() else 'warming',
+                'components': self.response_handler.readiness(),
+                'timestamp': status,
+                'ai_available': status['available'],
+                'model': status['model'],
+                'version': '3.0.0'
+            })
+        except Exception as e:
+            logger.error(f"Error in health check: {e}")
+            return JSONResponse({
+                'status': 'unhealthy',
+                'error': str(e)
+            }, status_code=500)
+
+    async def readiness_check(self, request: Request) -> Response:
+        """Readiness probe: 503 until background warm-up has finished"""
+        ready = self.response_handler.is_ready()
+        body = {'ready': ready, 'components': self.response_handler.readiness()}
+        if ready:
+            return JSONResponse(body)
+        return JSONResponse(body, status_code=503, headers={'Retry-After': '1'})
+
+    async def get_status(self, request: Request) -> Response:
+        """Get detailed application status"""
+        try:
+            ai_status = self.response_handler.ai_client.get_status()
+            return JSONResponse({
+                'application': 'Government Helper',
+                'version': '3.0.0',
+                'server_mode': 'asgi',
+                'ai_client': ai_status,
+                'cache': self.response_handler.cache.get_stats(),
+                'coalescing': self.response_handler.get_coalescing_stats(),
+                'prompts': SystemPrompts.stats.get_stats(),
+                'knowledge_base': (self.response_handler.knowledge_base.get_stats()
+                                   if self.response_handler.knowledge_base else None),
+                'faq': (self.response_handler.faq.get_stats()
+                        if self.response_handler.faq else None),
+                'routing': self.response_handler.get_routing_stats(),
+                'prefetch': self.response_handler.get_prefetch_stats(),
+                'failover': self.response_handler.get_failover_stats(),
+                'rate_limits': self.inbound_limiter.get_stats(),
+                'sessions': (self.response_handler.sessions.get_stats()
+                             if self.response_handler.sessions else None),
+                'logging': get_logging_stats(),
+                'profiling': {
+                    'profiler': self.profiler.get_stats() if self.profiler else None,
+                    'slow_requests': self.slow_requests.get_stats() if self.slow_requests else None
+                },
+                'jobs': (await self.response_handler.run_blocking(self.response_handler.jobs.get_stats)
+                         if self.response_handler.jobs else None),
+                'endpoints': {
+                    'chat': '/chat',
+                    'chat_stream': '/chat/stream',
+                    'chat_batch': '/chat/batch',
+                    'chat_jobs': '/chat/jobs',
+                    'metrics': '/metrics',
+                    'health': '/health',
+                    'ready': '/ready',
+                    'status': '/status'
+                }
+            })
+        except Exception as e:
+            logger.error(f"Error getting status: {e}")
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    @staticmethod
+    async def _parse_chat_request(request: Request):
+        """Validate a chat request, returning (message, None) or (None, error response)"""
+        error = AsyncGovernmentHelperApp._content_type_error(request)
+        if error:
+            return None, error
+
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+
+        user_message, error = validate_chat_data(data)
+        if error:
+            return None, JSONResponse(error, status_code=400)
+        return user_message, None
+
+    @staticmethod
+    def _content_type_error(request: Request) -> Optional[Response]:
+        """400 unless the body is declared as JSON, matching Flask's request.is_json"""
+        content_type = request.headers.get('content-type', '').split(';')[0].strip()
+        if content_type != 'application/json' and not content_type.endswith('+json'):
+            return JSONResponse({
+                'error': 'Content-Type must be application/json',
+                'status': 'error'
+            }, status_code=400)
+        return None
+
+    @staticmethod
+    def _busy_response(error: UpstreamBusyError) -> Response:
+        """Fast rejection when every upstream slot stays taken past the deadline"""
+        return JSONResponse({
+            'error': 'సర్వర్ బిజీగా ఉంది. దయచేసి కొద్దిసేపటి తర్వాత ప్రయత్నించండి (Server busy. Please retry shortly)',
+            'status': 'error'
+        }, status_code=503, headers={'Retry-After': error.retry_after_header})
+
+    @staticmethod
+    async def _session_id(request: Request) -> Optional[str]:
+        """Conversation id of a request whose JSON body was already validated"""
+        return session_id_from(request.headers.get('x-session-id'), await request.json())
+
+    async def _check_inbound_limits(self, request: Request, session_id: Optional[str]) -> None:
+        """Apply per-IP and per-session limits on a storage thread; raises RateLimitExceeded"""
+        await self.response_handler.run_blocking(
+            self.inbound_limiter.check,
+            client_address(request.client.host if request.client else None,
+                           request.headers.get('x-forwarded-for')),
+            session_id
+        )
+
+    @staticmethod
+    def _rate_limited_response(error: RateLimitExceeded) -> Response:
+        """429 with a Retry-After hint for clients or quota over their limit"""
+        return JSONResponse({
+            'error': 'చాలా అభ్యర్థనలు వచ్చాయి. దయచేసి కొద్దిసేపటి తర్వాత మళ్ళీ ప్రయత్నించండి (Too many requests. Please try again shortly)',
+            'status': 'error',
+            'retry_after': error.retry_after_header
+        }, status_code=429, headers={'Retry-After': error.retry_after_header})
+
+    @staticmethod
+    async def _format_sse(events, request_start: Optional[float] = None):
+        """Serialize response events into Server-Sent Events frames"""
+        source = None
+        try:
+            async for event in events:
+                name = event.pop('event')
+                if name == 'done':
+                    source = event['source']
+                yield f"event: {name}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            metrics.request_finished(request_start, source)
+
+    @staticmethod
+    async def _format_ndjson(items):
+        """Serialize batch items as newline-delimited JSON"""
+        async for item in items:
+            yield json.dumps(item, ensure_ascii=False) + '\n'
+
+def create_app() -> Starlette:
+    """ASGI application factory (e.g. `uvicorn --factory async_app:create_app`)"""
+    return AsyncGovernmentHelperApp().app
+
+def main():
+    """Run the ASGI application under uvicorn"""
+    try:
+        asgi_app = create_app()
+        logger.info(f"🌐 Starting ASGI server on {Config.HOST}:{Config.PORT}")
+        uvicorn.run(
+            asgi_app,
+            host=Config.HOST,
+            port=Config.PORT,
+            # uvicorn's loggers go through the log pipeline; RequestLogMiddleware writes the access log
+            log_config=None,
+            access_log=False,
+            log_level='debug' if Config.DEBUG else 'info'
+        )
+    except Exception as e:
+        logger.error(f"❌ Failed to start async application: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: script/language detection versus the old per-call Telugu character scan
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from language import detect_script  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'queries.txt')
+
+
+def legacy_is_telugu(user_message: str) -> bool:
+    """The detection previously inlined in SystemPrompts.create_prompt"""
+    telugu_chars = ['అ', 'ఆ', 'ఇ', 'ఈ', 'ఉ', 'ఊ', 'ఎ', 'ఏ', 'ఐ', 'ఒ', 'ఓ', 'ఔ',
+                    'క', 'ఖ', 'గ', 'ఘ', 'చ', 'ఛ', 'జ', 'ట', 'ఠ', 'డ', 'ఢ', 'ణ',
+                    'త', 'థ', 'ద', 'ధ', 'న', 'ప', 'ఫ', 'బ', 'భ', 'మ', 'య', 'ర', 'ల', 'వ', 'శ', 'ష', 'స', 'హ']
+    return any(char in user_message for char in telugu_chars)
+
+
+def load_corpus(path: str = CORPUS_PATH):
+    """Read benchmark questions, skipping comments and blank lines"""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def main():
+    queries = load_corpus()
+    rounds = 200
+
+    def run(detector):
+        for query in queries:
+            detector(query)
+
+    for name, detector in (('legacy char scan', legacy_is_telugu), ('detect_script', detect_script)):
+        seconds = min(timeit.repeat(lambda: run(detector), number=rounds, repeat=5))
+        print(f"{name:>18}: {seconds / (rounds * len(queries)) * 1e6:6.2f} µs/query")
+
+    labels = {}
+    for query in queries:
+        label = detect_script(query).label
+        labels[label] = labels.get(label, 0) + 1
+    legacy_telugu = sum(1 for query in queries if legacy_is_telugu(query))
+    print(f"\n{len(queries)} queries -> labels {labels}; legacy scan flagged {legacy_telugu} as Telugu")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: import time, time to the first /health, to /ready and to the first /chat answer
+
+Each run starts a fresh app process (against the fake Gemini server unless --sdk is given)
+and reports the median over the runs. Results are written as JSON to benchmarks/results/
+so regressions show up when runs are compared across commits:
+
+    python benchmarks/bench_startup.py --modes flask,asgi --runs 5
+    python benchmarks/bench_startup.py --sdk        # SDK client path; the first /chat calls the real API
+    python benchmarks/bench_startup.py --compare benchmarks/results/*-startup-*.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from fake_gemini import FakeGeminiSettings, start_fake_gemini
+from loadgen import RESULTS_DIR, ROOT_DIR, git_commit
+
+METRICS = ('import_app_s', 'first_health_s', 'ready_s', 'first_chat_s')
+# Not covered by the FAQ set or a knowledge base answer, so it needs the model
+CHAT_QUESTION = 'My father moved to another district and his pension stopped, what should he do?'
+POLL_INTERVAL = 0.01
+
+
+def app_env(mode: str, port: int, gemini_base: Optional[str]) -> Dict[str, str]:
+    """Environment for an app process; without gemini_base the SDK client is used"""
+    env = dict(os.environ, SERVER_MODE=mode, HOST='127.0.0.1', PORT=str(port), DEBUG='false',
+               RATE_LIMIT_ENABLED='false', CACHE_ENABLED='false')
+    if gemini_base is not None:
+        env.update(GEMINI_API_BASE=gemini_base, GEMINI_API_KEYS='fake-key-0,fake-key-1')
+    else:
+        env.pop('GEMINI_API_BASE', None)
+        env.pop('GEMINI_API_KEYS', None)
+        env.setdefault('GEMINI_API_KEY', 'fake-key')
+        env['UPSTREAM_POOL_ENABLED'] = 'false'
+    return env
+
+
+def measure_import(env: Dict[str, str]) -> float:
+    """Seconds to import the app module in a fresh interpreter"""
+    code = ('import time; start = time.perf_counter(); import app, async_app; '
+            'print(time.perf_counter() - start)')
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT_DIR, env=env,
+                                     stderr=subprocess.DEVNULL, text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+def poll(url: str, start: float, timeout: float, status: int = 200) -> float:
+    """Seconds from start until url answers with status"""
+    deadline = start + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == status:
+                return time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        time.sleep(POLL_INTERVAL)
+    raise RuntimeError(f"{url} did not answer within {timeout:.0f}s")
+
+
+def measure_run(env: Dict[str, str], port: int, log_path: str, timeout: float) -> Dict[str, Any]:
+    """Start the app once and time its first /health, /ready and /chat"""
+    base_url = f"http://127.0.0.1:{port}"
+    result = {'import_app_s': measure_import(env)}
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, 'run.py'], cwd=ROOT_DIR, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        try:
+            result['first_health_s'] = poll(f"{base_url}/health", start, timeout)
+            # /ready is polled on its own thread, so it is not held up behind the chat below
+            with ThreadPoolExecutor(max_workers=1) as poller:
+                ready = poller.submit(poll, f"{base_url}/ready", start, timeout)
+                # Sent straight away, so a chat that has to wait for warm-up is timed as such
+                response = requests.post(f"{base_url}/chat", json={'message': CHAT_QUESTION}, timeout=timeout)
+                result['first_chat_s'] = time.perf_counter() - start
+                result['first_chat_source'] = response.json().get('source')
+                result['ready_s'] = ready.result()
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+    return result
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        metric: {
+            'median_ms': round(statistics.median(run[metric] for run in runs) * 1000, 1),
+            'max_ms': round(max(run[metric] for run in runs) * 1000, 1),
+        }
+        for metric in METRICS
+    }
+
+
+def print_summary(label: str, summary: Dict[str, Any]) -> None:
+    print(f"{label:<24} " + '  '.join(
+        f"{metric[:-2]} {summary[metric]['median_ms']:>7} ms" for metric in METRICS))
+
+
+def compare(paths: List[str]) -> None:
+    """Print saved runs side by side"""
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            result = json.load(f)
+        print_summary(f"{result['commit']} {result['mode']}", result['summary'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default='flask,asgi', help='comma-separated SERVER_MODE values to start')
+    parser.add_argument('--runs', type=int, default=3, help='fresh starts per mode')
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--sdk', action='store_true', help='use the google-generativeai client instead of the pool')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for each step')
+    parser.add_argument('--output-dir', default=RESULTS_DIR)
+    parser.add_argument('--compare', nargs='+', metavar='RESULT', help='print saved result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    commit = git_commit()
+    os.makedirs(args.output_dir, exist_ok=True)
+    fake, gemini_base = (None, None) if args.sdk else start_fake_gemini(settings=FakeGeminiSettings(0.05))
+    try:
+        for mode in args.modes.split(','):
+            env = app_env(mode, args.port, gemini_base)
+            label = f"{mode}-sdk" if args.sdk else mode
+            log_path = os.path.join(args.output_dir, f"startup-{label}.log")
+            runs = [measure_run(env, args.port, log_path, args.timeout) for _ in range(args.runs)]
+            summary = summarize(runs)
+            print_summary(f"{commit} {label}", summary)
+
+            result = {
+                'commit': commit,
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'mode': label,
+                'settings': {'runs': args.runs, 'sdk': args.sdk},
+                'summary': summary,
+                'runs': runs,
+            }
+            with open(os.path.join(args.output_dir, f"{commit}-startup-{label}.json"), 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2)
+    finally:
+        if fake is not None:
+            fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
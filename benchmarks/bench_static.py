@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark: GET / rendered through render_template_string versus precompressed static assets
+
+Reports bytes on the wire for a first visit and a repeat visit, and server time per request.
+"""
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, render_template_string  # noqa: E402
+from templates import HTMLTemplate  # noqa: E402
+
+ACCEPT_ENCODING = 'gzip, deflate, br'
+REPEATS = 2000
+
+
+def legacy_client():
+    """The previous home route: the template rendered by Jinja on every request"""
+    app = Flask(__name__, static_folder=None)
+
+    @app.route('/')
+    def home():
+        return render_template_string(HTMLTemplate.MAIN_TEMPLATE)
+
+    return app.test_client()
+
+
+def static_app():
+    """The current home route and fingerprinted assets"""
+    logging.disable(logging.INFO)
+    from app import GovernmentHelperApp
+    return GovernmentHelperApp()
+
+
+def first_visit_bytes(client, assets=None):
+    """Bytes transferred for the page and its assets on an empty browser cache"""
+    urls = ['/'] + [f'/static/{name}' for name in (assets or [])]
+    total = 0
+    for url in urls:
+        total += len(client.get(url, headers={'Accept-Encoding': ACCEPT_ENCODING}).data)
+    return total
+
+
+def repeat_visit_bytes(client):
+    """Bytes transferred when the browser revalidates the page (assets are cached as immutable)"""
+    first = client.get('/', headers={'Accept-Encoding': ACCEPT_ENCODING})
+    etag = first.headers.get('ETag')
+    if not etag:
+        return len(first.data)
+    again = client.get('/', headers={'Accept-Encoding': ACCEPT_ENCODING, 'If-None-Match': etag})
+    return len(again.data)
+
+
+def per_request_us(client, headers):
+    """Mean server time for GET / through the WSGI test client"""
+    seconds = timeit.timeit(lambda: client.get('/', headers=headers), number=REPEATS)
+    return seconds / REPEATS * 1e6
+
+
+def main():
+    legacy = legacy_client()
+    helper_app = static_app()
+    current = helper_app.app.test_client()
+    assets = list(helper_app.static_assets.assets)
+
+    print(f"{'':28}{'legacy':>12}{'static':>12}")
+    print(f"{'first visit (bytes)':28}{first_visit_bytes(legacy):>12}{first_visit_bytes(current, assets):>12}")
+    print(f"{'repeat visit (bytes)':28}{repeat_visit_bytes(legacy):>12}{repeat_visit_bytes(current):>12}")
+    print(f"{'GET / (us)':28}{per_request_us(legacy, {'Accept-Encoding': ACCEPT_ENCODING}):>12.1f}"
+          f"{per_request_us(current, {'Accept-Encoding': ACCEPT_ENCODING}):>12.1f}")
+    etag = current.get('/', headers={'Accept-Encoding': ACCEPT_ENCODING}).headers['ETag']
+    print(f"{'GET / 304 (us)':28}{'-':>12}"
+          f"{per_request_us(current, {'Accept-Encoding': ACCEPT_ENCODING, 'If-None-Match': etag}):>12.1f}")
+    print()
+    for name, sizes in helper_app.static_assets.get_stats().items():
+        print(f"{name:28}" + '  '.join(f"{encoding}={size}" for encoding, size in sizes.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini REST API (generateContent / streamGenerateContent)
+
+Point the app at it with:
+    GEMINI_API_BASE=http://127.0.0.1:8765 GEMINI_API_KEYS=key-a,key-b python run.py
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+
+class FakeGeminiSettings:
+    """Behaviour of the fake server
+
+    latency is the mean response time; latency_dist picks how it varies
+    (uniform spreads +/- latency_spread, lognormal uses latency_spread as
+    sigma). A seed makes the latency and error sequence reproducible.
+    """
+
+    def __init__(self, latency: float = 0.2, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 bad_keys: Optional[Set[str]] = None, chunk_delay: float = 0.02,
+                 latency_dist: str = 'fixed', latency_spread: float = 0.5, seed: Optional[int] = None):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {latency_dist}")
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.bad_keys = bad_keys or set()
+        self.chunk_delay = chunk_delay
+        self.latency_dist = latency_dist
+        self.latency_spread = latency_spread
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self) -> float:
+        """Uniform draw deciding error injection"""
+        with self._lock:
+            self.requests += 1
+            return self._rng.random()
+
+    def sample_latency(self) -> float:
+        """Draw one response latency in seconds"""
+        with self._lock:
+            if self.latency_dist == 'uniform':
+                spread = self.latency * self.latency_spread
+                return max(0.0, self._rng.uniform(self.latency - spread, self.latency + spread))
+            if self.latency_dist == 'exponential' and self.latency > 0:
+                return self._rng.expovariate(1 / self.latency)
+            if self.latency_dist == 'lognormal' and self.latency > 0:
+                sigma = self.latency_spread
+                # mu chosen so the mean stays at latency while the tail grows with sigma
+                return self._rng.lognormvariate(math.log(self.latency) - sigma * sigma / 2, sigma)
+            return self.latency
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    """Answers Gemini REST calls with canned text"""
+
+    server_version = 'FakeGemini/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def _candidate(text: str) -> dict:
+        return {'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}}]}
+
+    def do_POST(self):
+        settings: FakeGeminiSettings = self.server.settings
+        url = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+        try:
+            model, method = url.path.rsplit('/', 1)[-1].split(':', 1)
+        except ValueError:
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+            return
+
+        api_key = self.headers.get('x-goog-api-key') or parse_qs(url.query).get('key', [''])[0]
+        if not api_key or api_key in settings.bad_keys:
+            self._send_json(403, {'error': {'code': 403, 'message': 'API key not valid'}})
+            return
+
+        roll = settings.roll()
+        if roll < settings.rate_limit_rate:
+            self._send_json(429, {'error': {'code': 429, 'message': 'Resource exhausted'}},
+                            headers={'Retry-After': '1'})
+            return
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            self._send_json(503, {'error': {'code': 503, 'message': 'Service unavailable'}})
+            return
+
+        prompt = ''.join(part.get('text', '') for content in body.get('contents', [])
+                         for part in content.get('parts', []))
+        answer = f"[{model}] Fake answer for: {prompt.splitlines()[0] if prompt else ''}"
+        time.sleep(settings.sample_latency())
+
+        if method == 'generateContent':
+            self._send_json(200, self._candidate(answer))
+        elif method == 'streamGenerateContent':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for word in answer.split(' '):
+                self.wfile.write(f"data: {json.dumps(self._candidate(word + ' '))}\r\n\r\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(settings.chunk_delay)
+            self.close_connection = True
+        else:
+            self._send_json(404, {'error': {'code': 404, 'message': f'Unknown method {method}'}})
+
+
+def start_fake_gemini(host: str = '127.0.0.1', port: int = 0,
+                      settings: Optional[FakeGeminiSettings] = None) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the fake server on a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), FakeGeminiHandler)
+    server.daemon_threads = True
+    server.settings = settings or FakeGeminiSettings()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help='mean seconds per response')
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='fixed')
+    parser.add_argument('--latency-spread', type=float, default=0.5,
+                        help='relative spread (uniform) or sigma (lognormal)')
+    parser.add_argument('--chunk-delay', type=float, default=0.02, help='seconds between streamed chunks')
+    parser.add_argument('--seed', type=int, default=None, help='seed for reproducible latencies and errors')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of 503 responses')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of 429 responses')
+    parser.add_argument('--bad-key', action='append', default=[], help='API key answered with 403')
+    args = parser.parse_args()
+
+    settings = FakeGeminiSettings(args.latency, args.error_rate, args.rate_limit_rate, set(args.bad_key),
+                                  chunk_delay=args.chunk_delay, latency_dist=args.latency_dist,
+                                  latency_spread=args.latency_spread, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), FakeGeminiHandler)
+    server.settings = settings
+    print(f"🧪 Fake Gemini listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
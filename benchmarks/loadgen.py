@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Load generator: replays the question corpus against /chat at a fixed rate for each serving mode
+
+By default it starts the fake Gemini server and the app itself (once per mode), so runs are
+reproducible without an API key. Results are printed and written as JSON to benchmarks/results/
+so runs can be compared across commits:
+
+    python benchmarks/loadgen.py --modes flask,asgi --rps 20 --duration 30 --concurrency 32
+    python benchmarks/loadgen.py --target http://127.0.0.1:5000 --endpoint stream
+    python benchmarks/loadgen.py --compare benchmarks/results/*.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from bench_language import load_corpus
+from fake_gemini import LATENCY_DISTRIBUTIONS, FakeGeminiSettings, start_fake_gemini
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT_DIR, 'benchmarks', 'results')
+ENDPOINTS = {'chat': '/chat', 'stream': '/chat/stream'}
+
+
+def git_commit() -> str:
+    """Short hash of the checked-out commit, marked dirty when the tree has changes"""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, text=True).strip()
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD'], cwd=ROOT_DIR).returncode != 0
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def start_app(mode: str, port: int, gemini_base: str, keys: List[str], cache: bool, log_path: str):
+    """Run the app as a subprocess pointed at the fake Gemini server"""
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        HOST='127.0.0.1',
+        PORT=str(port),
+        DEBUG='false',
+        GEMINI_API_BASE=gemini_base,
+        GEMINI_API_KEYS=','.join(keys),
+        RATE_LIMIT_ENABLED='false',
+        CACHE_ENABLED='true' if cache else 'false',
+    )
+    log = open(log_path, 'w')
+    process = subprocess.Popen([sys.executable, 'run.py'], cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, log
+
+
+def wait_ready(base_url: str, timeout: float = 30.0) -> None:
+    """Poll /ready until the server has finished warming up"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/ready", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become ready within {timeout:.0f}s")
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values), math.ceil(q * len(sorted_values))) - 1)
+    return sorted_values[rank]
+
+
+class LoadRun:
+    """Open-loop load at a fixed request rate with a cap on concurrent requests
+
+    Latency is measured from each request's scheduled send time, so queueing
+    behind the concurrency cap counts against the server (no coordinated omission).
+    """
+
+    def __init__(self, base_url: str, questions: List[str], rps: float, duration: float,
+                 concurrency: int, endpoint: str = 'chat', timeout: float = 60.0):
+        self.url = base_url.rstrip('/') + ENDPOINTS[endpoint]
+        self.questions = questions
+        self.rps = rps
+        self.duration = duration
+        self.concurrency = concurrency
+        self.stream = endpoint == 'stream'
+        self.timeout = timeout
+        self.samples: List[Dict[str, Any]] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _send(self, question: str, scheduled: float) -> None:
+        sample = {'status': None, 'source': None, 'first_byte': None}
+        try:
+            response = self._session().post(self.url, json={'message': question},
+                                            timeout=self.timeout, stream=self.stream)
+            sample['status'] = response.status_code
+            if self.stream:
+                for line in response.iter_lines(decode_unicode=True):
+                    if sample['first_byte'] is None:
+                        sample['first_byte'] = time.perf_counter() - scheduled
+                    if line and line.startswith('data:') and '"source"' in line:
+                        sample['source'] = json.loads(line[5:]).get('source')
+            elif response.status_code == 200:
+                sample['source'] = response.json().get('source')
+        except (requests.RequestException, ValueError) as e:
+            sample['error'] = type(e).__name__
+        sample['latency'] = time.perf_counter() - scheduled
+        with self._lock:
+            self.samples.append(sample)
+
+    def run(self) -> Dict[str, Any]:
+        total = int(self.rps * self.duration)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for i in range(total):
+                scheduled = start + i / self.rps
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self._send, self.questions[i % len(self.questions)], scheduled)
+        return self.summarize(time.perf_counter() - start)
+
+    def summarize(self, wall_seconds: float) -> Dict[str, Any]:
+        """Latency percentiles, throughput and error rate"""
+        latencies = sorted(sample['latency'] for sample in self.samples)
+        first_bytes = sorted(sample['first_byte'] for sample in self.samples if sample['first_byte'] is not None)
+        ok = [sample for sample in self.samples if sample['status'] == 200
+              and sample['source'] not in (None, 'server_error', 'empty_response', 'rate_limited')]
+        statuses: Dict[str, int] = {}
+        sources: Dict[str, int] = {}
+        for sample in self.samples:
+            status = str(sample['status'] or sample.get('error'))
+            statuses[status] = statuses.get(status, 0) + 1
+            if sample['source']:
+                sources[sample['source']] = sources.get(sample['source'], 0) + 1
+
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 2) if value is not None else None
+
+        summary = {
+            'requests': len(self.samples),
+            'wall_seconds': round(wall_seconds, 3),
+            'throughput_rps': round(len(ok) / wall_seconds, 2) if wall_seconds else 0.0,
+            'error_rate': round(1 - len(ok) / len(self.samples), 4) if self.samples else 0.0,
+            'latency_ms': {f"p{int(q * 100)}": ms(percentile(latencies, q)) for q in (0.5, 0.95, 0.99)},
+            'status_codes': statuses,
+            'sources': sources,
+        }
+        summary['latency_ms']['max'] = ms(latencies[-1]) if latencies else None
+        if first_bytes:
+            summary['first_byte_ms'] = {f"p{int(q * 100)}": ms(percentile(first_bytes, q)) for q in (0.5, 0.95, 0.99)}
+        return summary
+
+
+def print_summary(label: str, summary: Dict[str, Any]) -> None:
+    latency = summary['latency_ms']
+    print(f"{label:<24} {summary['requests']:>6} req  {summary['throughput_rps']:>7.1f} ok/s  "
+          f"err {summary['error_rate'] * 100:5.1f}%  "
+          f"p50 {latency['p50']:>8} ms  p95 {latency['p95']:>8} ms  p99 {latency['p99']:>8} ms")
+    if 'first_byte_ms' in summary:
+        first_byte = summary['first_byte_ms']
+        print(f"{'':<24} first byte p50 {first_byte['p50']} ms  p95 {first_byte['p95']} ms  p99 {first_byte['p99']} ms")
+
+
+def compare(paths: List[str]) -> None:
+    """Print saved runs side by side"""
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            result = json.load(f)
+        print_summary(f"{result['commit']} {result['mode']}/{result['settings']['endpoint']}", result['summary'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default='flask,asgi', help='comma-separated SERVER_MODE values to start')
+    parser.add_argument('--target', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='chat')
+    parser.add_argument('--rps', type=float, default=20.0)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of load per mode')
+    parser.add_argument('--concurrency', type=int, default=32, help='maximum requests in flight')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--cache', action='store_true', help='keep the answer cache on (off by default)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for question order and fake latencies')
+    parser.add_argument('--keys', type=int, default=2, help='number of fake API keys in the pool')
+    parser.add_argument('--latency', type=float, default=0.3, help='mean fake Gemini latency in seconds')
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='lognormal')
+    parser.add_argument('--latency-spread', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--output-dir', default=RESULTS_DIR)
+    parser.add_argument('--compare', nargs='+', metavar='RESULT', help='print saved result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    questions = load_corpus()
+    random.Random(args.seed).shuffle(questions)
+    settings = {key: value for key, value in vars(args).items() if key not in ('compare', 'output_dir', 'target')}
+    commit = git_commit()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    targets = [('external', args.target)] if args.target else [(mode, None) for mode in args.modes.split(',')]
+    for mode, target in targets:
+        process = log = fake = None
+        try:
+            if target is None:
+                fake, gemini_base = start_fake_gemini(settings=FakeGeminiSettings(
+                    args.latency, args.error_rate, args.rate_limit_rate, latency_dist=args.latency_dist,
+                    latency_spread=args.latency_spread, seed=args.seed))
+                target = f"http://127.0.0.1:{args.port}"
+                log_path = os.path.join(args.output_dir, f"{mode}.log")
+                process, log = start_app(mode, args.port, gemini_base,
+                                         [f"fake-key-{i}" for i in range(args.keys)], args.cache, log_path)
+            wait_ready(target)
+
+            summary = LoadRun(target, questions, args.rps, args.duration, args.concurrency, args.endpoint).run()
+            print_summary(f"{commit} {mode}/{args.endpoint}", summary)
+
+            result = {
+                'commit': commit,
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'mode': mode,
+                'settings': settings,
+                'summary': summary,
+            }
+            path = os.path.join(args.output_dir, f"{commit}-{mode}-{args.endpoint}.json")
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=10)
+                log.close()
+            if fake is not None:
+                fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
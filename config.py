@@ -4,27 +4,191 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 class Config:
     """Configuration settings for the Government Helper AI Assistant"""
     
     # Gemini API settings
     GEMINI_API_KEY: Optional[str] = os.getenv('GEMINI_API_KEY')
     GEMINI_MODEL = "gemini-1.5-flash"  # Fast and efficient model
+
+    # Upstream pool: comma-separated keys/models, one endpoint per combination
+    GEMINI_API_KEYS = [key.strip() for key in os.getenv('GEMINI_API_KEYS', '').split(',') if key.strip()] \
+        or ([GEMINI_API_KEY] if GEMINI_API_KEY else [])
+    GEMINI_MODELS = [model.strip() for model in os.getenv('GEMINI_MODELS', '').split(',') if model.strip()] \
+        or [GEMINI_MODEL]
+    GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
+    # Defaults to on when more than one endpoint is configured or the API base is overridden
+    UPSTREAM_POOL_ENABLED = os.getenv(
+        'UPSTREAM_POOL_ENABLED',
+        str(len(GEMINI_API_KEYS) * len(GEMINI_MODELS) > 1 or 'GEMINI_API_BASE' in os.environ)
+    ).lower() == 'true'
+    UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', 30))
+    UPSTREAM_MAX_ATTEMPTS = int(os.getenv('UPSTREAM_MAX_ATTEMPTS', 3))
+    UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', 0.25))
+    UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', 4.0))
+    UPSTREAM_EWMA_ALPHA = float(os.getenv('UPSTREAM_EWMA_ALPHA', 0.2))
+    UPSTREAM_CIRCUIT_THRESHOLD = int(os.getenv('UPSTREAM_CIRCUIT_THRESHOLD', 3))
+    UPSTREAM_CIRCUIT_COOLDOWN = float(os.getenv('UPSTREAM_CIRCUIT_COOLDOWN', 30))
+    UPSTREAM_RATE_LIMIT_COOLDOWN = float(os.getenv('UPSTREAM_RATE_LIMIT_COOLDOWN', 60))
+
+    # Request deadlines (X-Request-Timeout header, in seconds) and hedged upstream requests
+    REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', 25))
+    REQUEST_TIMEOUT_MAX = float(os.getenv('REQUEST_TIMEOUT_MAX', 60))
+    HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'False').lower() == 'true'
+    HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', 0.5))  # never hedge sooner than this
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 0.95))  # of recent upstream latencies
+
+    # Rate limiting: outbound quota per API key, inbound limits per client
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+    GEMINI_RPM = float(os.getenv('GEMINI_RPM', 60))
+    GEMINI_TPM = float(os.getenv('GEMINI_TPM', 1000000))
+    RATE_LIMIT_QUEUE_SIZE = int(os.getenv('RATE_LIMIT_QUEUE_SIZE', 100))
+    RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', 10))
+    RATE_LIMIT_OUTPUT_TOKENS = int(os.getenv('RATE_LIMIT_OUTPUT_TOKENS', 300))  # expected answer size
+    INBOUND_IP_RPM = float(os.getenv('INBOUND_IP_RPM', 30))
+    INBOUND_IP_BURST = float(os.getenv('INBOUND_IP_BURST', 10))
+    INBOUND_SESSION_RPM = float(os.getenv('INBOUND_SESSION_RPM', 12))
+    INBOUND_SESSION_BURST = float(os.getenv('INBOUND_SESSION_BURST', 5))
+    TRUST_PROXY_HEADERS = os.getenv('TRUST_PROXY_HEADERS', 'False').lower() == 'true'
     
     # App settings
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', 5000))
+    SERVER_MODE = os.getenv('SERVER_MODE', 'flask').lower()  # 'flask' or 'asgi'
+
+    # Local fallback model: a small GGUF model run on the CPU with llama.cpp (needs llama-cpp-python)
+    LOCAL_MODEL_PATH: Optional[str] = os.getenv('LOCAL_MODEL_PATH')  # e.g. models/qwen2.5-1.5b-instruct-q4_k_m.gguf
+    LOCAL_MODEL_WORKERS = int(os.getenv('LOCAL_MODEL_WORKERS', 0))  # answers generated at once, 0 = one per 4 cores
+    LOCAL_MODEL_CONTEXT = int(os.getenv('LOCAL_MODEL_CONTEXT', 2048))  # tokens per context
+    LOCAL_MAX_TOKENS = int(os.getenv('LOCAL_MAX_TOKENS', 256))  # answer cap, below every generation profile
+    LOCAL_MODEL_QUEUE_TIMEOUT = float(os.getenv('LOCAL_MODEL_QUEUE_TIMEOUT', 10))  # longest wait for a free context
+    FAILOVER_THRESHOLD = int(os.getenv('FAILOVER_THRESHOLD', 3))  # consecutive Gemini failures before failing over
+    FAILOVER_COOLDOWN = float(os.getenv('FAILOVER_COOLDOWN', 30))  # seconds before Gemini is tried again
+
+    # Asynchronous chat jobs (POST /chat/jobs) for SMS/IVR/WhatsApp gateways, persisted in SQLite
+    JOB_QUEUE_PATH: Optional[str] = os.getenv('JOB_QUEUE_PATH')  # e.g. jobs.db; unset disables /chat/jobs
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))  # jobs answered at once per process
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 4))
+    JOB_BACKOFF_BASE = float(os.getenv('JOB_BACKOFF_BASE', 2))  # seconds before the first retry, doubled after each
+    JOB_BACKOFF_MAX = float(os.getenv('JOB_BACKOFF_MAX', 60))
+    JOB_TIMEOUT = float(os.getenv('JOB_TIMEOUT', 60))  # deadline of one attempt
+    JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 120))  # a job whose process died is retried after this
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))  # idle workers check for other processes' jobs
+    JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', 24 * 60 * 60))  # finished jobs stay pollable
+    JOB_CALLBACK_HOSTS = [host.strip() for host in os.getenv('JOB_CALLBACK_HOSTS', 'localhost,127.0.0.1,::1').split(',')
+                          if host.strip()]  # webhooks may only point at these hosts
+    JOB_CALLBACK_TIMEOUT = float(os.getenv('JOB_CALLBACK_TIMEOUT', 5))
+
+    # Speculative prefetch of likely follow-ups (fees, documents, office, processing time) into the answer cache
+    PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'False').lower() == 'true'
+    # Learned by `python prefetch.py`
+    PREFETCH_TABLE_PATH = os.getenv('PREFETCH_TABLE_PATH', os.path.join(BASE_DIR, 'classifier', 'followups.json'))
+    PREFETCH_TOP_K = int(os.getenv('PREFETCH_TOP_K', 2))  # follow-ups generated per answer
+    PREFETCH_MIN_HEADROOM = float(os.getenv('PREFETCH_MIN_HEADROOM', 0.5))  # share of the Gemini quota left free
+    PREFETCH_MAX_IN_FLIGHT = int(os.getenv('PREFETCH_MAX_IN_FLIGHT', 4))  # requests in progress before pausing
+    PREFETCH_QUEUE_SIZE = int(os.getenv('PREFETCH_QUEUE_SIZE', 100))
+    PREFETCH_TIMEOUT = float(os.getenv('PREFETCH_TIMEOUT', 30))
+    PREFETCH_BACKOFF_MAX = float(os.getenv('PREFETCH_BACKOFF_MAX', 60))  # longest pause once traffic is high
+
+    # Startup: the Gemini SDK and the intent classifier are set up on background threads
+    BACKGROUND_INIT = os.getenv('BACKGROUND_INIT', 'True').lower() == 'true'
+    INIT_WAIT_TIMEOUT = float(os.getenv('INIT_WAIT_TIMEOUT', 20))  # longest a request waits for warm-up
+
+    # Multi-process launcher (launcher.py)
+    WORKERS = int(os.getenv('WORKERS', 0))  # 0 = one per CPU core
+    WORKER_MAX_REQUESTS = int(os.getenv('WORKER_MAX_REQUESTS', 0))  # recycle a worker after this many requests, 0 = never
+    WORKER_MAX_REQUESTS_JITTER = int(os.getenv('WORKER_MAX_REQUESTS_JITTER', 50))  # so workers do not recycle together
+    WORKER_GRACEFUL_TIMEOUT = float(os.getenv('WORKER_GRACEFUL_TIMEOUT', 30))  # to finish in-flight requests
+    SHARED_STORE_SOCKET: Optional[str] = os.getenv('SHARED_STORE_SOCKET')  # set by launcher.py for its workers
+
+    # Logging: JSON lines written by a background thread; the request path only enqueues
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()  # 'json' or 'text'
+    LOG_FILE: Optional[str] = os.getenv('LOG_FILE')  # default: stderr
+    LOG_FILE_MAX_BYTES = int(os.getenv('LOG_FILE_MAX_BYTES', 50 * 1024 * 1024))  # rotate past this size
+    LOG_FILE_BACKUPS = int(os.getenv('LOG_FILE_BACKUPS', 5))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # records beyond this are dropped and counted
+    LOG_SUCCESS_SAMPLE_RATE = float(os.getenv('LOG_SUCCESS_SAMPLE_RATE', 1.0))  # share of successful requests logged
+
+    # Profiling, off by default: /admin/profile and /admin/slow-requests need an X-Admin-Token header
+    ADMIN_TOKEN: Optional[str] = os.getenv('ADMIN_TOKEN')
+    PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'False').lower() == 'true'
+    PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', 10))  # between stack samples
+    PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS', 60))
+    SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 0))  # record requests slower than this, 0 = off
+    SLOW_REQUEST_BUFFER = int(os.getenv('SLOW_REQUEST_BUFFER', 100))  # slow requests kept
+
+    # Metrics: per-stage latency histograms exported on /metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+
+    # Async serving settings
+    ASYNC_MAX_CONCURRENT_UPSTREAM = int(os.getenv('ASYNC_MAX_CONCURRENT_UPSTREAM', 32))
+    ASYNC_SLOT_TIMEOUT = float(os.getenv('ASYNC_SLOT_TIMEOUT', 2.0))
+    ASYNC_STORAGE_WORKERS = int(os.getenv('ASYNC_STORAGE_WORKERS', 16))  # threads for cache, session and KB work
+
+    # Batch endpoint settings
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 200))
+    BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', 8))  # concurrent Gemini calls per batch
     
-    # Generation settings
+    # Generation settings (MAX_TOKENS is the "detailed" profile, see generation_profiles.py)
     MAX_TOKENS = 1000
     TEMPERATURE = 0.7
     TOP_P = 0.9
     TOP_K = 40
+    SHORT_MAX_TOKENS = int(os.getenv('SHORT_MAX_TOKENS', 256))  # "short" profile
+    STANDARD_MAX_TOKENS = int(os.getenv('STANDARD_MAX_TOKENS', 512))  # "standard" profile
+
+    # Prompt settings
+    PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 800))  # per-request prompt, excluding system instruction
+
+    # Conversation session settings
+    SESSIONS_ENABLED = os.getenv('SESSIONS_ENABLED', 'True').lower() == 'true'
+    SESSION_MAX_SESSIONS = int(os.getenv('SESSION_MAX_SESSIONS', 10000))
+    SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', 16 * 1024 * 1024))
+    SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', 2 * 60 * 60))  # idle time before a session is dropped
+    SESSION_DISK_PATH: Optional[str] = os.getenv('SESSION_DISK_PATH')  # e.g. sessions.db
+    SESSION_MAX_TURNS = int(os.getenv('SESSION_MAX_TURNS', 6))  # older turns are folded into a summary
+    SESSION_MAX_ANSWER_CHARS = int(os.getenv('SESSION_MAX_ANSWER_CHARS', 400))
+    SESSION_SUMMARY_CHARS = int(os.getenv('SESSION_SUMMARY_CHARS', 300))
+    SESSION_HISTORY_TOKEN_BUDGET = int(os.getenv('SESSION_HISTORY_TOKEN_BUDGET', 250))  # part of PROMPT_TOKEN_BUDGET
+
+    # Answer cache settings
+    CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'True').lower() == 'true'
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 2000))
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    CACHE_TTL_SECONDS = int(os.getenv('CACHE_TTL_SECONDS', 24 * 60 * 60))
+    CACHE_DISK_PATH: Optional[str] = os.getenv('CACHE_DISK_PATH')  # e.g. answers.db
+    CACHE_DISK_MAX_ENTRIES = int(os.getenv('CACHE_DISK_MAX_ENTRIES', 50000))
+
+    # Knowledge base settings
+    KB_ENABLED = os.getenv('KB_ENABLED', 'True').lower() == 'true'
+    KB_SOURCE_DIR = os.getenv('KB_SOURCE_DIR', os.path.join(BASE_DIR, 'knowledge'))
+    KB_INDEX_DIR = os.getenv('KB_INDEX_DIR', os.path.join(BASE_DIR, '.kb_index'))
+    KB_TOP_K = int(os.getenv('KB_TOP_K', 3))
+    KB_MIN_CONFIDENCE = float(os.getenv('KB_MIN_CONFIDENCE', 0.3))  # to be injected into the prompt
+    KB_DIRECT_ANSWER_CONFIDENCE = float(os.getenv('KB_DIRECT_ANSWER_CONFIDENCE', 0.85))
+    KB_VECTOR_MIN_SIMILARITY = float(os.getenv('KB_VECTOR_MIN_SIMILARITY', 0.5))
+
+    # Precomputed FAQ answers (built offline with `python warmup.py`)
+    FAQ_ENABLED = os.getenv('FAQ_ENABLED', 'True').lower() == 'true'
+    FAQ_QUESTIONS_PATH = os.getenv('FAQ_QUESTIONS_PATH', os.path.join(BASE_DIR, 'faq', 'questions.json'))
+    FAQ_ANSWERS_PATH = os.getenv('FAQ_ANSWERS_PATH', os.path.join(BASE_DIR, 'faq', 'answers.bin'))
+    FAQ_MIN_COVERAGE = float(os.getenv('FAQ_MIN_COVERAGE', 0.75))  # share of question words the FAQ set knows
+
+    # Local intent routing (canned reply, knowledge lookup, short answer or full generation)
+    CLASSIFIER_ENABLED = os.getenv('CLASSIFIER_ENABLED', 'True').lower() == 'true'
+    CLASSIFIER_DATA_PATH = os.getenv('CLASSIFIER_DATA_PATH', os.path.join(BASE_DIR, 'classifier', 'labelled_questions.json'))
+    CLASSIFIER_MIN_MARGIN = float(os.getenv('CLASSIFIER_MIN_MARGIN', 2.0))  # below this, use full generation
+    CLASSIFIER_CANNED_MIN_MARGIN = float(os.getenv('CLASSIFIER_CANNED_MIN_MARGIN', 8.0))
+    CLASSIFIER_CANNED_MAX_WORDS = int(os.getenv('CLASSIFIER_CANNED_MAX_WORDS', 8))
+    CLASSIFIER_LOOKUP_CONFIDENCE = float(os.getenv('CLASSIFIER_LOOKUP_CONFIDENCE', 0.6))  # KB answer for lookups
 
     @classmethod
     def validate_config(cls) -> bool:
         """Validate required configuration"""
-        if not cls.GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY environment variable is required")
+        if not cls.GEMINI_API_KEYS:
+            raise ValueError("GEMINI_API_KEY (or GEMINI_API_KEYS) environment variable is required")
         return True
@@ -0,0 +1,39 @@
+import time
+from typing import Optional
+from config import Config
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before an answer was ready"""
+
+def deadline_from_header(value: Optional[str]) -> float:
+    """Absolute deadline (time.monotonic) from an X-Request-Timeout value in seconds
+
+    Missing or malformed values fall back to REQUEST_TIMEOUT; larger values
+    are capped at REQUEST_TIMEOUT_MAX.
+    """
+    seconds = Config.REQUEST_TIMEOUT
+    if value:
+        try:
+            seconds = float(value)
+        except ValueError:
+            pass
+    if seconds <= 0 or seconds != seconds:
+        seconds = Config.REQUEST_TIMEOUT
+    return time.monotonic() + min(seconds, Config.REQUEST_TIMEOUT_MAX)
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left before the deadline (None when there is no deadline)
+
+    Raises DeadlineExceeded once it has passed.
+    """
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left
+
+def upstream_timeout(deadline: Optional[float]) -> float:
+    """Timeout for one upstream call: UPSTREAM_TIMEOUT, shortened to fit the deadline"""
+    left = remaining(deadline)
+    return Config.UPSTREAM_TIMEOUT if left is None else min(Config.UPSTREAM_TIMEOUT, left)
@@ -0,0 +1,232 @@
+import array
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left
+from typing import Optional, Dict, Any, List, Tuple
+from answer_cache import AnswerCache, normalize_question
+from config import Config
+from knowledge_base import tokenize
+from language import detect_language
+from prompts import SystemPrompts
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MAGIC = b'GHFAQ\x00\x00\x00'
+# magic, format version, content version, table entries, meta length
+_HEADER = struct.Struct('<8sIIII')
+
+def _hash(key: str) -> int:
+    """Stable 64-bit hash of a lookup key (the builtin hash() differs between processes)"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def load_questions(path: str = Config.FAQ_QUESTIONS_PATH) -> Dict[str, Any]:
+    """Read the curated FAQ definition"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def expand_questions(spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One entry per document, language and intent: a canonical question plus its variants"""
+    entries = []
+    for document, info in spec['documents'].items():
+        for intent in info.get('intents', list(spec['templates'])):
+            for language in spec['languages']:
+                questions = [template.format(name=info['names'][language])
+                             for template in spec['templates'][intent][language]]
+                entries.append({
+                    'slot': f"{document}|{language}|{intent}",
+                    'document': document,
+                    'language': language,
+                    'intent': intent,
+                    'question': questions[0],
+                    'variants': questions[1:]
+                })
+    return entries
+
+def record_keys(entry: Dict[str, Any]) -> List[str]:
+    """Lookup keys of an FAQ entry: its slot plus the cache key of every phrasing"""
+    return [f"s|{entry['slot']}"] + [f"q|{AnswerCache.make_key(question)}"
+                                     for question in [entry['question'], *entry['variants']]]
+
+def build_meta(spec: Dict[str, Any], entries: List[Dict[str, Any]], **info) -> Dict[str, Any]:
+    """Matching data stored alongside the answers: document aliases and the FAQ vocabulary"""
+    aliases = {document: sorted({normalize_question(alias) for alias in details['aliases']})
+               for document, details in spec['documents'].items()}
+    words = set(spec.get('filler', []))
+    for entry in entries:
+        words.update([entry['question'], *entry['variants']])
+    for details in spec['documents'].values():
+        words.update(details['aliases'])
+    vocabulary = sorted({token for text in words for token in tokenize(text)})
+    return {**info, 'languages': spec['languages'], 'aliases': aliases, 'vocabulary': vocabulary}
+
+def named_documents(user_message: str, aliases: Dict[str, List[str]]) -> List[str]:
+    """Documents a question mentions by one of their (normalized) aliases"""
+    text = f" {normalize_question(user_message)}"
+    return [document for document, names in aliases.items() if any(f" {alias}" in text for alias in names)]
+
+def is_covered(user_message: str, vocabulary: frozenset) -> bool:
+    """Check that nearly all words of a question occur in the FAQ set (FAQ_MIN_COVERAGE)"""
+    tokens = tokenize(user_message)
+    return bool(tokens) and sum(token in vocabulary for token in tokens) >= Config.FAQ_MIN_COVERAGE * len(tokens)
+
+def write_answer_file(path: str, content_version: int, records: List[Tuple[List[str], Dict[str, Any]]],
+                      meta: Dict[str, Any]) -> int:
+    """Write (keys, record) pairs as a memory-mappable answer file; returns its size in bytes
+
+    Layout: header, meta JSON (padded to 8 bytes), key hashes (uint64,
+    sorted), record offsets and lengths (uint32) and the JSON records.
+    """
+    blob = bytearray()
+    table: Dict[int, Tuple[int, int]] = {}
+    for keys, record in records:
+        data = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        offset = len(blob)
+        blob += data
+        for key in keys:
+            table.setdefault(_hash(key), (offset, len(data)))
+
+    hashes = array.array('Q', sorted(table))
+    offsets = array.array('I', (table[h][0] for h in hashes))
+    lengths = array.array('I', (table[h][1] for h in hashes))
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    meta_bytes += b' ' * (-len(meta_bytes) % 8)
+
+    data = b''.join([
+        _HEADER.pack(MAGIC, FORMAT_VERSION, content_version, len(hashes), len(meta_bytes)),
+        meta_bytes, hashes.tobytes(), offsets.tobytes(), lengths.tobytes(), bytes(blob)
+    ])
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+class FAQStore:
+    """Precomputed answers to common questions, memory-mapped from the file warmup.py writes
+
+    Opening reads only the header and the small matching metadata; answers
+    stay on disk until a lookup hits them.
+    """
+
+    def __init__(self, path: str = Config.FAQ_ANSWERS_PATH):
+        self.path = path
+        self.lookups = 0
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.lookup_seconds = 0.0
+
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, self.content_version, count, meta_length = _HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            self.close(views=False)
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} FAQ answer file")
+
+        start = _HEADER.size
+        meta = json.loads(self._mmap[start:start + meta_length])
+        self.built_at = meta.get('built_at')
+        self.model = meta.get('model')
+        self.languages = frozenset(meta['languages'])
+        self.aliases: Dict[str, List[str]] = meta['aliases']
+        self.vocabulary = frozenset(meta['vocabulary'])
+
+        view = memoryview(self._mmap)
+        start += meta_length
+        self.entries = count
+        self._hashes = view[start:start + 8 * count].cast('Q')
+        self._offsets = view[start + 8 * count:start + 12 * count].cast('I')
+        self._lengths = view[start + 12 * count:start + 16 * count].cast('I')
+        self._records = view[start + 16 * count:]
+
+    @classmethod
+    def from_config(cls) -> Optional['FAQStore']:
+        """Open the answer file if enabled and built for the current FAQ content version"""
+        if not Config.FAQ_ENABLED or not os.path.exists(Config.FAQ_ANSWERS_PATH):
+            return None
+        try:
+            store = cls(Config.FAQ_ANSWERS_PATH)
+            version = load_questions(Config.FAQ_QUESTIONS_PATH)['version']
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"❌ Failed to load FAQ answers: {e}")
+            return None
+        if store.content_version != version:
+            logger.warning(f"FAQ answers are stale (built for version {store.content_version}, "
+                           f"questions are at {version}); run `python warmup.py`")
+            store.close()
+            return None
+        logger.info(f"✅ FAQ answers loaded: {store.entries} keys, content version {version}")
+        return store
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Record stored under a lookup key"""
+        key_hash = _hash(key)
+        index = bisect_left(self._hashes, key_hash)
+        if index == self.entries or self._hashes[index] != key_hash:
+            return None
+        offset = self._offsets[index]
+        return json.loads(self._records[offset:offset + self._lengths[index]].tobytes())
+
+    def _match(self, user_message: str, language: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Map a reworded question to its (document, language, intent) slot
+
+        Matches only when the question names exactly one document and nearly
+        all of its words occur in the FAQ set, so questions with extra
+        specifics still go to the model.
+        """
+        language = language or detect_language(user_message)
+        if language not in self.languages:
+            return None
+        documents = named_documents(user_message, self.aliases)
+        if len(documents) != 1 or not is_covered(user_message, self.vocabulary):
+            return None
+        return self.get(f"s|{documents[0]}|{language}|{SystemPrompts.detect_intent(user_message)}")
+
+    def lookup(self, user_message: str, language: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Precomputed response for a question, matched exactly or by document and intent"""
+        start = time.perf_counter()
+        record = self.get(f"q|{AnswerCache.make_key(user_message, language)}")
+        if record is not None:
+            self.exact_hits += 1
+        else:
+            record = self._match(user_message, language)
+            if record is not None:
+                self.fuzzy_hits += 1
+        self.lookups += 1
+        self.lookup_seconds += time.perf_counter() - start
+        if record is None:
+            return None
+        return {
+            'response': record['response'],
+            'source': 'faq',
+            'status': 'success'
+        }
+
+    def close(self, views: bool = True) -> None:
+        """Release the memory-mapped file"""
+        if views:
+            for view in (self._hashes, self._offsets, self._lengths, self._records):
+                view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get FAQ store statistics"""
+        hits = self.exact_hits + self.fuzzy_hits
+        return {
+            'content_version': self.content_version,
+            'built_at': self.built_at,
+            'model': self.model,
+            'keys': self.entries,
+            'lookups': self.lookups,
+            'exact_hits': self.exact_hits,
+            'fuzzy_hits': self.fuzzy_hits,
+            'hit_rate': round(hits / self.lookups, 4) if self.lookups else 0.0,
+            'avg_lookup_us': round(self.lookup_seconds / self.lookups * 1e6, 1) if self.lookups else 0.0
+        }
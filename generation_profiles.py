@@ -0,0 +1,60 @@
+from typing import Dict, Any, Optional
+from config import Config
+
+# Named Gemini generation settings (SDK GenerationConfig field names). Output
+# length drives latency, so answers are sized to the question instead of
+# always allowing a full procedural guide.
+PROFILES: Dict[str, Dict[str, Any]] = {
+    'short': {
+        'max_output_tokens': Config.SHORT_MAX_TOKENS,
+        'temperature': 0.3,
+        'top_p': Config.TOP_P,
+        'top_k': Config.TOP_K,
+    },
+    'standard': {
+        'max_output_tokens': Config.STANDARD_MAX_TOKENS,
+        'temperature': Config.TEMPERATURE,
+        'top_p': Config.TOP_P,
+        'top_k': Config.TOP_K,
+    },
+    'detailed': {
+        'max_output_tokens': Config.MAX_TOKENS,
+        'temperature': Config.TEMPERATURE,
+        'top_p': Config.TOP_P,
+        'top_k': Config.TOP_K,
+    },
+    # Greedy decoding, so regenerated answers (FAQ warm-up, cache fills) come out the same
+    'deterministic': {
+        'max_output_tokens': Config.MAX_TOKENS,
+        'temperature': 0.0,
+        'top_p': 1.0,
+        'top_k': 1,
+    },
+}
+DEFAULT_PROFILE = 'detailed'
+
+# Narrow questions up to this many words get the short profile
+SHORT_QUESTION_WORDS = 6
+
+# The same settings in REST API form for the upstream pool
+REST_CONFIGS = {
+    name: {
+        'temperature': profile['temperature'],
+        'topP': profile['top_p'],
+        'topK': profile['top_k'],
+        'maxOutputTokens': profile['max_output_tokens']
+    }
+    for name, profile in PROFILES.items()
+}
+
+def choose_profile(user_message: str, intent: str) -> str:
+    """Pick a profile from the prompt intent and the question length"""
+    if intent == 'short':
+        return 'short'
+    if intent != 'full':
+        return 'short' if len(user_message.split()) <= SHORT_QUESTION_WORDS else 'standard'
+    return DEFAULT_PROFILE
+
+def max_output_tokens(profile: Optional[str]) -> int:
+    """Answer length limit of a profile"""
+    return PROFILES[profile or DEFAULT_PROFILE]['max_output_tokens']
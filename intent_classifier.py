@@ -0,0 +1,154 @@
+import json
+import logging
+import random
+import time
+import zlib
+from typing import Optional, Dict, Any, List, Tuple
+from answer_cache import normalize_question
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# How each label is answered: canned reply, knowledge base lookup, short prompt or full generation
+LABEL_ROUTES = {
+    'greeting': 'canned',
+    'thanks': 'canned',
+    'out_of_scope': 'canned',
+    'lookup': 'knowledge',
+    'short': 'short',
+    'full': 'full',
+}
+NGRAM_SIZES = (2, 3, 4, 5)
+HASH_BUCKETS = 1 << 20
+
+def features(text: str) -> List[int]:
+    """Hashed character 2-5 grams, words and word pairs of the normalized text, plus a bias feature"""
+    text = normalize_question(text)
+    words = text.split()
+    padded = f" {text} "
+    grams = {''}
+    for size in NGRAM_SIZES:
+        grams.update(padded[i:i + size] for i in range(len(padded) - size + 1))
+    grams.update(f"w:{word}" for word in words)
+    grams.update(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+    # crc32 rather than hash() so a model trained in one process scores the same in another
+    return list({zlib.crc32(gram.encode('utf-8')) % HASH_BUCKETS for gram in grams})
+
+class IntentClassifier:
+    """Averaged multi-class perceptron over hashed character n-gram and word features"""
+
+    def __init__(self, labels: List[str], weights: Dict[int, List[float]]):
+        self.labels = labels
+        self.weights = weights
+
+    @classmethod
+    def train(cls, examples: List[Tuple[str, str]], epochs: int = 12, seed: int = 1) -> 'IntentClassifier':
+        """Fit on (text, label) pairs; averaging the weights over every step keeps it stable on small sets"""
+        labels = sorted({label for _, label in examples})
+        size = len(labels)
+        data = [(features(text), labels.index(label)) for text, label in examples]
+        weights: Dict[int, List[float]] = {}
+        totals: Dict[int, List[float]] = {}
+        stamps: Dict[int, List[int]] = {}
+        step = 0
+        rng = random.Random(seed)
+
+        def update(feature: int, label: int, delta: float) -> None:
+            w = weights.setdefault(feature, [0.0] * size)
+            total = totals.setdefault(feature, [0.0] * size)
+            stamp = stamps.setdefault(feature, [0] * size)
+            # Lazily add the weight's value over the steps since its last change
+            total[label] += (step - stamp[label]) * w[label]
+            stamp[label] = step
+            w[label] += delta
+
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for grams, label in data:
+                step += 1
+                scores = cls._scores(weights, grams, size)
+                guess = max(range(size), key=scores.__getitem__)
+                if guess != label:
+                    for gram in grams:
+                        update(gram, label, 1.0)
+                        update(gram, guess, -1.0)
+
+        averaged = {
+            feature: [(totals[feature][i] + (step - stamps[feature][i]) * w[i]) / step for i in range(size)]
+            for feature, w in weights.items()
+        }
+        return cls(labels, averaged)
+
+    @staticmethod
+    def _scores(weights: Dict[int, List[float]], grams: List[int], size: int) -> List[float]:
+        """Per-label sums of the weights of the features present"""
+        rows = [w for w in map(weights.get, grams) if w is not None]
+        return [sum(column) for column in zip(*rows)] if rows else [0.0] * size
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Best label and its margin over the runner-up"""
+        scores = self._scores(self.weights, features(text), len(self.labels))
+        ranked = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        return self.labels[ranked[0]], scores[ranked[0]] - scores[ranked[1]]
+
+def load_examples(path: str = Config.CLASSIFIER_DATA_PATH) -> List[Tuple[str, str]]:
+    """Read the bundled labelled questions as (text, label) pairs"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return [(text, label) for label, texts in data['examples'].items() for text in texts]
+
+class IntentRouter:
+    """Decides how a question is answered before anything is sent to Gemini
+
+    Uncertain predictions fall back to full generation. Canned replies need
+    a wider margin and a short message, so a real question that happens to
+    start with a greeting still reaches the model.
+    """
+
+    def __init__(self, classifier: IntentClassifier, min_margin: float = Config.CLASSIFIER_MIN_MARGIN,
+                 canned_min_margin: float = Config.CLASSIFIER_CANNED_MIN_MARGIN,
+                 canned_max_words: int = Config.CLASSIFIER_CANNED_MAX_WORDS):
+        self.classifier = classifier
+        self.min_margin = min_margin
+        self.canned_min_margin = canned_min_margin
+        self.canned_max_words = canned_max_words
+        self.routed: Dict[str, int] = {}
+        self.route_seconds = 0.0
+
+    @classmethod
+    def from_config(cls) -> Optional['IntentRouter']:
+        """Train on the bundled labelled set, or None when routing is disabled"""
+        if not Config.CLASSIFIER_ENABLED:
+            return None
+        try:
+            start = time.perf_counter()
+            examples = load_examples(Config.CLASSIFIER_DATA_PATH)
+            router = cls(IntentClassifier.train(examples))
+            logger.info(f"✅ Intent classifier trained on {len(examples)} examples "
+                        f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+            return router
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"❌ Failed to train intent classifier: {e}")
+            return None
+
+    def route(self, user_message: str) -> Tuple[str, str]:
+        """(label, route) for a question; route is canned, knowledge, short or full"""
+        start = time.perf_counter()
+        label, margin = self.classifier.predict(user_message)
+        route = LABEL_ROUTES[label]
+        if margin < self.min_margin:
+            label, route = 'full', 'full'
+        elif route == 'canned' and (margin < self.canned_min_margin
+                                    or len(user_message.split()) > self.canned_max_words):
+            label, route = 'full', 'full'
+        self.routed[label] = self.routed.get(label, 0) + 1
+        self.route_seconds += time.perf_counter() - start
+        return label, route
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get routing counters"""
+        routed = sum(self.routed.values())
+        return {
+            'by_label': dict(self.routed),
+            'avg_route_us': round(self.route_seconds / routed * 1e6, 1) if routed else 0.0
+        }
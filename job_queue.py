@@ -0,0 +1,321 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, List, Callable
+from urllib.parse import urlparse
+import requests
+from answer_cache import AnswerCache
+from config import Config
+from metrics import Histogram, metrics
+from rate_limiter import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+# Answer sources worth another attempt; anything else is final
+RETRYABLE_SOURCES = ('server_error', 'timeout', 'empty_response')
+
+# Job states; 'running' jobs whose lease expired are picked up again
+PENDING_STATES = ('queued', 'running')
+
+_COLUMNS = ('id, question, session_id, profile, callback_url, state, attempts, result, error, '
+            'created_at, started_at, finished_at')
+
+def callback_allowed(url: str) -> bool:
+    """Check that a webhook URL is http(s) on one of JOB_CALLBACK_HOSTS"""
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return False
+    return parsed.scheme in ('http', 'https') and parsed.hostname in Config.JOB_CALLBACK_HOSTS
+
+class JobQueue:
+    """Chat questions answered in the background, persisted in SQLite for SMS/IVR/WhatsApp gateways
+
+    Jobs survive restarts: a worker leases the job it answers, and a job
+    whose lease runs out (its process died) is answered again. Workers of
+    every process share the file, claiming jobs in IMMEDIATE transactions.
+    Queued jobs asking the same question are claimed and answered together.
+    Failed answers are retried with exponential backoff; a full Gemini quota
+    puts the job back without using up an attempt, so the queue drains at
+    the upstream rate limit.
+    """
+
+    def __init__(self, path: str, answer: Callable[..., Dict[str, Any]], workers: int):
+        self.path = path
+        self.answer = answer
+        self.workers = workers
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.retries = 0
+        self.callbacks = 0
+        self.callback_errors = 0
+        self.wait_time = Histogram()
+        self.processing_time = Histogram()
+        self._finished_writes = 0
+        self._threads: List[threading.Thread] = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    @classmethod
+    def from_config(cls, answer: Callable[..., Dict[str, Any]]) -> Optional['JobQueue']:
+        """Build the queue described by Config, or None when JOB_QUEUE_PATH is unset"""
+        if not Config.JOB_QUEUE_PATH:
+            return None
+        try:
+            queue = cls(Config.JOB_QUEUE_PATH, answer, Config.JOB_WORKERS)
+            logger.info(f"✅ Chat jobs queued at {Config.JOB_QUEUE_PATH}")
+            return queue
+        except sqlite3.Error as e:
+            logger.error(f"❌ Failed to open job queue: {e}")
+            return None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode, so claims can open their own BEGIN IMMEDIATE transactions
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, question TEXT NOT NULL, dedup_key TEXT, session_id TEXT, profile TEXT, '
+            'callback_url TEXT, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+            'result TEXT, error TEXT, created_at REAL NOT NULL, available_at REAL NOT NULL, '
+            'started_at REAL, finished_at REAL, lease_until REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, available_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key, state)')
+        return conn
+
+    def reopen(self) -> None:
+        """Open a fresh connection; SQLite connections must not be shared across fork"""
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def start(self) -> None:
+        """Start the worker threads (in each serving process, never before fork)"""
+        if self._threads:
+            return
+        self._stopping.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the workers; a job in progress is answered again by the next process to start"""
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, question: str, session_id: Optional[str] = None, profile: Optional[str] = None,
+               callback_url: Optional[str] = None) -> Dict[str, Any]:
+        """Queue a question and return its job"""
+        job_id = os.urandom(12).hex()
+        # Follow-ups depend on the conversation, so only stateless questions are deduplicated
+        dedup_key = None if session_id else f"{profile or ''}|{AnswerCache.make_key(question)}"
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, question, dedup_key, session_id, profile, callback_url, state, '
+                'created_at, available_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, question, dedup_key, session_id, profile, callback_url, 'queued', now, now)
+            )
+        self.submitted += 1
+        self._wake.set()
+        return {'job_id': job_id, 'state': 'queued', 'attempts': 0, 'created_at': now}
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a job by id; None when it is unknown or expired"""
+        with self._lock:
+            row = self._conn.execute(f'SELECT {_COLUMNS} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._view(row) if row else None
+
+    @staticmethod
+    def _view(row: tuple) -> Dict[str, Any]:
+        """Public form of a job row"""
+        (job_id, _, _, _, _, state, attempts, result, error, created_at, started_at, finished_at) = row
+        job = {'job_id': job_id, 'state': state, 'attempts': attempts, 'created_at': created_at}
+        if started_at is not None:
+            job['started_at'] = started_at
+        if finished_at is not None:
+            job['finished_at'] = finished_at
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error:
+            job['error'] = error
+        return job
+
+    def _claim(self) -> Optional[List[tuple]]:
+        """Lease the next ready job plus queued jobs with the same question; None when idle"""
+        now = time.time()
+        lease_until = now + Config.JOB_LEASE_SECONDS
+        ready = "((state = 'queued' AND available_at <= ?) OR (state = 'running' AND lease_until < ?))"
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Jobs whose worker died on their last attempt are given up on
+                abandoned = self._conn.execute(
+                    "UPDATE jobs SET state = 'failed', error = 'worker lost', finished_at = ? "
+                    "WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, now, Config.JOB_MAX_ATTEMPTS)
+                ).rowcount
+                row = self._conn.execute(
+                    f'SELECT id, dedup_key FROM jobs WHERE {ready} ORDER BY available_at LIMIT 1', (now, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute('COMMIT')
+                    self.failed += abandoned
+                    return None
+                if row[1] is None:
+                    ids = [row[0]]
+                else:
+                    ids = [job_id for (job_id,) in self._conn.execute(
+                        f'SELECT id FROM jobs WHERE dedup_key = ? AND {ready}', (row[1], now, now))]
+                marks = ','.join('?' * len(ids))
+                self._conn.execute(
+                    f"UPDATE jobs SET state = 'running', attempts = attempts + 1, lease_until = ?, "
+                    f"started_at = COALESCE(started_at, ?) WHERE id IN ({marks})",
+                    (lease_until, now, *ids)
+                )
+                rows = self._conn.execute(f'SELECT {_COLUMNS} FROM jobs WHERE id IN ({marks})', ids).fetchall()
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        self.failed += abandoned
+        if abandoned:
+            logger.warning(f"🛑 Gave up on {abandoned} job(s) whose worker stopped on the last attempt")
+        # The job whose turn it was leads; the others share its answer
+        rows.sort(key=lambda job: job[0] != row[0])
+        return rows
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                jobs = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"❌ Failed to claim a job: {e}")
+                jobs = None
+            if not jobs:
+                self._wake.wait(Config.JOB_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            try:
+                self._process(jobs)
+            except Exception as e:
+                # The lease runs out and another attempt is made
+                logger.error(f"❌ Job {jobs[0][0]} failed: {e}")
+
+    def _process(self, jobs: List[tuple]) -> None:
+        """Answer the leading job once for every job in the group"""
+        job_id, question, session_id, profile, _, _, attempts = jobs[0][:7]
+        start = time.time()
+        if len(jobs) > 1:
+            self.deduplicated += len(jobs) - 1
+        deadline = time.monotonic() + Config.JOB_TIMEOUT
+        try:
+            result = self.answer(question, session_id, deadline, profile)
+        except RateLimitExceeded as e:
+            # No room in the Gemini quota: wait for it without using up an attempt
+            self._requeue(jobs, e.retry_after, refund=True)
+            return
+        self._record(self.processing_time, 'processing', time.time() - start)
+
+        if result['source'] in RETRYABLE_SOURCES:
+            if attempts < Config.JOB_MAX_ATTEMPTS:
+                delay = min(Config.JOB_BACKOFF_MAX, Config.JOB_BACKOFF_BASE * 2 ** (attempts - 1))
+                self._requeue(jobs, delay * random.uniform(0.5, 1.0))
+                self.retries += len(jobs)
+                return
+            logger.warning(f"🛑 Job {job_id} failed after {attempts} attempts ({result['source']})")
+            self._finish(jobs, result, 'failed', result['source'])
+        else:
+            self._finish(jobs, result, 'done')
+
+    def _record(self, histogram: Histogram, phase: str, seconds: float) -> None:
+        histogram.record(seconds)
+        metrics.observe_job(phase, seconds)
+
+    def _requeue(self, jobs: List[tuple], delay: float, refund: bool = False) -> None:
+        """Put leased jobs back to be claimed again after delay seconds"""
+        ids = [job[0] for job in jobs]
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET state = 'queued', available_at = ?, lease_until = NULL, "
+                f"attempts = attempts - ? WHERE id IN ({','.join('?' * len(ids))})",
+                (time.time() + delay, 1 if refund else 0, *ids)
+            )
+
+    def _finish(self, jobs: List[tuple], result: Dict[str, Any], state: str, error: Optional[str] = None) -> None:
+        """Store the answer on every job in the group and call their webhooks"""
+        ids = [job[0] for job in jobs]
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET state = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL "
+                f"WHERE id IN ({','.join('?' * len(ids))})",
+                (state, json.dumps(result, ensure_ascii=False), error, now, *ids)
+            )
+            self._finished_writes += 1
+            if self._finished_writes % 500 == 0:
+                self._conn.execute("DELETE FROM jobs WHERE state IN ('done', 'failed') AND finished_at < ?",
+                                   (now - Config.JOB_RETENTION_SECONDS,))
+        if state == 'done':
+            self.completed += len(jobs)
+        else:
+            self.failed += len(jobs)
+        for job in jobs:
+            # Time from submission to the first attempt
+            self._record(self.wait_time, 'wait', job[10] - job[9])
+            if job[4]:
+                self._call_back(job[4], self.get(job[0]))
+
+    def _call_back(self, url: str, job: Optional[Dict[str, Any]]) -> None:
+        """POST a finished job to its webhook; failures are logged, the job stays pollable"""
+        try:
+            requests.post(url, json=job, timeout=Config.JOB_CALLBACK_TIMEOUT).raise_for_status()
+            self.callbacks += 1
+        except requests.RequestException as e:
+            self.callback_errors += 1
+            logger.warning(f"Job webhook {url} failed: {e}")
+
+    @staticmethod
+    def _quantiles(histogram: Histogram) -> Dict[str, float]:
+        counts, total = histogram.snapshot()
+        count = sum(counts)
+        return {
+            'count': count,
+            'avg_ms': round(total / count * 1000, 1) if count else 0.0,
+            'p50_ms': round(Histogram.quantile(counts, 0.5) * 1000, 1),
+            'p95_ms': round(Histogram.quantile(counts, 0.95) * 1000, 1)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth across processes plus this process's counters and timings"""
+        with self._lock:
+            depth = dict(self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+            oldest = self._conn.execute("SELECT MIN(created_at) FROM jobs WHERE state = 'queued'").fetchone()[0]
+        return {
+            'path': self.path,
+            'workers': len(self._threads),
+            'depth': {state: depth.get(state, 0) for state in ('queued', 'running', 'done', 'failed')},
+            'oldest_queued_s': round(time.time() - oldest, 1) if oldest is not None else 0.0,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'deduplicated': self.deduplicated,
+            'retries': self.retries,
+            'callbacks': self.callbacks,
+            'callback_errors': self.callback_errors,
+            'wait': self._quantiles(self.wait_time),
+            'processing': self._quantiles(self.processing_time)
+        }
@@ -0,0 +1,358 @@
+import array
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import time
+import zlib
+from collections import Counter
+from typing import Optional, Dict, Any, List
+from answer_cache import normalize_question
+from config import Config
+
+try:
+    import numpy as np
+except ImportError:  # The vector index is optional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+VECTOR_DIM = 512
+SOURCE_EXTENSIONS = ('.md', '.markdown', '.json')
+MAX_PASSAGE_CHARS = 1500
+
+_STOPWORDS = frozenset(
+    'a an and are at be can do does for from get how i in is it me my of on or '
+    'the to what when where which who with you your'.split()
+    + ['ఎలా', 'ఏమిటి', 'మరియు', 'కోసం', 'నా', 'నేను', 'ఈ', 'ఆ', 'ఒక']
+)
+
+# Case/postposition endings stripped from Telugu words (longest first)
+_TELUGU_SUFFIXES = ('యొక్క', 'లోని', 'లకు', 'లను', 'లో', 'కు', 'కి', 'ను', 'ని', 'తో')
+
+
+def _stem(token: str) -> str:
+    """Strip common Telugu postpositions and English plurals"""
+    if '\u0c00' <= token[0] <= '\u0c7f':
+        for suffix in _TELUGU_SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= 2:
+                return token[:-len(suffix)]
+        return token
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokenize Telugu/English text into normalized search terms"""
+    return [_stem(token) for token in normalize_question(text).split() if token not in _STOPWORDS]
+
+
+def embed(text: str) -> 'np.ndarray':
+    """Hash character trigrams into a unit-length vector (needs NumPy)"""
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    padded = f" {normalize_question(text)} "
+    for i in range(len(padded) - 2):
+        vector[zlib.crc32(padded[i:i + 3].encode('utf-8')) % VECTOR_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _parse_markdown(path: str) -> List[Dict[str, Any]]:
+    """Split a Markdown procedure file into one passage per heading"""
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    doc_title = os.path.splitext(os.path.basename(path))[0]
+    passages = []
+    heading, body = None, []
+
+    def flush():
+        text = '\n'.join(body).strip()
+        if text:
+            title = doc_title if heading in (None, doc_title) else f"{doc_title} - {heading}"
+            passages.append({'title': title, 'text': text[:MAX_PASSAGE_CHARS]})
+
+    for line in lines:
+        if line.startswith('#'):
+            flush()
+            level = len(line) - len(line.lstrip('#'))
+            heading, body = line.lstrip('#').strip(), []
+            if level == 1:
+                doc_title = heading
+        else:
+            body.append(line)
+    flush()
+    return passages
+
+
+def _parse_json(path: str) -> List[Dict[str, Any]]:
+    """Read passages from a JSON object or list of objects"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    passages = []
+    for entry in data if isinstance(data, list) else [data]:
+        text = entry.get('text') or entry.get('content') or ''
+        passages.append({
+            'title': entry.get('title', os.path.basename(path)),
+            'text': text[:MAX_PASSAGE_CHARS],
+            'questions': entry.get('questions', []),
+            'answer': entry.get('answer')
+        })
+    return passages
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Write a file so readers never see a partial index"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_index(source_dir: str = Config.KB_SOURCE_DIR,
+                index_dir: str = Config.KB_INDEX_DIR) -> Dict[str, Any]:
+    """Build or incrementally refresh the on-disk index for a source directory
+
+    Only files whose size or mtime changed are re-parsed and re-tokenized;
+    postings are then reassembled from the cached term counts.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    sources_path = os.path.join(index_dir, 'sources.json')
+    meta_path = os.path.join(index_dir, 'meta.json')
+
+    previous: Dict[str, Any] = {}
+    if os.path.exists(sources_path):
+        with open(sources_path, encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('version') != INDEX_VERSION:
+            previous = {}
+    known_files = previous.get('files', {})
+
+    files: Dict[str, Any] = {}
+    changed = 0
+    for root, _, names in os.walk(source_dir):
+        for name in sorted(names):
+            if not name.lower().endswith(SOURCE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, source_dir)
+            stat = os.stat(path)
+            signature = [stat.st_mtime_ns, stat.st_size]
+
+            entry = known_files.get(rel_path)
+            if entry and entry['signature'] == signature:
+                files[rel_path] = entry
+                continue
+
+            try:
+                passages = _parse_json(path) if name.lower().endswith('.json') else _parse_markdown(path)
+            except (OSError, ValueError, AttributeError) as e:
+                logger.error(f"❌ Skipping knowledge file {rel_path}: {e}")
+                continue
+            for passage in passages:
+                index_text = ' '.join([passage['title'], *passage.get('questions', []), passage['text']])
+                passage['terms'] = dict(Counter(tokenize(index_text)))
+            files[rel_path] = {'signature': signature, 'passages': passages}
+            changed += 1
+
+    removed = len(set(known_files) - set(files))
+    stats = {'files': len(files), 'changed': changed, 'removed': removed}
+    if not changed and not removed and os.path.exists(meta_path):
+        stats['docs'] = sum(len(entry['passages']) for entry in files.values())
+        return stats
+
+    # Assemble postings from the per-file term counts
+    docs, lengths, vectors = [], [], []
+    postings: Dict[str, List[tuple]] = {}
+    for rel_path in sorted(files):
+        for passage in files[rel_path]['passages']:
+            doc_id = len(docs)
+            docs.append({
+                'id': f"{rel_path}#{doc_id}",
+                'source': rel_path,
+                'title': passage['title'],
+                'text': passage['text'],
+                'answer': passage.get('answer')
+            })
+            lengths.append(sum(passage['terms'].values()))
+            for term, count in passage['terms'].items():
+                postings.setdefault(term, []).append((doc_id, count))
+            if np is not None:
+                vectors.append(embed(' '.join(
+                    [passage['title'], *passage.get('questions', []), passage['text'][:200]]
+                )))
+
+    doc_count = len(docs)
+    vocab = {}
+    doc_ids, tfs = array.array('I'), array.array('H')
+    for term in sorted(postings):
+        entries = postings[term]
+        df = len(entries)
+        idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+        vocab[term] = [len(doc_ids), df, round(idf, 6)]
+        for doc_id, count in entries:
+            doc_ids.append(doc_id)
+            tfs.append(min(count, 0xFFFF))
+
+    _write_atomic(os.path.join(index_dir, 'postings.bin'), doc_ids.tobytes() + tfs.tobytes())
+    vectors_path = os.path.join(index_dir, 'vectors.npy')
+    if np is not None and vectors:
+        tmp_path = os.path.join(index_dir, 'vectors.tmp.npy')
+        np.save(tmp_path, np.vstack(vectors))
+        os.replace(tmp_path, vectors_path)
+    elif os.path.exists(vectors_path):
+        os.remove(vectors_path)
+
+    meta = {
+        'version': INDEX_VERSION,
+        'built_at': time.time(),
+        'doc_count': doc_count,
+        'avg_doc_length': (sum(lengths) / doc_count) if doc_count else 0.0,
+        'postings_count': len(doc_ids),
+        'doc_lengths': lengths,
+        'docs': docs,
+        'vocab': vocab
+    }
+    _write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+    _write_atomic(sources_path, json.dumps(
+        {'version': INDEX_VERSION, 'files': files}, ensure_ascii=False
+    ).encode('utf-8'))
+
+    stats['docs'] = doc_count
+    logger.info(f"📚 Knowledge index rebuilt: {stats}")
+    return stats
+
+
+class KnowledgeBase:
+    """BM25 search over a memory-mapped index of government procedure notes"""
+
+    def __init__(self, index_dir: str = Config.KB_INDEX_DIR):
+        self.index_dir = index_dir
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        self.direct_answers = 0
+
+        with open(os.path.join(index_dir, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        self.docs: List[Dict[str, Any]] = meta['docs']
+        self.vocab: Dict[str, List] = meta['vocab']
+        avg_length = meta['avg_doc_length'] or 1.0
+        self._norms = [BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                       for length in meta['doc_lengths']]
+        self._max_idf = max((entry[2] for entry in self.vocab.values()), default=1.0)
+
+        # Postings: [doc ids as uint32][term frequencies as uint16]
+        count = meta['postings_count']
+        self._file = open(os.path.join(index_dir, 'postings.bin'), 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if count else None
+        view = memoryview(self._mmap) if count else memoryview(b'')
+        self._doc_ids = view[:4 * count].cast('I')
+        self._tfs = view[4 * count:6 * count].cast('H')
+
+        vectors_path = os.path.join(index_dir, 'vectors.npy')
+        self._vectors = None
+        if np is not None and os.path.exists(vectors_path):
+            self._vectors = np.load(vectors_path, mmap_mode='r')
+
+    @classmethod
+    def from_config(cls) -> Optional['KnowledgeBase']:
+        """Refresh the index from KB_SOURCE_DIR and load it, if enabled"""
+        if not Config.KB_ENABLED or not os.path.isdir(Config.KB_SOURCE_DIR):
+            return None
+        try:
+            build_index(Config.KB_SOURCE_DIR, Config.KB_INDEX_DIR)
+            knowledge_base = cls(Config.KB_INDEX_DIR)
+            logger.info(f"✅ Knowledge base loaded: {len(knowledge_base.docs)} passages")
+            return knowledge_base
+        except Exception as e:
+            logger.error(f"❌ Failed to load knowledge base: {e}")
+            return None
+
+    def search(self, query: str, top_k: int = Config.KB_TOP_K) -> List[Dict[str, Any]]:
+        """Return the top passages for a query with BM25 score and confidence
+
+        Confidence is the IDF-weighted share of query terms found in the passage.
+        Vector similarity fills remaining slots when BM25 finds too few matches.
+        """
+        start = time.perf_counter()
+        scores: Dict[int, float] = {}
+        covered: Dict[int, float] = {}
+        total_idf = 0.0
+
+        for term in set(tokenize(query)):
+            entry = self.vocab.get(term)
+            if entry is None:
+                total_idf += self._max_idf
+                continue
+            offset, df, idf = entry
+            total_idf += idf
+            for i in range(offset, offset + df):
+                doc_id = self._doc_ids[i]
+                tf = self._tfs[i]
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + self._norms[doc_id])
+                covered[doc_id] = covered.get(doc_id, 0.0) + idf
+
+        ranked = heapq.nlargest(top_k, scores, key=scores.get)
+        results = [
+            {**self.docs[doc_id], 'score': round(scores[doc_id], 4),
+             'confidence': round(covered[doc_id] / total_idf, 4)}
+            for doc_id in ranked
+        ]
+
+        if self._vectors is not None and len(results) < top_k:
+            similarities = self._vectors @ embed(query)
+            for doc_id in np.argsort(-similarities)[:top_k]:
+                similarity = float(similarities[doc_id])
+                if len(results) >= top_k or similarity < Config.KB_VECTOR_MIN_SIMILARITY:
+                    break
+                if int(doc_id) not in scores:
+                    results.append({**self.docs[int(doc_id)], 'score': 0.0,
+                                    'confidence': round(similarity, 4)})
+
+        self.lookups += 1
+        self.lookup_seconds += time.perf_counter() - start
+        return results
+
+    def direct_answer(self, hits: List[Dict[str, Any]], min_confidence: Optional[float] = None) -> Optional[str]:
+        """Return a canned answer when the best hit is confident enough
+
+        min_confidence overrides KB_DIRECT_ANSWER_CONFIDENCE, e.g. for questions
+        already classified as simple lookups.
+        """
+        if min_confidence is None:
+            min_confidence = Config.KB_DIRECT_ANSWER_CONFIDENCE
+        if hits and hits[0].get('answer') and hits[0]['confidence'] >= min_confidence:
+            self.direct_answers += 1
+            return hits[0]['answer']
+        return None
+
+    def close(self) -> None:
+        """Release the memory-mapped index"""
+        self._doc_ids.release()
+        self._tfs.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get knowledge base statistics"""
+        return {
+            'passages': len(self.docs),
+            'terms': len(self.vocab),
+            'vector_index': self._vectors is not None,
+            'lookups': self.lookups,
+            'avg_lookup_us': round(self.lookup_seconds / self.lookups * 1e6, 1) if self.lookups else 0.0,
+            'direct_answers': self.direct_answers
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(build_index())
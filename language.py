@@ -0,0 +1,94 @@
+# Script classes for every codepoint below U+0C80 (end of the Telugu block)
+OTHER, LATIN, TELUGU = map(chr, range(3))
+
+
+def _build_script_table() -> str:
+    """Precompute a str.translate table mapping each codepoint to its script class
+
+    The whole Telugu block counts as Telugu (letters, vowel signs, virama,
+    digits and marks), so conjuncts and numerals are not missed. Codepoints
+    past the table are left untouched by str.translate and never collide
+    with the class characters, so counting classes stays exact.
+    """
+    table = [OTHER] * 0x0C80
+    for cp in list(range(0x41, 0x5B)) + list(range(0x61, 0x7B)):
+        table[cp] = LATIN
+    for cp in range(0x0C00, 0x0C80):
+        table[cp] = TELUGU
+    return ''.join(table)
+
+
+_SCRIPT_TABLE = _build_script_table()
+
+# Common Telugu words as typed in Latin letters (no short words that clash
+# with names such as "Mee Seva")
+_ROMANIZED_TELUGU = frozenset('''
+ela elaa enti emiti emi ekkada eppudu enduku evaru entha enta enni
+cheyali cheyyali cheyadam cheyyadaniki kavali kaavali kaavaali ledu ledhu undi unnayi unnadi
+naaku naku meeru nenu memu ante kosam dwara tho nundi varaku
+ivvandi cheppandi telusu teliyadu dorukutundi vastundi raavali pettali teesukovali
+rojulu patralu kharchu dabbu ammaku nannaku amma nanna intlo lo
+dharakhastu darakhastu sarkari prabhutva pathralu pathram
+'''.split())
+_PUNCTUATION = '?!.,;:\'"()'
+
+LANGUAGE_NAMES = {
+    'te': 'Telugu',
+    'en': 'English',
+    'mixed': 'Telugu, keeping official English terms as they are',
+    'romanized-te': 'Telugu written in English letters (the way the user wrote it)',
+}
+
+
+class ScriptProfile:
+    """Script make-up of a piece of text"""
+
+    __slots__ = ('label', 'telugu_ratio', 'latin_ratio', 'telugu_chars', 'latin_chars')
+
+    def __init__(self, label: str, telugu_chars: int, latin_chars: int):
+        total = telugu_chars + latin_chars
+        self.label = label  # 'te', 'en', 'mixed' or 'romanized-te'
+        self.telugu_chars = telugu_chars
+        self.latin_chars = latin_chars
+        self.telugu_ratio = telugu_chars / total if total else 0.0
+        self.latin_ratio = latin_chars / total if total else 0.0
+
+    def __repr__(self) -> str:
+        return (f"ScriptProfile(label={self.label!r}, telugu_ratio={self.telugu_ratio:.3f}, "
+                f"latin_ratio={self.latin_ratio:.3f})")
+
+
+def _is_romanized_telugu(text: str) -> bool:
+    """Check if Latin-script text contains enough romanized Telugu words"""
+    words = text.lower().split()
+    hits = sum(1 for word in words if word.strip(_PUNCTUATION) in _ROMANIZED_TELUGU)
+    return hits >= max(1, 0.2 * len(words))
+
+
+def detect_script(text: str) -> ScriptProfile:
+    """Classify text as Telugu, English, mixed (Tenglish) or romanized Telugu in one pass"""
+    classes = text.translate(_SCRIPT_TABLE)
+    latin = classes.count(LATIN)
+    telugu = classes.count(TELUGU)
+
+    total = latin + telugu
+    if not total:
+        label = 'en'
+    elif telugu >= 0.8 * total:
+        label = 'te'
+    elif latin >= 0.8 * total:
+        label = 'romanized-te' if _is_romanized_telugu(text) else 'en'
+    else:
+        label = 'mixed'
+    return ScriptProfile(label, telugu, latin)
+
+
+def detect_language(text: str) -> str:
+    """Return just the language label for text
+
+    ASCII text has no Telugu characters, so only the romanized Telugu check
+    decides between 'romanized-te' and 'en'.
+    """
+    if text.isascii():
+        return 'romanized-te' if _is_romanized_telugu(text) else 'en'
+    return detect_script(text).label
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Production launcher: load the app once, then serve it from several forked worker processes
+
+    python launcher.py                          # WORKERS, default one per CPU core
+    WORKERS=4 WORKER_MAX_REQUESTS=5000 python launcher.py
+
+Signals to the master process:
+
+    SIGHUP           reload without dropping connections: the master re-executes
+                     itself with the new code on the same listening socket, starts
+                     new workers and then lets the old ones finish their requests
+    SIGTERM, SIGINT  stop: workers finish in-flight requests (WORKER_GRACEFUL_TIMEOUT)
+
+SERVER_MODE picks the Flask (threaded WSGI) or Starlette (uvicorn) app. The
+workers share cached answers, sessions and rate-limit counters through a
+store process on a Unix socket (shared_store.py); metrics stay per worker.
+"""
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Set, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables before Config is imported
+load_dotenv()
+
+from config import Config  # noqa: E402
+from log_pipeline import configure_logging, shutdown_logging  # noqa: E402
+from shared_store import SharedStore, SharedStoreError, serve  # noqa: E402
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Handed from a master to the one it re-executes into on SIGHUP
+_LISTEN_FD_ENV = 'LAUNCHER_LISTEN_FD'
+_OLD_WORKERS_ENV = 'LAUNCHER_OLD_WORKERS'
+_STORE_PID_ENV = 'LAUNCHER_STORE_PID'
+
+# Keep-alive connections idle longer than this are closed, so a stopping worker is not held up by them
+KEEP_ALIVE_TIMEOUT = 5
+
+def load_app() -> Tuple[Any, Any]:
+    """Build the application for SERVER_MODE; returns (app, response handler)"""
+    if Config.SERVER_MODE == 'asgi':
+        from async_app import AsyncGovernmentHelperApp
+        application = AsyncGovernmentHelperApp(start_jobs=False)
+    else:
+        from app import GovernmentHelperApp
+        application = GovernmentHelperApp(start_jobs=False)
+    return application.app, application.response_handler
+
+def serve_wsgi(wsgi_app: Any, sock: socket.socket, max_requests: int) -> None:
+    """Serve the Flask app on a threaded server until SIGTERM or max_requests"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class RequestHandler(WSGIRequestHandler):
+        timeout = KEEP_ALIVE_TIMEOUT
+
+    served = 0
+    lock = threading.Lock()
+    stopping = threading.Event()
+
+    def stop() -> None:
+        if not stopping.is_set():
+            stopping.set()
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def counted_app(environ, start_response):
+        nonlocal served
+        with lock:
+            served += 1
+            if max_requests and served >= max_requests:
+                logger.info(f"♻️ Worker {os.getpid()} served {served} requests, recycling")
+                stop()
+        return wsgi_app(environ, start_response)
+
+    server = make_server(Config.HOST, Config.PORT, counted_app, threaded=True,
+                         request_handler=RequestHandler, fd=sock.fileno())
+    # Track request threads so closing the server waits for them
+    server.daemon_threads = False
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop())
+    server.serve_forever()
+
+    watchdog = threading.Timer(Config.WORKER_GRACEFUL_TIMEOUT, os._exit, args=(0,))
+    watchdog.daemon = True
+    watchdog.start()
+    server.server_close()
+
+def serve_asgi(asgi_app: Any, sock: socket.socket, max_requests: int) -> None:
+    """Serve the Starlette app under uvicorn, which handles SIGTERM and max_requests itself"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(
+        asgi_app,
+        log_config=None,
+        log_level='debug' if Config.DEBUG else 'info',
+        timeout_keep_alive=KEEP_ALIVE_TIMEOUT,
+        timeout_graceful_shutdown=int(Config.WORKER_GRACEFUL_TIMEOUT),
+        access_log=False,
+        limit_max_requests=max_requests or None
+    ))
+    server.run(sockets=[sock])
+
+class Master:
+    """Owns the listening socket, the shared store and the worker processes"""
+
+    def __init__(self, workers: int):
+        self.size = workers
+        # pid -> (slot, start time); the slot names the worker's log file
+        self.workers: Dict[int, Tuple[int, float]] = {}
+        self.sock = self._listen()
+        self.store_pid = int(os.environ.pop(_STORE_PID_ENV, 0)) or None
+        self.old_workers = [int(pid) for pid in os.environ.pop(_OLD_WORKERS_ENV, '').split(',') if pid]
+        self.app = None
+        self.handler = None
+        self.stopping = False
+        self._signals: List[int] = []
+        self._wake_r, self._wake_w = os.pipe()
+
+    def _listen(self) -> socket.socket:
+        """Bind the listening socket, or take over the one of the master this one replaced"""
+        fd = os.environ.pop(_LISTEN_FD_ENV, None)
+        if fd is not None:
+            sock = socket.socket(fileno=int(fd))
+        else:
+            sock = socket.create_server((Config.HOST, Config.PORT), backlog=2048)
+        sock.set_inheritable(False)
+        return sock
+
+    def _start_store(self) -> None:
+        """Fork the shared store process and wait until it answers"""
+        if not Config.SHARED_STORE_SOCKET:
+            Config.SHARED_STORE_SOCKET = os.path.join(tempfile.mkdtemp(prefix='govhelper-'), 'store.sock')
+            os.environ['SHARED_STORE_SOCKET'] = Config.SHARED_STORE_SOCKET
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._reset_child('store')
+                serve(Config.SHARED_STORE_SOCKET)
+            except BaseException:
+                logger.exception("❌ Shared store failed")
+                code = 1
+            finally:
+                shutdown_logging()
+                os._exit(code)
+        self.store_pid = pid
+
+        client = SharedStore(Config.SHARED_STORE_SOCKET)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                client.get_stats()
+                return
+            except SharedStoreError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _reset_child(self, name: str) -> None:
+        """Undo the master's signal setup in a forked child and restart its log writer"""
+        configure_logging(name, force=True)
+        signal.set_wakeup_fd(-1)
+        for signum in (signal.SIGTERM, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        # The master decides when children stop; terminal signals go to the whole group
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _free_slots(self) -> Set[int]:
+        return set(range(self.size)) - {slot for slot, _ in self.workers.values()}
+
+    def _spawn(self, slot: int) -> None:
+        """Fork one worker from the preloaded app"""
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._reset_child(f"worker{slot}")
+                # Forked workers would otherwise share one random sequence
+                random.seed()
+                self.handler.after_fork()
+                max_requests = Config.WORKER_MAX_REQUESTS
+                if max_requests:
+                    max_requests += random.randint(0, Config.WORKER_MAX_REQUESTS_JITTER)
+                serve_app = serve_asgi if Config.SERVER_MODE == 'asgi' else serve_wsgi
+                serve_app(self.app, self.sock, max_requests)
+            except BaseException:
+                logger.exception(f"❌ Worker {os.getpid()} failed")
+                code = 1
+            finally:
+                shutdown_logging()
+                os._exit(code)
+        self.workers[pid] = (slot, time.monotonic())
+
+    def _on_signal(self, signum: int, frame: Any) -> None:
+        self._signals.append(signum)
+
+    def run(self) -> None:
+        """Start the store and the workers, then supervise them until stopped"""
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        signal.set_wakeup_fd(self._wake_w)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+
+        if self.store_pid is None:
+            self._start_store()
+        start = time.perf_counter()
+        self.app, self.handler = load_app()
+        # Workers must not be forked while warm-up threads are still running
+        self.handler.wait_ready()
+        logger.info(f"🚀 Preloaded {Config.SERVER_MODE} app in {time.perf_counter() - start:.1f}s, "
+                    f"starting {self.size} workers on {Config.HOST}:{Config.PORT}")
+        for slot in range(self.size):
+            self._spawn(slot)
+        for pid in self.old_workers:
+            # The new workers already accept on the same socket
+            self._kill(pid, signal.SIGTERM)
+
+        while True:
+            select.select([self._wake_r], [], [], 1.0)
+            try:
+                while os.read(self._wake_r, 512):
+                    pass
+            except BlockingIOError:
+                pass
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum == signal.SIGHUP and not self.stopping:
+                    self.reload()
+                elif signum in (signal.SIGTERM, signal.SIGINT):
+                    self.stop()
+                    return
+            self._reap()
+            if not self.stopping:
+                for slot in sorted(self._free_slots()):
+                    self._spawn(slot)
+
+    def _reap(self) -> None:
+        """Collect exited children; a dead store is restarted (empty)"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            code = os.waitstatus_to_exitcode(status)
+            if pid == self.store_pid:
+                logger.error(f"❌ Shared store exited ({code}), restarting it")
+                self.store_pid = None
+                if not self.stopping:
+                    self._start_store()
+            elif pid in self.workers:
+                _, started = self.workers.pop(pid)
+                # uvicorn re-raises SIGTERM once it has shut down gracefully
+                if code and code != -signal.SIGTERM:
+                    logger.warning(f"Worker {pid} exited with {code}")
+                if time.monotonic() - started < 1.0 and not self.stopping:
+                    # Do not spin when workers crash on start
+                    time.sleep(1.0)
+            elif pid in self.old_workers:
+                self.old_workers.remove(pid)
+
+    def _kill(self, pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def reload(self) -> None:
+        """Re-execute the master with the current code, keeping the socket, store and workers"""
+        # Refuse a reload that could not start, so the running workers stay up
+        check = subprocess.run([sys.executable, '-c', 'import launcher; launcher.load_app()[1].wait_ready()'],
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if check.returncode:
+            logger.error(f"❌ Reload aborted, the new code fails to load:\n{check.stderr[-2000:]}")
+            return
+        logger.info(f"♻️ Reloading, {len(self.workers)} workers will finish their requests")
+        self.sock.set_inheritable(True)
+        env = dict(os.environ)
+        env[_LISTEN_FD_ENV] = str(self.sock.fileno())
+        env[_OLD_WORKERS_ENV] = ','.join(str(pid) for pid in list(self.workers) + self.old_workers)
+        env[_STORE_PID_ENV] = str(self.store_pid)
+        signal.set_wakeup_fd(-1)
+        shutdown_logging()
+        os.execve(sys.executable, [sys.executable, os.path.abspath(sys.argv[0])] + sys.argv[1:], env)
+
+    def stop(self) -> None:
+        """Stop the workers gracefully (SIGKILL after the timeout), then the store"""
+        self.stopping = True
+        workers = list(self.workers) + self.old_workers
+        logger.info(f"🛑 Stopping {len(workers)} workers")
+        for pid in workers:
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + Config.WORKER_GRACEFUL_TIMEOUT + 5
+        while (self.workers or self.old_workers) and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self._reap()
+        for pid in list(self.workers) + self.old_workers:
+            logger.warning(f"Worker {pid} did not stop in time, killing it")
+            self._kill(pid, signal.SIGKILL)
+        if self.store_pid is not None:
+            self._kill(self.store_pid, signal.SIGTERM)
+            os.waitpid(self.store_pid, 0)
+        self.sock.close()
+        try:
+            os.unlink(Config.SHARED_STORE_SOCKET)
+            os.rmdir(os.path.dirname(Config.SHARED_STORE_SOCKET))
+        except OSError:
+            pass  # a directory given in SHARED_STORE_SOCKET is left alone
+
+def main() -> None:
+    Master(Config.WORKERS or os.cpu_count() or 1).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterator, AsyncIterator
+from ai_client import GenerationBackend, UpstreamBusyError
+from config import Config
+from deadlines import DeadlineExceeded, remaining
+from generation_profiles import DEFAULT_PROFILE, PROFILES
+from prompts import SystemPrompts
+
+logger = logging.getLogger(__name__)
+
+class LocalModelBackend(GenerationBackend):
+    """Small quantized model run on the CPU with llama.cpp, answering while Gemini is unreachable
+
+    The GGUF file is memory-mapped, so its weights are loaded lazily from the
+    page cache and shared by every context and forked worker. Each of the
+    `workers` contexts generates one answer at a time on cores // workers
+    threads; requests wait for a free context at most LOCAL_MODEL_QUEUE_TIMEOUT
+    seconds. Needs the optional llama-cpp-python package.
+    """
+
+    name = 'local'
+    source = 'local_model'
+
+    def __init__(self, model_path: str, workers: int, threads: int, context_tokens: int, max_tokens: int,
+                 background: bool = Config.BACKGROUND_INIT):
+        super().__init__()
+        self.model_path = model_path
+        self.workers = workers
+        self.threads = threads
+        self.context_tokens = context_tokens
+        self.max_tokens = max_tokens
+        self.loaded = 0
+        self.generated = 0
+        self.rejected = 0
+        self.errors = 0
+        self.generation_seconds = 0.0
+        self._contexts: 'queue.Queue[Any]' = queue.Queue()
+        # Waiting for a free context blocks, so async callers wait on these threads
+        self._waiters = ThreadPoolExecutor(max_workers=Config.ASYNC_MAX_CONCURRENT_UPSTREAM,
+                                           thread_name_prefix='local-model')
+        self._start(background)
+
+    @classmethod
+    def from_config(cls) -> Optional['LocalModelBackend']:
+        """Build the backend described by Config, or None when no model is configured"""
+        if not Config.LOCAL_MODEL_PATH:
+            return None
+        cores = os.cpu_count() or 1
+        workers = Config.LOCAL_MODEL_WORKERS or max(1, cores // 4)
+        return cls(Config.LOCAL_MODEL_PATH, workers, max(1, cores // workers),
+                   Config.LOCAL_MODEL_CONTEXT, Config.LOCAL_MAX_TOKENS)
+
+    def _start(self, background: bool) -> None:
+        if background:
+            threading.Thread(target=self._load, name='local-model-init', daemon=True).start()
+        else:
+            self._load()
+
+    def _load(self) -> None:
+        """Open one llama.cpp context per worker on the mapped model file"""
+        start = time.perf_counter()
+        try:
+            from llama_cpp import Llama
+            for _ in range(self.workers):
+                self._contexts.put(Llama(model_path=self.model_path, n_ctx=self.context_tokens,
+                                         n_threads=self.threads, use_mmap=True, verbose=False))
+                self.loaded += 1
+            logger.info(f"✅ Local model loaded: {os.path.basename(self.model_path)} "
+                        f"({self.workers} x {self.threads} threads) in {(time.perf_counter() - start) * 1000:.0f} ms")
+        except ImportError:
+            logger.error("❌ Local model needs the llama-cpp-python package")
+        except Exception as e:
+            logger.error(f"❌ Failed to load local model: {e}")
+        finally:
+            self.init_seconds = time.perf_counter() - start
+            self._ready.set()
+
+    def reopen(self) -> None:
+        """Open fresh contexts in a forked worker; llama.cpp state is not fork-safe, the mapped file is"""
+        if not self.loaded:
+            return
+        self.loaded = 0
+        self._contexts = queue.Queue()
+        self._ready = threading.Event()
+        self._waiters = ThreadPoolExecutor(max_workers=Config.ASYNC_MAX_CONCURRENT_UPSTREAM,
+                                           thread_name_prefix='local-model')
+        self._start(Config.BACKGROUND_INIT)
+
+    def is_available(self) -> bool:
+        """Check if at least one context is loaded"""
+        return self.loaded > 0
+
+    def _checkout(self, deadline: Optional[float] = None) -> Any:
+        """Take a free context, waiting at most LOCAL_MODEL_QUEUE_TIMEOUT; raises UpstreamBusyError"""
+        left = remaining(deadline)
+        timeout = Config.LOCAL_MODEL_QUEUE_TIMEOUT if left is None else min(left, Config.LOCAL_MODEL_QUEUE_TIMEOUT)
+        try:
+            return self._contexts.get(timeout=timeout)
+        except queue.Empty:
+            remaining(deadline)
+            self.rejected += 1
+            logger.warning(f"⏳ Local model busy: {self.workers} answers in progress, request rejected")
+            raise UpstreamBusyError(retry_after=max(1.0, Config.LOCAL_MODEL_QUEUE_TIMEOUT))
+
+    def stream_response(self, prompt: str, deadline: Optional[float] = None,
+                        profile: Optional[str] = None) -> Iterator[str]:
+        """Stream answer text as the model generates it, stopping once the deadline passes
+
+        Answers use the profile's temperature and at most LOCAL_MAX_TOKENS
+        tokens. The system prompt leads every chat, so each context reuses
+        its evaluated prefix from the previous answer.
+        """
+        self._wait_init(deadline)
+        if not self.is_available():
+            logger.error("Local model not available")
+            return
+        if not prompt or len(prompt.strip()) == 0:
+            logger.error("Empty prompt provided")
+            return
+
+        settings = PROFILES[profile or DEFAULT_PROFILE]
+        context = self._checkout(deadline)
+        start = time.perf_counter()
+        try:
+            chunks = context.create_chat_completion(
+                messages=[
+                    {'role': 'system', 'content': SystemPrompts.MAIN_SYSTEM_PROMPT},
+                    {'role': 'user', 'content': prompt}
+                ],
+                max_tokens=min(self.max_tokens, settings['max_output_tokens']),
+                temperature=settings['temperature'],
+                stream=True
+            )
+            for chunk in chunks:
+                text = chunk['choices'][0]['delta'].get('content')
+                if not text:
+                    continue
+                remaining(deadline)
+                yield text
+            self.generated += 1
+            self.generation_seconds += time.perf_counter() - start
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Local model failed: {e}")
+            raise
+        finally:
+            self._contexts.put(context)
+
+    def generate_response(self, prompt: str, deadline: Optional[float] = None,
+                          profile: Optional[str] = None) -> Optional[str]:
+        """Generate a whole answer; None when the model fails or returns nothing"""
+        try:
+            text = ''.join(self.stream_response(prompt, deadline, profile)).strip()
+        except (DeadlineExceeded, UpstreamBusyError):
+            raise
+        except Exception:
+            return None
+        return text or None
+
+    async def generate_response_async(self, prompt: str, deadline: Optional[float] = None,
+                                      profile: Optional[str] = None) -> Optional[str]:
+        """Generate on a waiter thread so the event loop keeps serving"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._waiters, self.generate_response, prompt, deadline, profile)
+
+    async def stream_response_async(self, prompt: str, deadline: Optional[float] = None,
+                                    profile: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream by pulling each chunk on a waiter thread"""
+        chunks = self.stream_response(prompt, deadline, profile)
+        end = object()
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                text = await loop.run_in_executor(self._waiters, next, chunks, end)
+                if text is end:
+                    break
+                yield text
+        finally:
+            chunks.close()
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get local model status"""
+        return {
+            'available': self.is_available(),
+            'state': self.get_state(),
+            'init_ms': round(self.init_seconds * 1000) if self.init_seconds is not None else None,
+            'model': os.path.basename(self.model_path),
+            'workers': self.workers,
+            'threads': self.threads,
+            'busy': self.loaded - self._contexts.qsize() if self.loaded else 0,
+            'max_tokens': self.max_tokens,
+            'generated': self.generated,
+            'avg_ms': round(self.generation_seconds / self.generated * 1000, 1) if self.generated else 0.0,
+            'rejected': self.rejected,
+            'errors': self.errors
+        }
@@ -0,0 +1,289 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Optional, Dict, Any, List
+from config import Config
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Longest X-Request-Id accepted from a client; anything else gets a generated id
+_MAX_REQUEST_ID = 64
+
+class RequestLog:
+    """Logging context of one request: its id, whether its info logs are kept, stage timings and access log fields"""
+
+    __slots__ = ('request_id', 'sampled', 'start', 'stages', 'fields')
+
+    def __init__(self, request_id: str, sampled: bool):
+        self.request_id = request_id
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.fields: Dict[str, Any] = {}
+
+_current: contextvars.ContextVar[Optional[RequestLog]] = contextvars.ContextVar('request_log', default=None)
+
+def begin_request(request_id: Optional[str] = None) -> RequestLog:
+    """Open the logging context of a request, keeping a sane client-supplied id"""
+    if not request_id or len(request_id) > _MAX_REQUEST_ID or not request_id.isprintable():
+        request_id = os.urandom(8).hex()
+    context = RequestLog(request_id, random.random() < Config.LOG_SUCCESS_SAMPLE_RATE)
+    _current.set(context)
+    return context
+
+def note_stage(stage: str, seconds: float) -> None:
+    """Add a stage timing to the current request's access log line"""
+    context = _current.get()
+    if context is not None:
+        context.stages[stage] = round(context.stages.get(stage, 0.0) + seconds * 1000, 2)
+
+def annotate(**fields: Any) -> None:
+    """Add fields to the current request's access log line"""
+    context = _current.get()
+    if context is not None:
+        context.fields.update(fields)
+
+def end_request(context: RequestLog, method: str, path: str, status: int) -> None:
+    """Write the access log line of a request; successful ones are subject to sampling"""
+    _current.set(None)
+    if status < 400 and not context.sampled:
+        if _pipeline is not None:
+            _pipeline.sampled_out += 1
+        return
+    fields = {
+        'request_id': context.request_id,
+        'method': method,
+        'path': path,
+        'status': status,
+        'duration_ms': round((time.perf_counter() - context.start) * 1000, 2),
+        **context.fields
+    }
+    if context.stages:
+        fields['stages_ms'] = context.stages
+    logging.getLogger('access').log(logging.ERROR if status >= 500 else logging.INFO, 'request',
+                                    extra={'fields': fields})
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; fields passed as extra={'fields': {...}} are merged in"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'msg': record.getMessage()
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class StreamOutput:
+    """Writes batches to a stream such as stderr"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.path = None
+
+    def write(self, text: str) -> None:
+        self.stream.write(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def close(self) -> None:
+        self.flush()
+
+class RotatingFileOutput:
+    """Buffered appends to a file, rotated to path.1 ... path.N past max_bytes"""
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._open()
+
+    def _open(self) -> None:
+        self.file = open(self.path, 'a', encoding='utf-8', buffering=1 << 16)
+        self.size = self.file.tell()
+
+    def write(self, text: str) -> None:
+        size = len(text.encode('utf-8'))
+        if self.max_bytes and self.size and self.size + size > self.max_bytes:
+            self.rotate()
+        self.file.write(text)
+        self.size += size
+
+    def rotate(self) -> None:
+        self.file.close()
+        if self.backups:
+            for index in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{index}"):
+                    os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+class LogPipeline:
+    """Bounded queue of log records drained by a background writer thread
+
+    Records that do not fit the queue are dropped and counted rather than
+    blocking the request. The writer formats whatever has queued up and
+    writes it as one batch.
+    """
+
+    def __init__(self, output, formatter: logging.Formatter, max_queue: int, batch_size: int = 512):
+        self.output = output
+        self.formatter = formatter
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.queue: 'queue.Queue[Optional[logging.LogRecord]]' = queue.Queue(max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines: List[str] = []
+            for record in batch:
+                if record is None:
+                    continue
+                try:
+                    lines.append(self.formatter.format(record))
+                except Exception:
+                    self.errors += 1
+            try:
+                if lines:
+                    self.output.write('\n'.join(lines) + '\n')
+                    self.written += len(lines)
+                self.output.flush()
+            except (OSError, ValueError):
+                self.errors += 1
+            if None in batch:
+                return
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Write what is queued, then stop the writer"""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self.output.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'format': 'json' if isinstance(self.formatter, JsonFormatter) else 'text',
+            'file': self.output.path,
+            'queued': self.queue.qsize(),
+            'max_queue': self.max_queue,
+            'written': self.written,
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+            'errors': self.errors
+        }
+
+class QueueingHandler(logging.Handler):
+    """Root handler that only enqueues; formatting and I/O happen on the writer thread"""
+
+    def __init__(self, pipeline: LogPipeline):
+        super().__init__()
+        self.pipeline = pipeline
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # Queue.put_nowait is thread-safe, so the handler lock is not needed
+        if self.filter(record):
+            self.emit(record)
+            return True
+        return False
+
+    def emit(self, record: logging.LogRecord) -> None:
+        context = _current.get()
+        if context is not None:
+            if record.levelno < logging.WARNING and not context.sampled:
+                self.pipeline.sampled_out += 1
+                return
+            record.request_id = context.request_id
+        try:
+            self.pipeline.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.dropped += 1
+
+_pipeline: Optional[LogPipeline] = None
+# Pipelines inherited across fork; kept referenced so their buffers are never flushed twice
+_abandoned: List[LogPipeline] = []
+
+def configure_logging(process_name: Optional[str] = None, force: bool = False) -> LogPipeline:
+    """Send all logging through the queue pipeline described by Config (once per process)
+
+    force replaces an existing pipeline, for processes forked from one that
+    was configured: the writer thread does not survive fork. process_name
+    gives such a process its own log file, e.g. LOG_FILE=app.log becomes
+    app-worker1.log, since processes cannot share file rotation.
+    """
+    global _pipeline
+    if _pipeline is not None:
+        if not force:
+            return _pipeline
+        _abandoned.append(_pipeline)
+
+    path = Config.LOG_FILE
+    if path and process_name:
+        root, ext = os.path.splitext(path)
+        path = f"{root}-{process_name}{ext}"
+    output = (RotatingFileOutput(path, Config.LOG_FILE_MAX_BYTES, Config.LOG_FILE_BACKUPS)
+              if path else StreamOutput(sys.stderr))
+    formatter = JsonFormatter() if Config.LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+    _pipeline = LogPipeline(output, formatter, Config.LOG_QUEUE_SIZE)
+
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(QueueingHandler(_pipeline))
+    root_logger.setLevel(Config.LOG_LEVEL)
+    # The access log above replaces the servers' own request lines
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    logging.getLogger('uvicorn.access').setLevel(logging.WARNING)
+    return _pipeline
+
+def shutdown_logging() -> None:
+    """Flush and stop the pipeline; also runs at interpreter exit"""
+    global _pipeline
+    if _pipeline is not None:
+        _pipeline.close()
+        _pipeline = None
+
+def get_stats() -> Optional[Dict[str, Any]]:
+    """Pipeline counters, or None when logging was not configured through it"""
+    return _pipeline.get_stats() if _pipeline is not None else None
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,249 @@
+import threading
+import time
+from typing import Optional, Dict, List, Tuple
+from config import Config
+from log_pipeline import annotate, note_stage
+
+# Log-linear buckets over microseconds: 8 sub-buckets per power of two (~12% precision)
+_SUB_BUCKET_BITS = 3
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_MAX_MICROS = 1 << 27  # ~134 s; slower observations land in the last bucket
+_BUCKET_COUNT = (_MAX_MICROS.bit_length() - _SUB_BUCKET_BITS) * _SUB_BUCKETS + _SUB_BUCKETS
+
+# Prometheus "le" boundaries in seconds, folded from the fine-grained buckets on export
+EXPORT_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+def _bucket_index(micros: int) -> int:
+    """Bucket for a value in microseconds"""
+    if micros < 2 * _SUB_BUCKETS:
+        return max(micros, 0)
+    if micros >= _MAX_MICROS:
+        return _BUCKET_COUNT - 1
+    shift = micros.bit_length() - _SUB_BUCKET_BITS - 1
+    return shift * _SUB_BUCKETS + (micros >> shift)
+
+def _bucket_upper(index: int) -> float:
+    """Exclusive upper bound of a bucket in seconds"""
+    if index < 2 * _SUB_BUCKETS:
+        return (index + 1) / 1e6
+    shift = index // _SUB_BUCKETS - 1
+    return ((index % _SUB_BUCKETS + _SUB_BUCKETS + 1) << shift) / 1e6
+
+class _Sharded:
+    """Per-thread shards written without locks; merged (and dead threads folded) on read"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, list]] = []
+        self._retired = self._new_shard()
+        self._lock = threading.Lock()
+
+    def _new_shard(self) -> list:
+        raise NotImplementedError
+
+    def _fold(self, into: list, shard: list) -> None:
+        raise NotImplementedError
+
+    def _shard(self) -> list:
+        shard = self._new_shard()
+        self._local.shard = shard
+        with self._lock:
+            # Threaded servers start a thread per request, so keep the shard list short
+            if len(self._shards) >= 64:
+                self._retire_dead()
+            self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead(self) -> None:
+        """Fold shards of finished threads into one; caller holds the lock"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._fold(self._retired, shard)
+        self._shards = alive
+
+    def _merged(self) -> list:
+        with self._lock:
+            self._retire_dead()
+            merged = self._new_shard()
+            self._fold(merged, self._retired)
+            for _, shard in self._shards:
+                self._fold(merged, shard)
+        return merged
+
+class Histogram(_Sharded):
+    """HDR-style latency histogram; the last slot of a shard holds the running sum"""
+
+    def _new_shard(self) -> list:
+        return [0] * _BUCKET_COUNT + [0.0]
+
+    def _fold(self, into: list, shard: list) -> None:
+        for index, value in enumerate(shard):
+            if value:
+                into[index] += value
+
+    def record(self, seconds: float) -> None:
+        shard = getattr(self._local, 'shard', None) or self._shard()
+        shard[_bucket_index(int(seconds * 1e6))] += 1
+        shard[-1] += seconds
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        """(bucket counts, sum of observations)"""
+        merged = self._merged()
+        return merged[:-1], merged[-1]
+
+    @staticmethod
+    def quantile(counts: List[int], q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation"""
+        rank = q * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if count and seen >= rank:
+                return _bucket_upper(index)
+        return 0.0
+
+class Counter(_Sharded):
+    """Counter with one label value per key (also used as a gauge via negative increments)"""
+
+    def _new_shard(self) -> list:
+        return [{}]
+
+    def _fold(self, into: list, shard: list) -> None:
+        # The shard's thread may add a new label while this one reads it
+        for key, value in list(shard[0].items()):
+            into[0][key] = into[0].get(key, 0) + value
+
+    def add(self, key: str = '', amount: int = 1) -> None:
+        values = (getattr(self._local, 'shard', None) or self._shard())[0]
+        values[key] = values.get(key, 0) + amount
+
+    def values(self) -> Dict[str, int]:
+        return self._merged()[0]
+
+class Metrics:
+    """Per-stage latency histograms, response source counters and an in-flight gauge
+
+    Gemini call latency is also kept per generation profile, and the wait
+    and processing time of background chat jobs per phase.
+    """
+
+    STAGES = ('parse', 'prompt', 'upstream', 'upstream_first_token', 'serialize', 'total')
+
+    def __init__(self, enabled: bool = True, prefix: str = 'govhelper'):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.stages = {stage: Histogram() for stage in self.STAGES}
+        self.profiles: Dict[str, Histogram] = {}
+        self.jobs = {phase: Histogram() for phase in ('wait', 'processing')}
+        self.responses = Counter()
+        self.in_flight = Counter()
+
+    def observe(self, stage: str, start: float) -> None:
+        """Record the time since start (a time.perf_counter() value) for a stage"""
+        seconds = time.perf_counter() - start
+        note_stage(stage, seconds)
+        if self.enabled:
+            self.stages[stage].record(seconds)
+
+    def observe_upstream(self, profile: str, start: float) -> None:
+        """Record a Gemini call under the 'upstream' stage and its generation profile"""
+        seconds = time.perf_counter() - start
+        note_stage('upstream', seconds)
+        if self.enabled:
+            self.stages['upstream'].record(seconds)
+            histogram = self.profiles.get(profile) or self.profiles.setdefault(profile, Histogram())
+            histogram.record(seconds)
+
+    def observe_job(self, phase: str, seconds: float) -> None:
+        """Record how long a chat job waited in the queue or took to answer"""
+        if self.enabled:
+            self.jobs[phase].record(seconds)
+
+    def upstream_summary(self) -> Dict[str, Dict[str, float]]:
+        """Gemini call count and latency quantiles (ms) per generation profile"""
+        summary = {}
+        for profile, histogram in list(self.profiles.items()):
+            counts, total = histogram.snapshot()
+            calls = sum(counts)
+            summary[profile] = {
+                'calls': calls,
+                'avg_ms': round(total / calls * 1000, 1) if calls else 0.0,
+                'p50_ms': round(Histogram.quantile(counts, 0.5) * 1000, 1),
+                'p95_ms': round(Histogram.quantile(counts, 0.95) * 1000, 1)
+            }
+        return summary
+
+    def request_started(self) -> Optional[float]:
+        """Mark a request in flight; returns its start time, or None when disabled"""
+        if not self.enabled:
+            return None
+        self.in_flight.add()
+        return time.perf_counter()
+
+    def in_flight_requests(self) -> int:
+        """Chat requests being handled by this process (0 when metrics are disabled)"""
+        return self.in_flight.values().get('', 0) if self.enabled else 0
+
+    def request_finished(self, start: Optional[float], source: Optional[str] = None) -> None:
+        """Close a request opened with request_started"""
+        if source:
+            annotate(source=source)
+        if start is None:
+            return
+        self.in_flight.add(amount=-1)
+        self.stages['total'].record(time.perf_counter() - start)
+        if source:
+            self.responses.add(source)
+
+    @staticmethod
+    def _render_histograms(name: str, label: str, histograms: Dict[str, Histogram], help_text: str) -> List[str]:
+        """Exposition lines for a family of histograms plus their approximate quantiles"""
+        lines = [f"# HELP {name} {help_text}",
+                 f"# TYPE {name} histogram"]
+        quantile_lines = []
+        for value, histogram in list(histograms.items()):
+            counts, total = histogram.snapshot()
+            cumulative, index = 0, 0
+            for bound in EXPORT_BOUNDS:
+                while index < len(counts) and _bucket_upper(index) <= bound + 1e-9:
+                    cumulative += counts[index]
+                    index += 1
+                lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+            count = sum(counts)
+            lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{{label}="{value}"}} {total:.6f}')
+            lines.append(f'{name}_count{{{label}="{value}"}} {count}')
+            for q in QUANTILES:
+                quantile_lines.append(f'{name}_quantile{{{label}="{value}",quantile="{q}"}} '
+                                      f'{Histogram.quantile(counts, q):.6f}')
+
+        return lines + [f"# HELP {name}_quantile Approximate latency quantiles per {label}",
+                        f"# TYPE {name}_quantile gauge"] + quantile_lines
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = self._render_histograms(f"{self.prefix}_stage_seconds", 'stage', self.stages,
+                                        'Time spent per request stage')
+        lines += self._render_histograms(f"{self.prefix}_upstream_profile_seconds", 'profile', dict(self.profiles),
+                                         'Gemini call latency per generation profile')
+        lines += self._render_histograms(f"{self.prefix}_job_seconds", 'phase', self.jobs,
+                                         'Chat job queue wait and processing time')
+
+        name = f"{self.prefix}_responses_total"
+        lines += [f"# HELP {name} Responses by source",
+                  f"# TYPE {name} counter"]
+        lines += [f'{name}{{source="{source}"}} {value}'
+                  for source, value in sorted(self.responses.values().items())]
+
+        name = f"{self.prefix}_in_flight_requests"
+        lines += [f"# HELP {name} Chat requests currently being handled",
+                  f"# TYPE {name} gauge",
+                  f"{name} {self.in_flight.values().get('', 0)}"]
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(enabled=Config.METRICS_ENABLED)
@@ -0,0 +1,313 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Callable, Iterable
+from answer_cache import AnswerCache
+from config import Config
+from faq_store import build_meta, expand_questions, is_covered, load_questions, named_documents
+from language import detect_language
+from log_pipeline import annotate
+from metrics import metrics
+from prompts import SystemPrompts
+from rate_limiter import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+# Follow-up sections of a full answer, in the order prompts.py asks for them; the
+# prior before any logs are learned
+SECTIONS = ('documents', 'fees', 'processing_time', 'office')
+
+def session_tag(session_id: str) -> str:
+    """Short stable hash of a session id, so access logs can be grouped by conversation"""
+    return hashlib.blake2b(session_id.encode('utf-8'), digest_size=6).hexdigest()
+
+class FollowupTable:
+    """How often each answer section is asked for next, given the intent of the previous question"""
+
+    def __init__(self, counts: Optional[Dict[str, Dict[str, float]]] = None):
+        self.counts: Dict[str, Dict[str, float]] = counts or {}
+
+    @classmethod
+    def load(cls, path: str) -> 'FollowupTable':
+        """Read a table learned by `python prefetch.py`; empty when there is none yet"""
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, encoding='utf-8') as f:
+                return cls(json.load(f)['transitions'])
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"❌ Failed to load follow-up table: {e}")
+            return cls()
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'transitions': self.counts}, f, indent=2, sort_keys=True)
+
+    def observe(self, previous: str, intent: str) -> None:
+        row = self.counts.setdefault(previous, {})
+        row[intent] = row.get(intent, 0) + 1
+
+    def predict(self, intent: str, k: int, exclude: Iterable[str] = ()) -> List[str]:
+        """Most likely next sections, learned counts first and section order breaking ties"""
+        row = self.counts.get(intent, {})
+        candidates = [section for section in SECTIONS if section not in exclude]
+        candidates.sort(key=lambda section: -row.get(section, 0))
+        return candidates[:k]
+
+    @classmethod
+    def learn(cls, lines: Iterable[str]) -> 'FollowupTable':
+        """Count consecutive intents per session in JSON access log lines"""
+        table = cls()
+        records = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('logger') == 'access' and record.get('session') and record.get('intent'):
+                records.append(record)
+        last: Dict[str, str] = {}
+        for record in sorted(records, key=lambda record: record['ts']):
+            previous = last.get(record['session'])
+            if previous is not None:
+                table.observe(previous, record['intent'])
+            last[record['session']] = record['intent']
+        return table
+
+class Prefetcher:
+    """Answers the follow-ups a user is likely to ask next while they read the current answer
+
+    Questions are mapped onto the FAQ slots of faq/questions.json: a document
+    named in the question (or earlier in the conversation) plus an answer
+    section. After each answer the top PREFETCH_TOP_K next sections are
+    generated at low priority, never queueing for Gemini quota ahead of a
+    user, and stored in the answer cache under the slot's canonical question,
+    where a matching follow-up finds them even mid-conversation. Speculation
+    pauses, backing off exponentially, while the Gemini quota is below
+    PREFETCH_MIN_HEADROOM, callers are queued or rejected, or more than
+    PREFETCH_MAX_IN_FLIGHT requests are in progress. Counts are per process.
+    """
+
+    def __init__(self, speculate: Callable[[str, float], Optional[bool]], cache: AnswerCache, limiter,
+                 spec: Dict[str, Any], table: FollowupTable, sessions=None, faq=None):
+        self.speculate = speculate
+        self.cache = cache
+        self.limiter = limiter
+        self.table = table
+        self.sessions = sessions
+        self.faq = faq
+        entries = expand_questions(spec)
+        meta = build_meta(spec, entries)
+        self.questions = {entry['slot']: entry['question'] for entry in entries}
+        self.aliases = meta['aliases']
+        self.vocabulary = frozenset(meta['vocabulary'])
+        self.languages = frozenset(meta['languages'])
+        self.observed = 0
+        self.dropped = 0
+        self.skipped_busy = 0
+        self.upstream_calls = 0
+        self.errors = 0
+        self.hits = 0
+        self.cache_hits = 0
+        self.wasted = 0
+        # Slots this process generated, by expiry, until a follow-up uses them
+        self._outstanding: 'OrderedDict[str, float]' = OrderedDict()
+        self._paused_until = 0.0
+        self._backoff = 0.0
+        self._rejected_seen = 0
+        self._lock = threading.Lock()
+        self._start()
+
+    @classmethod
+    def from_config(cls, speculate: Callable[[str, float], Optional[bool]], cache: AnswerCache, limiter,
+                    sessions=None, faq=None) -> Optional['Prefetcher']:
+        """Build the prefetcher described by Config, or None when disabled"""
+        if not Config.PREFETCH_ENABLED or not cache.enabled:
+            return None
+        try:
+            spec = load_questions(Config.FAQ_QUESTIONS_PATH)
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Prefetch needs the FAQ question set: {e}")
+            return None
+        return cls(speculate, cache, limiter, spec, FollowupTable.load(Config.PREFETCH_TABLE_PATH), sessions, faq)
+
+    def _start(self) -> None:
+        self._pending: 'queue.Queue[tuple]' = queue.Queue(Config.PREFETCH_QUEUE_SIZE)
+        threading.Thread(target=self._run, name='prefetch', daemon=True).start()
+
+    def reopen(self) -> None:
+        """Restart the background thread in a forked worker"""
+        self._lock = threading.Lock()
+        self._start()
+
+    def _slot(self, user_message: str, questions: List[str], language: Optional[str] = None) -> Optional[tuple]:
+        """(document, language, intent) of a question, the document possibly named in an earlier one"""
+        language = language or detect_language(user_message)
+        if language not in self.languages:
+            return None
+        for question in reversed(questions):
+            documents = named_documents(question, self.aliases)
+            if len(documents) == 1:
+                return documents[0], language, SystemPrompts.detect_intent(user_message)
+            if documents:
+                return None
+        return None
+
+    def observe(self, user_message: str, session_id: Optional[str] = None) -> None:
+        """Note an answered question and queue its follow-ups for prefetching"""
+        intent = SystemPrompts.detect_intent(user_message)
+        if session_id:
+            # Access log lines carry these, for learning the table with `python prefetch.py`
+            annotate(session=session_tag(session_id), intent=intent)
+        self.observed += 1
+        try:
+            self._pending.put_nowait((user_message, session_id))
+        except queue.Full:
+            self.dropped += 1
+
+    def lookup(self, user_message: str, session_id: Optional[str] = None,
+               language: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Standalone answer for a follow-up on a document, precomputed or prefetched"""
+        intent = SystemPrompts.detect_intent(user_message)
+        if intent == 'full' or not is_covered(user_message, self.vocabulary):
+            return None
+        questions = self.sessions.recent_questions(session_id) if self.sessions is not None else []
+        slot = self._slot(user_message, [*questions, user_message], language)
+        if slot is None:
+            return None
+        key = '|'.join(slot)
+        if self.faq is not None:
+            record = self.faq.get(f"s|{key}")
+            if record is not None:
+                return {'response': record['response'], 'source': 'faq', 'status': 'success'}
+        cached = self.cache.get(self.questions[key])
+        if cached is None:
+            return None
+        with self._lock:
+            prefetched = self._outstanding.pop(key, None)
+        # Only answers this process prefetched count towards the hit rate; the
+        # rest were cached by earlier questions or another worker
+        if prefetched is not None:
+            self.hits += 1
+        else:
+            self.cache_hits += 1
+        return {**cached, 'source': 'prefetch'}
+
+    def _busy(self) -> bool:
+        """Check whether user traffic needs the quota or the workers right now"""
+        rejected = self.limiter.rejected
+        rejected_since, self._rejected_seen = rejected - self._rejected_seen, rejected
+        return (rejected_since > 0 or self.limiter.headroom() < Config.PREFETCH_MIN_HEADROOM
+                or metrics.in_flight_requests() > Config.PREFETCH_MAX_IN_FLIGHT)
+
+    def _pause(self) -> None:
+        self._backoff = min(Config.PREFETCH_BACKOFF_MAX, self._backoff * 2 or 1.0)
+        self._paused_until = time.monotonic() + self._backoff
+
+    def _expire(self) -> None:
+        """Count prefetched answers that expired unused"""
+        now = time.time()
+        with self._lock:
+            while self._outstanding:
+                key, expires_at = next(iter(self._outstanding.items()))
+                if expires_at > now:
+                    break
+                del self._outstanding[key]
+                self.wasted += 1
+
+    def _run(self) -> None:
+        while True:
+            user_message, session_id = self._pending.get()
+            try:
+                self._prefetch(user_message, session_id)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"❌ Prefetch failed: {e}")
+
+    def _prefetch(self, user_message: str, session_id: Optional[str]) -> None:
+        questions = self.sessions.recent_questions(session_id) if self.sessions is not None else []
+        if not questions or questions[-1] != user_message:
+            questions.append(user_message)
+        slot = self._slot(user_message, questions)
+        if slot is None:
+            return
+        document, language, intent = slot
+        asked = {SystemPrompts.detect_intent(question) for question in questions}
+        if len(questions) > 1:
+            self.table.observe(SystemPrompts.detect_intent(questions[-2]), intent)
+
+        self._expire()
+        for section in self.table.predict(intent, Config.PREFETCH_TOP_K, exclude=asked):
+            key = f"{document}|{language}|{section}"
+            question = self.questions[key]
+            if key in self._outstanding or (self.faq is not None and self.faq.get(f"s|{key}") is not None):
+                continue
+            if self.cache.memory.get(AnswerCache.make_key(question)) is not None:
+                continue
+            if time.monotonic() < self._paused_until or self._busy():
+                self.skipped_busy += 1
+                self._pause()
+                return
+            try:
+                generated = self.speculate(question, time.monotonic() + Config.PREFETCH_TIMEOUT)
+            except RateLimitExceeded:
+                generated = None
+            if generated is None:
+                # Out of quota or Gemini is failing: nothing was spent, try again later
+                self.skipped_busy += 1
+                self._pause()
+                return
+            self._backoff = 0.0
+            self.upstream_calls += 1
+            if not generated:
+                self.wasted += 1
+                continue
+            with self._lock:
+                self._outstanding[key] = time.time() + self.cache.ttl_seconds
+            logger.debug(f"⚡ Prefetched follow-up: {question}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Prefetch counters: hit rate against upstream calls spent on speculation
+
+        hits counts follow-ups served by an answer this process prefetched,
+        cache_hits those served by one cached some other way. wasted counts
+        calls that returned nothing plus answers that expired from the cache
+        before any follow-up used them.
+        """
+        self._expire()
+        return {
+            'observed': self.observed,
+            'queued': self._pending.qsize(),
+            'dropped': self.dropped,
+            'skipped_busy': self.skipped_busy,
+            'paused_s': round(max(0.0, self._paused_until - time.monotonic()), 1),
+            'upstream_calls': self.upstream_calls,
+            'hits': self.hits,
+            'cache_hits': self.cache_hits,
+            'hit_rate': round(self.hits / self.upstream_calls, 4) if self.upstream_calls else 0.0,
+            'outstanding': len(self._outstanding),
+            'wasted': self.wasted,
+            'errors': self.errors
+        }
+
+def main(paths: List[str]) -> None:
+    """Learn the follow-up table from JSON access logs and write it to PREFETCH_TABLE_PATH"""
+    lines: List[str] = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            lines.extend(f)
+    table = FollowupTable.learn(lines)
+    table.save(Config.PREFETCH_TABLE_PATH)
+    print(f"Learned {sum(sum(row.values()) for row in table.counts.values()):.0f} transitions "
+          f"from {len(paths)} log file(s) into {Config.PREFETCH_TABLE_PATH}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python prefetch.py LOG_FILE [LOG_FILE ...]")
+    main(sys.argv[1:])
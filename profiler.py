@@ -0,0 +1,205 @@
+import asyncio
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Optional, Dict, Any, List, Tuple
+from config import Config
+from log_pipeline import RequestLog
+
+logger = logging.getLogger(__name__)
+
+def admin_allowed(token: Optional[str]) -> bool:
+    """Check an X-Admin-Token header against ADMIN_TOKEN; always False when no token is configured"""
+    return bool(Config.ADMIN_TOKEN) and token is not None and hmac.compare_digest(
+        token.encode('utf-8'), Config.ADMIN_TOKEN.encode('utf-8'))
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def _collapse(frame) -> str:
+    """Frames from the outermost call to the innermost, ';'-separated"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+def _format_frames(frames: list) -> List[str]:
+    """Frames (outermost first) as 'file:line in function' strings"""
+    return [f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} in {frame.f_code.co_name}"
+            for frame in frames]
+
+def thread_stack(frame) -> List[str]:
+    """Call stack of a running thread, outermost call first"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return _format_frames(frames[::-1])
+
+def task_stack(task: asyncio.Task) -> List[str]:
+    """Await chain of a suspended asyncio task, from the task's coroutine to the innermost await"""
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = (getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+                 or getattr(awaitable, 'ag_frame', None))
+        if frame is None:
+            break
+        frames.append(frame)
+        awaitable = (getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+                     or getattr(awaitable, 'ag_await', None))
+    return _format_frames(frames)
+
+class SamplingProfiler:
+    """On-demand stack sampler over every thread of this process
+
+    Every `interval` seconds it reads all thread stacks with
+    sys._current_frames() and counts identical stacks, producing the
+    collapsed format flamegraph.pl and speedscope read. Nothing runs
+    between profiles, and only one profile runs at a time.
+    """
+
+    def __init__(self, interval: float, max_seconds: float):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.runs = 0
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self._running = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> Optional['SamplingProfiler']:
+        """Build the profiler described by Config, or None when disabled"""
+        if not Config.PROFILER_ENABLED:
+            return None
+        if not Config.ADMIN_TOKEN:
+            logger.warning("PROFILER_ENABLED has no effect without ADMIN_TOKEN")
+        return cls(Config.PROFILER_INTERVAL_MS / 1000, Config.PROFILER_MAX_SECONDS)
+
+    def profile(self, seconds: float) -> Optional[Tuple[str, int]]:
+        """Sample for `seconds` (capped at max_seconds); returns (collapsed stacks, samples), None if already running"""
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            seconds = min(max(seconds, self.interval), self.max_seconds)
+            own = threading.get_ident()
+            stacks: Counter = Counter()
+            samples, spent = 0, 0.0
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                start = time.perf_counter()
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != own:
+                        stacks[f"{names.get(ident, ident)};{_collapse(frame)}"] += 1
+                samples += 1
+                spent += time.perf_counter() - start
+                time.sleep(self.interval)
+            self.runs += 1
+            self.samples += samples
+            self.sampling_seconds += spent
+            logger.info(f"🔎 Profiled {seconds:.1f}s: {samples} samples, "
+                        f"{spent / samples * 1e6:.0f} us per sample")
+            return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common()), samples
+        finally:
+            self._running.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'running': self._running.locked(),
+            'interval_ms': round(self.interval * 1000, 1),
+            'runs': self.runs,
+            'samples': self.samples,
+            'avg_sample_us': round(self.sampling_seconds / self.samples * 1e6, 1) if self.samples else 0.0
+        }
+
+class SlowRequestRecorder:
+    """Keeps stage timings and a stack snapshot of requests slower than a threshold
+
+    A watchdog thread checks the requests in progress a few times per
+    threshold and snapshots the stack of any that is past it (the thread's
+    call stack, or the await chain of an asyncio task). Once such a request
+    finishes it lands in a ring buffer of the last `size` slow requests.
+    """
+
+    def __init__(self, threshold: float, size: int):
+        self.threshold = threshold
+        self.check_interval = max(0.005, min(threshold / 4, 0.25))
+        self.recorded = 0
+        self.entries: deque = deque(maxlen=size)
+        # Requests in progress: id(context) -> [context, thread id or task, stack snapshot]
+        self._active: Dict[int, list] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls) -> Optional['SlowRequestRecorder']:
+        """Build the recorder described by Config, or None when SLOW_REQUEST_MS is 0"""
+        if Config.SLOW_REQUEST_MS <= 0:
+            return None
+        return cls(Config.SLOW_REQUEST_MS / 1000, Config.SLOW_REQUEST_BUFFER)
+
+    def begin(self, context: RequestLog) -> None:
+        """Watch a request from its start"""
+        if self._thread is None or not self._thread.is_alive():
+            # Started on first use, so each forked worker gets its own watchdog
+            self._thread = threading.Thread(target=self._watch, name='slow-request-watchdog', daemon=True)
+            self._thread.start()
+        try:
+            owner = asyncio.current_task()
+        except RuntimeError:
+            owner = None
+        self._active[id(context)] = [context, owner or threading.get_ident(), None]
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.check_interval)
+            now = time.perf_counter()
+            frames = None
+            for entry in list(self._active.values()):
+                context, owner, stack = entry
+                if stack is not None or now - context.start < self.threshold:
+                    continue
+                if isinstance(owner, asyncio.Task):
+                    entry[2] = task_stack(owner)
+                else:
+                    frames = frames or sys._current_frames()
+                    frame = frames.get(owner)
+                    entry[2] = thread_stack(frame) if frame is not None else []
+
+    def end(self, context: RequestLog, method: str, path: str, status: int) -> None:
+        """Record the request if it was slow"""
+        entry = self._active.pop(id(context), None)
+        duration = time.perf_counter() - context.start
+        if duration < self.threshold:
+            return
+        self.recorded += 1
+        self.entries.append({
+            'at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'request_id': context.request_id,
+            'method': method,
+            'path': path,
+            'status': status,
+            'duration_ms': round(duration * 1000, 2),
+            'stages_ms': dict(context.stages),
+            **context.fields,
+            # Missing when the request finished before the watchdog looked
+            'stack': entry[2] if entry is not None else None
+        })
+
+    def get_entries(self) -> List[Dict[str, Any]]:
+        """Recorded slow requests, newest first"""
+        return list(reversed(self.entries))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'threshold_ms': round(self.threshold * 1000, 1),
+            'in_progress': len(self._active),
+            'recorded': self.recorded,
+            'buffered': len(self.entries)
+        }
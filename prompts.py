@@ -1,3 +1,75 @@
+from typing import Optional, Dict, Any, List, Tuple
+from config import Config
+from language import LANGUAGE_NAMES, detect_language
+
+# Keywords that narrow a question to a single section of the full answer
+_INTENT_KEYWORDS = {
+    'fees': ('fee', 'fees', 'cost', 'charge', 'charges', 'how much', 'price', 'ఫీజు', 'రుసుము', 'ఖర్చు', 'ఎంత'),
+    'documents': ('documents', 'document required', 'documents required', 'proof', 'పత్రాలు', 'డాక్యుమెంట్'),
+    'office': ('office', 'where', 'location', 'address', 'centre', 'center', 'ఎక్కడ', 'కార్యాలయం', 'ఆఫీసు', 'కేంద్రం'),
+    'processing_time': ('how long', 'how many days', 'processing time', 'ఎన్ని రోజులు', 'సమయం'),
+}
+
+# Answer instructions per detected intent; {language} is filled in below
+_INSTRUCTION_TEMPLATES = {
+    'full': """Please provide a comprehensive answer in {language} with:
+1. Clear step-by-step process
+2. Complete list of required documents
+3. Fees and processing time
+4. Office locations
+5. Helpful tips and common mistakes to avoid
+
+Format your response with proper headings and bullet points.""",
+    'fees': """Answer briefly in {language}: only the fees/charges and how to pay them. Do not repeat the full procedure.""",
+    'documents': """Answer briefly in {language}: only the list of required documents, as bullet points.""",
+    'office': """Answer briefly in {language}: only where to apply (office or online portal) with contact details if known.""",
+    'processing_time': """Answer briefly in {language}: only the usual processing time and how to track the application status.""",
+    'short': """Answer briefly in {language}: only what was asked, in a few sentences or bullet points, without the full procedure.""",
+}
+
+CONTEXT_HEADER = "\n\nReference notes from our procedure documents (prefer these facts when relevant):\n"
+HISTORY_HEADER = "Earlier in this conversation (use it to understand follow-up questions):\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate Gemini tokens: ~4 ASCII chars or ~2 other chars per token"""
+    ascii_chars = sum(1 for char in text if char < '\x80')
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars + 1) // 2
+
+
+class PromptStats:
+    """Running prompt size counters, comparing against the legacy monolithic prompt"""
+
+    def __init__(self):
+        self.prompts = 0
+        self.tokens = 0
+        self.legacy_tokens = 0
+        self.trimmed = 0
+        self.by_intent: Dict[str, int] = {}
+
+    def record(self, intent: str, tokens: int, legacy_tokens: int, trimmed: bool) -> None:
+        """Record one assembled prompt"""
+        self.prompts += 1
+        self.tokens += tokens
+        self.legacy_tokens += legacy_tokens
+        self.trimmed += int(trimmed)
+        self.by_intent[intent] = self.by_intent.get(intent, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get average prompt sizes before and after prompt assembly"""
+        avg_tokens = self.tokens / self.prompts if self.prompts else 0.0
+        avg_legacy = self.legacy_tokens / self.prompts if self.prompts else 0.0
+        return {
+            'prompts': self.prompts,
+            'avg_tokens': round(avg_tokens, 1),
+            'avg_legacy_tokens': round(avg_legacy, 1),
+            'savings': round(1 - avg_tokens / avg_legacy, 3) if avg_legacy else 0.0,
+            'token_budget': Config.PROMPT_TOKEN_BUDGET,
+            'trimmed': self.trimmed,
+            'by_intent': dict(self.by_intent)
+        }
+
+
 class SystemPrompts:
     """Centralized system prompts for the Government Helper AI assistant"""
 
@@ -32,39 +104,83 @@ Response guidelines:
 
 Always structure your response with clear headings and bullet points for easy reading."""
 
+    # Precompiled instruction blocks keyed by (language label, intent)
+    INSTRUCTIONS = {
+        (label, intent): template.format(language=language)
+        for label, language in LANGUAGE_NAMES.items()
+        for intent, template in _INSTRUCTION_TEMPLATES.items()
+    }
+
+    QUESTION_PREFIXES = {
+        'te': 'User Question (in Telugu)',
+        'en': 'User Question',
+        'mixed': 'User Question (in Telugu mixed with English)',
+        'romanized-te': 'User Question (Telugu typed in English letters)',
+    }
+
+    # Fixed overhead of the previous monolithic prompt (system prompt + full instructions)
+    LEGACY_OVERHEAD_TOKENS = estimate_tokens(MAIN_SYSTEM_PROMPT + _INSTRUCTION_TEMPLATES['full']) + 10
+
+    stats = PromptStats()
+
     @staticmethod
-    def create_prompt(user_message: str) -> str:
-        """Create a formatted prompt for the Gemini model"""
-        # Detect Telugu characters
-        telugu_chars = ['అ', 'ఆ', 'ఇ', 'ఈ', 'ఉ', 'ఊ', 'ఎ', 'ఏ', 'ఐ', 'ఒ', 'ఓ', 'ఔ',
-                       'క', 'ఖ', 'గ', 'ఘ', 'చ', 'ఛ', 'జ', 'ట', 'ఠ', 'డ', 'ఢ', 'ణ',
-                       'త', 'థ', 'ద', 'ధ', 'న', 'ప', 'ఫ', 'బ', 'భ', 'మ', 'య', 'ర', 'ల', 'వ', 'శ', 'ష', 'స', 'హ']
-        
-        is_telugu = any(char in user_message for char in telugu_chars)
-        
-        if is_telugu:
-            return f"""{SystemPrompts.MAIN_SYSTEM_PROMPT}
-
-User Question (in Telugu): {user_message}
-
-Please provide a comprehensive answer in Telugu with:
-1. Clear step-by-step process
-2. Complete list of required documents
-3. Fees and processing time
-4. Office locations
-5. Helpful tips and common mistakes to avoid
+    def detect_intent(user_message: str) -> str:
+        """Pick the instruction block for a question; 'full' unless exactly one narrow intent matches"""
+        text = user_message.lower()
+        matches = [intent for intent, keywords in _INTENT_KEYWORDS.items()
+                   if any(keyword in text for keyword in keywords)]
+        return matches[0] if len(matches) == 1 else 'full'
+
+    @staticmethod
+    def format_context(passages: Optional[List[Dict[str, Any]]], token_budget: int) -> Tuple[str, bool]:
+        """Format knowledge base passages as reference notes within a token budget
 
-Format your response with proper headings and bullet points."""
-        else:
-            return f"""{SystemPrompts.MAIN_SYSTEM_PROMPT}
+        Returns the notes and whether any passage had to be cut or dropped.
+        """
+        notes, trimmed = [], False
+        for passage in passages or []:
+            note = f"[{passage['title']}]\n{passage['text']}"
+            tokens = estimate_tokens(note)
+            if tokens > token_budget:
+                # Keep a truncated copy of the passage if a useful amount fits
+                if token_budget >= 50:
+                    notes.append(note[:len(note) * token_budget // tokens])
+                trimmed = True
+                break
+            notes.append(note)
+            token_budget -= tokens
 
-User Question: {user_message}
+        if not notes:
+            return '', trimmed
+        return CONTEXT_HEADER + '\n\n'.join(notes), trimmed
 
-Please provide a comprehensive answer in English with:
-1. Clear step-by-step process
-2. Complete list of required documents  
-3. Fees and processing time
-4. Office locations
-5. Helpful tips and common mistakes to avoid
+    @staticmethod
+    def create_prompt(user_message: str, passages: Optional[List[Dict[str, Any]]] = None,
+                      intent: Optional[str] = None, language: Optional[str] = None,
+                      history: str = '') -> str:
+        """Create the per-request prompt for the Gemini model
+
+        MAIN_SYSTEM_PROMPT is not included: it is sent once as the model's
+        system instruction. history is the already windowed conversation so
+        far; reference passages are trimmed to keep the prompt within
+        Config.PROMPT_TOKEN_BUDGET.
+        """
+        language = language or detect_language(user_message)
+        intent = intent or SystemPrompts.detect_intent(user_message)
+
+        question = f"{SystemPrompts.QUESTION_PREFIXES[language]}: {user_message}"
+        instructions = SystemPrompts.INSTRUCTIONS[(language, intent)]
+        if history:
+            history = f"{HISTORY_HEADER}{history}\n\n"
+        fixed_tokens = estimate_tokens(history) + estimate_tokens(question) + estimate_tokens(instructions)
+
+        context, trimmed = SystemPrompts.format_context(passages, Config.PROMPT_TOKEN_BUDGET - fixed_tokens)
+        prompt = f"{history}{question}{context}\n\n{instructions}"
 
-Format your response with proper headings and bullet points."""
+        SystemPrompts.stats.record(
+            intent,
+            tokens=fixed_tokens + estimate_tokens(context),
+            legacy_tokens=SystemPrompts.LEGACY_OVERHEAD_TOKENS + estimate_tokens(question),
+            trimmed=trimmed
+        )
+        return prompt
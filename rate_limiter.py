@@ -0,0 +1,338 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+import zlib
+from typing import Optional, Dict, Any
+from config import Config
+
+class RateLimitExceeded(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint"""
+
+    def __init__(self, retry_after: float, message: Optional[str] = None):
+        super().__init__(message or f"Rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After value in whole seconds"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+class TokenBucket:
+    """Classic token bucket; callers provide locking"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until the bucket holds amount tokens (0 if it already does)"""
+        self._refill(now)
+        # A request larger than the bucket may proceed once it is full
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+    def try_take(self, amount: float, now: float) -> float:
+        """Take tokens if available; returns 0 on success or seconds until enough tokens"""
+        wait = self.wait_time(amount, now)
+        if not wait:
+            self.tokens -= min(amount, self.capacity)
+        return wait
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def level(self, now: float) -> float:
+        """Share of the capacity currently available"""
+        self._refill(now)
+        return self.tokens / self.capacity
+
+def bucket_for(buckets: Dict[str, TokenBucket], key: str, rate: float, capacity: float,
+               max_keys: int, now: float) -> TokenBucket:
+    """Look up a key's bucket, adding one while keeping the table within max_keys
+
+    The table is kept in least recently used order. When it is full, clients
+    whose buckets have refilled completely are forgotten; if none has, the
+    least recently used bucket goes, so a flood of new keys cannot grow it.
+    Callers provide locking.
+    """
+    bucket = buckets.pop(key, None)
+    if bucket is None:
+        if len(buckets) >= max_keys:
+            for idle_key in [k for k, b in buckets.items() if b.is_full(now)]:
+                del buckets[idle_key]
+            if len(buckets) >= max_keys:
+                del buckets[next(iter(buckets))]
+        bucket = TokenBucket(rate, capacity)
+    buckets[key] = bucket
+    return bucket
+
+class ShardedBuckets:
+    """Per-key token buckets split across independently locked shards"""
+
+    def __init__(self, per_minute: float, burst: float, shards: int = 16, max_keys_per_shard: int = 4096):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys_per_shard = max_keys_per_shard
+        self.rejected = 0
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+
+    def take(self, key: str, amount: float = 1.0) -> float:
+        """Take tokens for a key; returns 0 when allowed, else seconds to wait"""
+        buckets, lock = self._shards[zlib.crc32(key.encode('utf-8')) % len(self._shards)]
+        now = time.monotonic()
+        with lock:
+            bucket = bucket_for(buckets, key, self.rate, self.burst, self.max_keys_per_shard, now)
+            wait = bucket.try_take(amount, now)
+        if wait:
+            self.rejected += 1
+        return wait
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for buckets, _ in self._shards)
+
+class SharedBuckets:
+    """Per-key token buckets kept in the shared store, so limits hold across workers
+
+    Falls back to buckets in this process while the store is unreachable.
+    """
+
+    def __init__(self, store, name: str, per_minute: float, burst: float):
+        self.store = store
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.rejected = 0
+        self.local = ShardedBuckets(per_minute, burst)
+
+    def take(self, key: str, amount: float = 1.0) -> float:
+        """Take tokens for a key; returns 0 when allowed, else seconds to wait"""
+        try:
+            wait = self.store.take([(f"{self.name}|{key}", self.rate, self.burst, amount)])
+        except OSError:
+            wait = self.local.take(key, amount)
+        if wait:
+            self.rejected += 1
+        return wait
+
+    def __len__(self) -> int:
+        return len(self.local)
+
+class InboundLimiter:
+    """Per-IP and per-session request limits for the chat endpoints"""
+
+    def __init__(self, shared=None):
+        self.enabled = Config.RATE_LIMIT_ENABLED
+        self.shared = shared
+        if shared is not None:
+            self.by_ip = SharedBuckets(shared, 'ip', Config.INBOUND_IP_RPM, Config.INBOUND_IP_BURST)
+            self.by_session = SharedBuckets(shared, 'session', Config.INBOUND_SESSION_RPM, Config.INBOUND_SESSION_BURST)
+        else:
+            self.by_ip = ShardedBuckets(Config.INBOUND_IP_RPM, Config.INBOUND_IP_BURST)
+            self.by_session = ShardedBuckets(Config.INBOUND_SESSION_RPM, Config.INBOUND_SESSION_BURST)
+
+    def check(self, client_ip: Optional[str], session_id: Optional[str] = None) -> None:
+        """Raise RateLimitExceeded if the client is over its limits"""
+        if not self.enabled:
+            return
+        wait = self.by_ip.take(client_ip or 'unknown')
+        if not wait and session_id:
+            wait = self.by_session.take(session_id)
+        if wait:
+            raise RateLimitExceeded(wait)
+
+    def get_stats(self) -> Dict[str, Any]:
+        if self.shared is not None:
+            try:
+                buckets = self.shared.get_stats()['buckets']
+                tracked_ips, tracked_sessions = buckets.get('ip', 0), buckets.get('session', 0)
+            except OSError:
+                tracked_ips, tracked_sessions = len(self.by_ip), len(self.by_session)
+            return {
+                'enabled': self.enabled,
+                'shared': True,
+                'tracked_ips': tracked_ips,
+                'tracked_sessions': tracked_sessions,
+                'rejected_ip': self.by_ip.rejected,
+                'rejected_session': self.by_session.rejected
+            }
+        return {
+            'enabled': self.enabled,
+            'tracked_ips': len(self.by_ip),
+            'tracked_sessions': len(self.by_session),
+            'rejected_ip': self.by_ip.rejected,
+            'rejected_session': self.by_session.rejected
+        }
+
+class OutboundLimiter:
+    """Keeps upstream calls within the Gemini RPM/TPM quota
+
+    Requests that cannot go immediately wait in a bounded queue ordered by
+    priority (smaller prompts first); when the queue is full or the wait
+    would exceed the deadline, RateLimitExceeded is raised straight away.
+    The lock only guards the local queue, buckets and counters: a take from
+    the shared store runs outside it, so one slow round trip never holds up
+    every caller in the process.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 max_queue: int, max_wait: float, enabled: bool = True, shared=None):
+        self.enabled = enabled
+        # Under launcher.py the quota buckets live in the shared store, since
+        # every worker draws on the same API keys
+        self.shared = shared
+        self.requests = TokenBucket(requests_per_minute / 60.0, max(1.0, requests_per_minute / 6.0))
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, max(1.0, tokens_per_minute / 6.0))
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self._waiters: list = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition(threading.Lock())
+
+    @classmethod
+    def from_config(cls, endpoints: int = 1, shared=None) -> 'OutboundLimiter':
+        """Quota scales with the number of API keys in use"""
+        return cls(
+            Config.GEMINI_RPM * endpoints,
+            Config.GEMINI_TPM * endpoints,
+            Config.RATE_LIMIT_QUEUE_SIZE,
+            Config.RATE_LIMIT_MAX_WAIT,
+            enabled=Config.RATE_LIMIT_ENABLED,
+            shared=shared
+        )
+
+    def _try_take(self, tokens: float) -> float:
+        """Take one request and the estimated tokens, or return the wait needed; call without the lock"""
+        if self.shared is not None:
+            try:
+                return self.shared.take([
+                    ('gemini|requests', self.requests.rate, self.requests.capacity, 1),
+                    ('gemini|tokens', self.tokens.rate, self.tokens.capacity, tokens)
+                ])
+            except OSError:
+                pass  # store unreachable: fall back to this worker's buckets
+        with self._cond:
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if not wait:
+                self.requests.try_take(1, now)
+                self.tokens.try_take(tokens, now)
+            return wait
+
+    def _count(self, counter: str) -> None:
+        with self._cond:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def try_acquire(self, tokens: float) -> bool:
+        """Admit the call only if it can go right now without queueing"""
+        if not self.enabled:
+            return True
+        if self._waiters or self._try_take(tokens):
+            return False
+        self._count('admitted')
+        return True
+
+    def acquire(self, tokens: float, priority: int = 0, timeout: Optional[float] = None) -> None:
+        """Block until the call fits the quota, or raise RateLimitExceeded"""
+        if not self.enabled:
+            return
+        timeout = self.max_wait if timeout is None else min(timeout, self.max_wait)
+        deadline = time.monotonic() + timeout
+
+        if not self._waiters:
+            wait = self._try_take(tokens)
+            if not wait:
+                self._count('admitted')
+                return
+            if wait > timeout:
+                self._count('rejected')
+                raise RateLimitExceeded(wait)
+
+        entry = (priority, next(self._sequence))
+        with self._cond:
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise RateLimitExceeded(self.max_wait)
+            heapq.heappush(self._waiters, entry)
+            self.queued += 1
+        try:
+            while True:
+                with self._cond:
+                    # Only the head of the queue takes from the buckets; the rest sleep until it leaves
+                    while self._waiters[0] != entry:
+                        left = deadline - time.monotonic()
+                        if left <= 0:
+                            self.rejected += 1
+                            raise RateLimitExceeded(timeout)
+                        self._cond.wait(left)
+                wait = self._try_take(tokens)
+                if not wait:
+                    self._count('admitted')
+                    return
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    self._count('rejected')
+                    raise RateLimitExceeded(wait)
+                time.sleep(min(wait, left))
+        finally:
+            with self._cond:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def headroom(self) -> float:
+        """Share of the quota free right now: 0 while calls are queued, 1 when disabled
+
+        Under launcher.py this reads the shared buckets every worker draws
+        on; only the queue is this worker's own.
+        """
+        if not self.enabled:
+            return 1.0
+        if self._waiters:
+            return 0.0
+        if self.shared is not None:
+            try:
+                return self.shared.level([
+                    ('gemini|requests', self.requests.rate, self.requests.capacity),
+                    ('gemini|tokens', self.tokens.rate, self.tokens.capacity)
+                ])
+            except OSError:
+                pass  # store unreachable: this worker's buckets are the ones in use
+        with self._cond:
+            now = time.monotonic()
+            return min(self.requests.level(now), self.tokens.level(now))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'queue_depth': len(self._waiters),
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'shared': self.shared is not None,
+            'rpm': round(self.requests.rate * 60),
+            'tpm': round(self.tokens.rate * 60)
+        }
+
+def prompt_priority(token_estimate: int) -> int:
+    """Queue priority for a prompt: shorter prompts are served first"""
+    return min(token_estimate // 100, 10)
+
+def client_address(remote_addr: Optional[str], forwarded_for: Optional[str]) -> Optional[str]:
+    """Client IP, honouring X-Forwarded-For only when the app sits behind a trusted proxy"""
+    if Config.TRUST_PROXY_HEADERS and forwarded_for:
+        return forwarded_for.split(',')[0].strip()
+    return remote_addr
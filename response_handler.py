@@ -1,81 +1,768 @@
+import asyncio
+import contextvars
 import logging
-from typing import Dict, Any
-from ai_client import GeminiClient
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Iterator, AsyncIterator, List, Optional, Tuple
+from config import Config
+from ai_client import BackendHealth, GeminiClient, GenerationBackend, UpstreamBusyError
+from answer_cache import AnswerCache
+from deadlines import DeadlineExceeded
+from faq_store import FAQStore
+from generation_profiles import choose_profile
+from intent_classifier import IntentRouter
+from job_queue import JobQueue
+from knowledge_base import KnowledgeBase
+from language import detect_language
+from local_model import LocalModelBackend
+from metrics import metrics
+from prefetch import Prefetcher
 from prompts import SystemPrompts
+from rate_limiter import RateLimitExceeded
+from sessions import SessionStore
+from shared_store import SharedStore
+from singleflight import SingleFlight, AsyncSingleFlight
 
 logger = logging.getLogger(__name__)
 
 class ResponseHandler:
     """Handles generating responses using Gemini AI with enhanced error handling"""
 
-    def __init__(self):
-        self.ai_client = GeminiClient()
-
-    def get_response(self, user_message: str) -> Dict[str, Any]:
-        """Get response using Gemini AI with proper error handling"""
-        logger.info(f"Processing user question: {user_message}")
-
-        # Validate input
-        if not user_message or len(user_message.strip()) == 0:
-            return {
-                'response': 'దయచేసి మీ ప్రశ్న టైప్ చేయండి (Please type your question)',
-                'source': 'validation_error',
-                'status': 'error'
-            }
-
-        # Check if AI client is available
-        if not self.ai_client.is_available():
-            return {
-                'response': '''క్షమించండి, ప్రస్తుతం AI సేవ అందుబాటులో లేదు. దయచేసి Gemini API కీ సెటప్ చేసి మళ్ళీ ప్రయత్నించండి.
+    # Fallback replies keyed by response source: (message, status)
+    FALLBACK_RESPONSES = {
+        'validation_error': (
+            'దయచేసి మీ ప్రశ్న టైప్ చేయండి (Please type your question)',
+            'error'
+        ),
+        'ai_unavailable': (
+            '''క్షమించండి, ప్రస్తుతం AI సేవ అందుబాటులో లేదు. దయచేసి Gemini API కీ సెటప్ చేసి మళ్ళీ ప్రయత్నించండి.
 
 Sorry, AI service is currently unavailable. Please setup Gemini API key and try again.
 
 మీరు ఈ విషయాలను స్వయంగా తనిఖీ చేయవచ్చు:
 1. ఆధార్ కార్డ్: uidai.gov.in
-2. పెన్షన్: nsap.nic.in  
+2. పెన్షన్: nsap.nic.in
 3. ఆదాయ సర్టిఫికేట్: webland.ap.gov.in (AP) లేదా webland.telangana.gov.in (TS)''',
-                'source': 'ai_unavailable',
-                'status': 'error'
-            }
-
-        try:
-            # Create optimized prompt for Gemini
-            prompt = SystemPrompts.create_prompt(user_message)
-            
-            # Generate response using Gemini
-            ai_response = self.ai_client.generate_response(prompt)
-            
-            if ai_response and len(ai_response.strip()) > 0:
-                logger.info("✅ Gemini AI response generated successfully")
-                return {
-                    'response': ai_response,
-                    'source': 'gemini_ai',
-                    'status': 'success'
-                }
-            else:
-                logger.warning("Gemini returned empty response")
-                return {
-                    'response': '''క్షమించండి, ప్రస్తుతం AI సమాధానం రాలేదు. దయచేసి మీ ప్రశ్నను మరొకసారి అడగండి.
+            'error'
+        ),
+        'empty_response': (
+            '''క్షమించండి, ప్రస్తుతం AI సమాధానం రాలేదు. దయచేసి మీ ప్రశ్నను మరొకసారి అడగండి.
 
 Sorry, couldn't generate AI response. Please try asking your question again.
 
 సాధారణ సహాయం కోసం:
 • ఆధార్ కార్డ్ హెల్ప్లైన్: 1947
 • ప్రభుత్వ సేవల పోర్టల్: ap.gov.in లేదా telangana.gov.in''',
-                    'source': 'empty_response',
-                    'status': 'warning'
-                }
-                
-        except Exception as e:
-            logger.error(f"Error in response generation: {e}")
-            return {
-                'response': '''క్షమించండి, ప్రస్తుతం సర్వర్ బిజీగా ఉంది. దయచేసి మళ్ళీ ప్రయత్నించండి.
+            'warning'
+        ),
+        'server_error': (
+            '''క్షమించండి, ప్రస్తుతం సర్వర్ బిజీగా ఉంది. దయచేసి మళ్ళీ ప్రయత్నించండి.
 
 Sorry, server is busy. Please try again.
 
 తక్షణ సహాయం కోసం:
 • ఆధార్ కేంద్రాలు: uidai.gov.in/contact-support
 • ప్రభుత్వ హెల్ప్లైన్: 1100''',
-                'source': 'server_error',
-                'status': 'error'
+            'error'
+        ),
+        'rate_limited': (
+            'చాలా అభ్యర్థనలు వచ్చాయి. దయచేసి కొద్దిసేపటి తర్వాత మళ్ళీ ప్రయత్నించండి (Too many requests. Please try again shortly)',
+            'error'
+        ),
+        'timeout': (
+            'క్షమించండి, సమాధానం సమయానికి రాలేదు. దయచేసి మళ్ళీ ప్రయత్నించండి (Sorry, the answer took too long. Please try again)',
+            'error'
+        ),
+    }
+
+    # Replies for messages the intent classifier marks as needing no model call
+    CANNED_RESPONSES = {
+        'greeting': '''నమస్కారం! నేను ప్రభుత్వ పత్రాల సహాయకుడిని. ఆధార్, రేషన్ కార్డ్, పెన్షన్, ఆదాయ/జనన/మరణ ధృవీకరణ పత్రాలు, ఆస్తి రిజిస్ట్రేషన్ లేదా ఓటర్ ఐడి గురించి అడగండి.
+
+Hello! I help with government documents: Aadhaar, ration card, pension, income/birth/death certificates, property registration and voter ID. Please ask your question.''',
+        'thanks': '''మీకు సహాయం చేయగలిగినందుకు సంతోషం! ఇంకా ఏమైనా ప్రశ్నలు ఉంటే అడగండి.
+
+Glad I could help! Ask me if you have any other questions.''',
+        'out_of_scope': '''క్షమించండి, నేను ప్రభుత్వ పత్రాలు మరియు సేవల గురించి మాత్రమే సహాయం చేయగలను (ఆధార్, రేషన్ కార్డ్, పెన్షన్, ధృవీకరణ పత్రాలు, ఆస్తి రిజిస్ట్రేషన్, ఓటర్ ఐడి).
+
+Sorry, I can only help with government documents and services (Aadhaar, ration card, pension, certificates, property registration, voter ID).''',
+    }
+
+    def __init__(self, ai_client: Optional[GeminiClient] = None):
+        self.ai_client = ai_client or GeminiClient()
+        # Answers fail over to the local model while Gemini is failing (None without LOCAL_MODEL_PATH)
+        self.fallback = LocalModelBackend.from_config()
+        self.primary_health = BackendHealth(Config.FAILOVER_THRESHOLD, Config.FAILOVER_COOLDOWN)
+        self.failovers = 0
+        # Cache and sessions shared between the workers of launcher.py (None otherwise)
+        self.shared = SharedStore.from_config()
+        self.cache = AnswerCache.from_config(self.shared)
+        self.knowledge_base = KnowledgeBase.from_config()
+        self.faq = FAQStore.from_config()
+        self.sessions = SessionStore.from_config(self.shared)
+        # Questions answered in the background for /chat/jobs (None without JOB_QUEUE_PATH)
+        self.jobs = JobQueue.from_config(self.get_response)
+        # Likely follow-ups generated in the background after each answer (None unless PREFETCH_ENABLED)
+        self.prefetcher = Prefetcher.from_config(self._speculate, self.cache, self.ai_client.limiter,
+                                                 self.sessions, self.faq)
+        # Questions skip routing until the classifier has been trained
+        self.router: Optional[IntentRouter] = None
+        self._router_ready = threading.Event()
+        if Config.BACKGROUND_INIT:
+            threading.Thread(target=self._load_router, name='classifier-init', daemon=True).start()
+        else:
+            self._load_router()
+        # Answers by source, to report how many requests needed no Gemini call
+        self.served: Dict[str, int] = {}
+        # Identical prompts in flight at the same time share one upstream call
+        self.singleflight = SingleFlight()
+        self.async_singleflight = AsyncSingleFlight()
+        # Async serving runs SQLite, shared-store and KB work here so a slow disk never stalls the event loop
+        self._storage_workers = ThreadPoolExecutor(max_workers=Config.ASYNC_STORAGE_WORKERS,
+                                                   thread_name_prefix='storage')
+
+    def _load_router(self) -> None:
+        try:
+            self.router = IntentRouter.from_config()
+        finally:
+            self._router_ready.set()
+
+    def readiness(self) -> Dict[str, str]:
+        """Warm-up state of the components set up in the background"""
+        components = {
+            'ai_client': self.ai_client.get_state(),
+            'classifier': 'ready' if self._router_ready.is_set() else 'warming'
+        }
+        if self.fallback is not None:
+            components['local_model'] = self.fallback.get_state()
+        return components
+
+    def is_ready(self) -> bool:
+        """Check if background warm-up has finished"""
+        return 'warming' not in self.readiness().values()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until background warm-up has finished; False on timeout"""
+        return (self.ai_client.wait_ready(timeout) and self._router_ready.wait(timeout)
+                and (self.fallback is None or self.fallback.wait_ready(timeout)))
+
+    def after_fork(self) -> None:
+        """Reopen per-process resources in a worker forked from a preloaded app"""
+        self.cache.reopen()
+        if self.sessions is not None:
+            self.sessions.reopen()
+        if self.fallback is not None:
+            self.fallback.reopen()
+        if self.jobs is not None:
+            self.jobs.reopen()
+            self.jobs.start()
+        if self.prefetcher is not None:
+            self.prefetcher.reopen()
+
+    async def run_blocking(self, func, *args):
+        """Run blocking storage work on a storage thread, keeping the request's log context"""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._storage_workers, context.run, func, *args)
+
+    def get_coalescing_stats(self) -> Dict[str, int]:
+        """Get request coalescing counters across threaded and async serving"""
+        sync_stats = self.singleflight.get_stats()
+        async_stats = self.async_singleflight.get_stats()
+        return {key: sync_stats[key] + async_stats[key] for key in sync_stats}
+
+    def get_routing_stats(self) -> Dict[str, Any]:
+        """Get answer counts by source and the share served without calling Gemini"""
+        total = sum(self.served.values())
+        local = total - self.served.get('gemini_ai', 0)
+        return {
+            'served': dict(self.served),
+            'local_share': round(local / total, 4) if total else 0.0,
+            'classifier': self.router.get_stats() if self.router is not None else None
+        }
+
+    def get_failover_stats(self) -> Dict[str, Any]:
+        """Get Gemini's failover breaker, how often answers failed over and the local model state"""
+        return {
+            'gemini': self.primary_health.state,
+            'consecutive_failures': self.primary_health.consecutive_failures,
+            'failovers': self.failovers,
+            'local_model': self.fallback.get_status() if self.fallback is not None else None
+        }
+
+    def get_prefetch_stats(self) -> Optional[Dict[str, Any]]:
+        """Get follow-up prefetch counters, or None when prefetching is disabled"""
+        return self.prefetcher.get_stats() if self.prefetcher is not None else None
+
+    def _count(self, source: str, answers: int = 1) -> None:
+        """Count answers served from a source"""
+        self.served[source] = self.served.get(source, 0) + answers
+
+    @classmethod
+    def _fallback_response(cls, source: str) -> Dict[str, Any]:
+        """Build the canned reply for a failure source"""
+        message, status = cls.FALLBACK_RESPONSES[source]
+        return {
+            'response': message,
+            'source': source,
+            'status': status
+        }
+
+    def _canned_response(self, label: str, user_message: str, history: str) -> Optional[Dict[str, Any]]:
+        """Canned reply for a greeting, thanks or off-topic message
+
+        Off-topic replies are skipped mid-conversation (the message may be a
+        follow-up) and when the knowledge base finds the question relevant.
+        """
+        if label == 'out_of_scope':
+            if history:
+                return None
+            if self.knowledge_base is not None and any(
+                    hit['confidence'] >= Config.KB_MIN_CONFIDENCE for hit in self.knowledge_base.search(user_message)):
+                return None
+        return {
+            'response': self.CANNED_RESPONSES[label],
+            'source': 'canned',
+            'status': 'success'
+        }
+
+    def _remember(self, session_id: Optional[str], user_message: str, result: Dict[str, Any]) -> None:
+        """Add a successful answer to the session history and prefetch its likely follow-ups"""
+        if result['status'] != 'success':
+            return
+        if self.sessions is not None and session_id:
+            self.sessions.record(session_id, user_message, result['response'])
+        if self.prefetcher is not None:
+            self.prefetcher.observe(user_message, session_id)
+
+    def _prepare(self, user_message: str, session_id: Optional[str] = None, profile: Optional[str] = None
+                 ) -> Tuple[Optional[Dict[str, Any]], Optional[str], Optional[str]]:
+        """Answer locally when possible, otherwise build the Gemini prompt
+
+        Returns (response, None, None) for invalid input, canned replies, cache
+        hits, precomputed FAQ answers, confident knowledge base answers and AI
+        outages, or (None, prompt, generation profile). Questions asked
+        mid-conversation skip the cache and precomputed answers, since they
+        may depend on earlier turns; so do questions with an explicitly
+        requested profile, since stored answers were sized for another one.
+        """
+        # Validate input
+        if not user_message or len(user_message.strip()) == 0:
+            return self._fallback_response('validation_error'), None, None
+
+        history = self.sessions.history(session_id) if self.sessions is not None else ''
+
+        # Route the question: canned reply, knowledge lookup, short answer or full generation
+        label, route = self.router.route(user_message) if self.router is not None else ('full', 'full')
+        if route == 'canned':
+            canned = self._canned_response(label, user_message, history)
+            if canned is not None:
+                logger.info(f"✅ Canned reply served ({label})")
+                self._count('canned')
+                return canned, None, None
+            route = 'full'
+
+        # Detected once here and passed to the cache key, FAQ and follow-up slots and the prompt
+        language = detect_language(user_message)
+
+        # Serve repeated questions from the answer cache
+        reusable = not history and profile is None
+        cached = self.cache.get(user_message, language) if reusable else None
+        if cached is not None:
+            logger.info("✅ Answer served from cache")
+            result = {**cached, 'source': 'cache'}
+            self._remember(session_id, user_message, result)
+            self._count('cache')
+            return result, None, None
+
+        # Serve common questions from the precomputed FAQ answers (built by warmup.py)
+        faq_answer = self.faq.lookup(user_message, language) if reusable and self.faq is not None else None
+        if faq_answer is not None:
+            logger.info("✅ Answer served from FAQ store")
+            self._remember(session_id, user_message, faq_answer)
+            self._count('faq')
+            return faq_answer, None, None
+
+        # Follow-ups on the document being discussed: precomputed, or prefetched while the last answer was read
+        followup = (self.prefetcher.lookup(user_message, session_id, language)
+                    if self.prefetcher is not None and profile is None else None)
+        if followup is not None:
+            logger.info(f"✅ Follow-up served ({followup['source']})")
+            self._remember(session_id, user_message, followup)
+            self._count(followup['source'])
+            return followup, None, None
+
+        # Answer from the local knowledge base, or pick passages for the prompt
+        passages = []
+        if self.knowledge_base is not None:
+            hits = self.knowledge_base.search(user_message)
+            # Questions classified as simple lookups accept a less certain match
+            min_confidence = Config.CLASSIFIER_LOOKUP_CONFIDENCE if route == 'knowledge' else None
+            answer = None if history else self.knowledge_base.direct_answer(hits, min_confidence)
+            if answer:
+                logger.info("✅ Answer served from knowledge base")
+                result = {
+                    'response': answer,
+                    'source': 'knowledge_base',
+                    'status': 'success'
+                }
+                self._remember(session_id, user_message, result)
+                self._count('knowledge_base')
+                return result, None, None
+            passages = [hit for hit in hits if hit['confidence'] >= Config.KB_MIN_CONFIDENCE]
+
+        # Check if a backend is available; one still warming up holds the call until it is
+        if not self._backends():
+            return self._fallback_response('ai_unavailable'), None, None
+
+        # Lookups the knowledge base could not answer get the same short answer
+        intent = SystemPrompts.detect_intent(user_message)
+        if route in ('short', 'knowledge') and intent == 'full':
+            intent = 'short'
+        profile = profile or choose_profile(user_message, intent)
+
+        # Create optimized prompt for Gemini
+        stage_start = time.perf_counter()
+        prompt = SystemPrompts.create_prompt(user_message, passages, language=language, intent=intent,
+                                             history=history)
+        metrics.observe('prompt', stage_start)
+        return None, prompt, profile
+
+    def _speculate(self, user_message: str, deadline: float) -> Optional[bool]:
+        """Answer a predicted follow-up with Gemini and cache it; False when nothing came back
+
+        Returns None without calling Gemini while it is failing; prefetches
+        never fail over to the local model. They never queue for quota either:
+        RateLimitExceeded is raised unless the call can go right now.
+        """
+        if not (self.ai_client.is_healthy() and self.primary_health.allows()):
+            return None
+        passages = []
+        if self.knowledge_base is not None:
+            passages = [hit for hit in self.knowledge_base.search(user_message)
+                        if hit['confidence'] >= Config.KB_MIN_CONFIDENCE]
+        intent = SystemPrompts.detect_intent(user_message)
+        prompt = SystemPrompts.create_prompt(user_message, passages, intent=intent)
+        try:
+            text = self.ai_client.generate_response(prompt, deadline, choose_profile(user_message, intent),
+                                                    queue=False)
+        except RateLimitExceeded:
+            raise
+        except Exception as e:
+            logger.warning(f"Prefetch generation failed: {e}")
+            text = None
+        self._record(self.ai_client, bool(text))
+        if not text or not text.strip():
+            return False
+        self.cache.set(user_message, {
+            'response': text.strip(),
+            'source': self.ai_client.source,
+            'status': 'success'
+        })
+        return True
+
+    def _backends(self) -> List[GenerationBackend]:
+        """Backends to try for a generated answer, in order
+
+        Gemini is skipped while it is unavailable, has no endpoint open to
+        traffic or has failed FAILOVER_THRESHOLD times in a row (then for
+        FAILOVER_COOLDOWN seconds), as long as the local model can answer.
+        """
+        backends = []
+        primary_state = self.ai_client.get_state()
+        if primary_state == 'warming' or (self.ai_client.is_healthy() and self.primary_health.allows()):
+            backends.append(self.ai_client)
+        if self.fallback is not None and self.fallback.get_state() != 'unavailable':
+            backends.append(self.fallback)
+        if not backends and primary_state != 'unavailable':
+            # Nothing to fail over to, so Gemini gets the call anyway
+            backends.append(self.ai_client)
+        return backends
+
+    def _record(self, backend: GenerationBackend, ok: bool) -> None:
+        """Track Gemini's health for failover"""
+        if backend is self.ai_client:
+            if ok:
+                self.primary_health.record_success()
+            else:
+                self.primary_health.record_failure()
+
+    def _fail_over(self, backend: GenerationBackend, reason: str) -> None:
+        self.failovers += 1
+        logger.warning(f"⚡ {backend.name} {reason}, failing over to the next backend")
+
+    def _generate(self, prompt: str, deadline: Optional[float] = None,
+                  profile: Optional[str] = None) -> Tuple[Optional[str], str]:
+        """Generate with the first backend that answers; returns (text, source of that backend)"""
+        backends = self._backends()
+        for position, backend in enumerate(backends):
+            last = position == len(backends) - 1
+            try:
+                text = backend.generate_response(prompt, deadline, profile)
+            except RateLimitExceeded:
+                # Out of Gemini quota, but the local model can still answer
+                if last:
+                    raise
+                self._fail_over(backend, 'has no quota left')
+                continue
+            self._record(backend, bool(text))
+            if text or last:
+                return text, backend.source
+            self._fail_over(backend, 'failed')
+        return None, self.ai_client.source
+
+    async def _generate_async(self, prompt: str, deadline: Optional[float] = None,
+                              profile: Optional[str] = None) -> Tuple[Optional[str], str]:
+        """Async variant of _generate"""
+        backends = self._backends()
+        for position, backend in enumerate(backends):
+            last = position == len(backends) - 1
+            try:
+                text = await backend.generate_response_async(prompt, deadline, profile)
+            except RateLimitExceeded:
+                if last:
+                    raise
+                self._fail_over(backend, 'has no quota left')
+                continue
+            self._record(backend, bool(text))
+            if text or last:
+                return text, backend.source
+            self._fail_over(backend, 'failed')
+        return None, self.ai_client.source
+
+    def _stream(self, prompt: str, deadline: Optional[float] = None,
+                profile: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+        """Stream (source, text) from the first backend that produces text
+
+        Failing over is only possible until the first chunk has been sent.
+        """
+        backends = self._backends()
+        for position, backend in enumerate(backends):
+            last = position == len(backends) - 1
+            sent = False
+            try:
+                for text in backend.stream_response(prompt, deadline, profile):
+                    sent = True
+                    yield backend.source, text
+            except DeadlineExceeded:
+                raise
+            except RateLimitExceeded:
+                if last or sent:
+                    raise
+                self._fail_over(backend, 'has no quota left')
+                continue
+            except Exception:
+                self._record(backend, False)
+                if last or sent:
+                    raise
+                self._fail_over(backend, 'failed')
+                continue
+            self._record(backend, sent)
+            if sent:
+                return
+            if not last:
+                self._fail_over(backend, 'returned nothing')
+
+    async def _stream_async(self, prompt: str, deadline: Optional[float] = None,
+                            profile: Optional[str] = None) -> AsyncIterator[Tuple[str, str]]:
+        """Async variant of _stream"""
+        backends = self._backends()
+        for position, backend in enumerate(backends):
+            last = position == len(backends) - 1
+            sent = False
+            try:
+                async for text in backend.stream_response_async(prompt, deadline, profile):
+                    sent = True
+                    yield backend.source, text
+            except DeadlineExceeded:
+                raise
+            except RateLimitExceeded:
+                if last or sent:
+                    raise
+                self._fail_over(backend, 'has no quota left')
+                continue
+            except Exception:
+                self._record(backend, False)
+                if last or sent:
+                    raise
+                self._fail_over(backend, 'failed')
+                continue
+            self._record(backend, sent)
+            if sent:
+                return
+            if not last:
+                self._fail_over(backend, 'returned nothing')
+
+    def _finish(self, user_message: str, ai_response: Optional[str], session_id: Optional[str] = None,
+                cache: bool = True, source: str = GeminiClient.source) -> Dict[str, Any]:
+        """Turn generated text into a response, caching successful answers unless cache is False
+
+        Local model answers are never cached, so the question goes to Gemini
+        again once it is back.
+        """
+        self._count(source)
+        if ai_response and len(ai_response.strip()) > 0:
+            logger.info(f"✅ Response generated ({source})")
+            result = {
+                'response': ai_response.strip(),
+                'source': source,
+                'status': 'success'
             }
+            # Answers that relied on earlier turns are not reusable for other users
+            if (cache and source == self.ai_client.source
+                    and (self.sessions is None or not self.sessions.has_history(session_id))):
+                self.cache.set(user_message, result)
+            self._remember(session_id, user_message, result)
+            return result
+
+        logger.warning(f"Empty response ({source})")
+        return self._fallback_response('empty_response')
+
+    def get_response(self, user_message: str, session_id: Optional[str] = None,
+                     deadline: Optional[float] = None, profile: Optional[str] = None) -> Dict[str, Any]:
+        """Get response using Gemini AI with proper error handling
+
+        deadline is a time.monotonic() value after which the Gemini call is
+        abandoned. profile forces a generation profile instead of choosing one
+        from the question. Raises RateLimitExceeded when the Gemini quota has no room in time.
+        """
+        logger.debug(f"Processing user question: {user_message}")
+
+        try:
+            early, prompt, chosen = self._prepare(user_message, session_id, profile)
+            if early is not None:
+                return early
+
+            # Generate response using Gemini, or the local model while Gemini is failing
+            # Followers of a coalesced call wait on the leader's deadline
+            ai_response, source = self.singleflight.do((prompt, chosen), self._generate, prompt, deadline, chosen)
+            return self._finish(user_message, ai_response, session_id, cache=profile is None, source=source)
+
+        except RateLimitExceeded:
+            raise
+        except DeadlineExceeded:
+            logger.warning("⏳ Request deadline passed before Gemini answered")
+            return self._fallback_response('timeout')
+        except Exception as e:
+            logger.error(f"Error in response generation: {e}")
+            return self._fallback_response('server_error')
+
+    async def get_response_async(self, user_message: str, session_id: Optional[str] = None,
+                                 deadline: Optional[float] = None, profile: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of get_response for AsyncGeminiClient
+
+        Raises RateLimitExceeded (or UpstreamBusyError) when the call cannot be admitted in time.
+        """
+        logger.debug(f"Processing user question: {user_message}")
+
+        try:
+            early, prompt, chosen = await self.run_blocking(self._prepare, user_message, session_id, profile)
+            if early is not None:
+                return early
+
+            ai_response, source = await self.async_singleflight.do(
+                (prompt, chosen), self._generate_async, prompt, deadline, chosen
+            )
+            return await self.run_blocking(self._finish, user_message, ai_response, session_id,
+                                           profile is None, source)
+
+        except RateLimitExceeded:
+            raise
+        except DeadlineExceeded:
+            logger.warning("⏳ Request deadline passed before Gemini answered")
+            return self._fallback_response('timeout')
+        except Exception as e:
+            logger.error(f"Error in response generation: {e}")
+            return self._fallback_response('server_error')
+
+    def _plan_batch(self, messages: List[str], use_cache: bool = True
+                    ) -> Tuple[List[Tuple[List[int], Dict[str, Any]]], List[List[int]]]:
+        """Group identical questions and split them into cache hits and ones still to answer
+
+        Returns ([(indexes, cached response)], [indexes]) where each index list
+        shares one normalized question.
+        """
+        groups: Dict[str, List[int]] = OrderedDict()
+        for index, message in enumerate(messages):
+            groups.setdefault(self.cache.make_key(message), []).append(index)
+
+        answered, pending = [], []
+        for indexes in groups.values():
+            cached = self.cache.get(messages[indexes[0]]) if use_cache else None
+            if cached is not None:
+                answered.append((indexes, {**cached, 'source': 'cache'}))
+                self._count('cache', len(indexes))
+            else:
+                pending.append(indexes)
+        return answered, pending
+
+    def _batch_item(self, user_message: str, deadline: Optional[float] = None,
+                    profile: Optional[str] = None) -> Dict[str, Any]:
+        """Answer one batch question, turning a quota rejection into its fallback"""
+        try:
+            return self.get_response(user_message, deadline=deadline, profile=profile)
+        except RateLimitExceeded:
+            return self._fallback_response('rate_limited')
+
+    def get_batch_responses(self, messages: List[str], deadline: Optional[float] = None,
+                            profile: Optional[str] = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Answer many questions, yielding (index, response) pairs as each completes
+
+        Identical questions are answered once and cache hits are yielded first;
+        the rest run on at most BATCH_MAX_WORKERS threads, all under one deadline
+        and generation profile.
+        """
+        answered, pending = self._plan_batch(messages, use_cache=profile is None)
+        logger.info(f"Processing batch of {len(messages)} questions "
+                    f"({len(answered)} cached, {len(pending)} to answer)")
+        for indexes, result in answered:
+            for index in indexes:
+                yield index, result
+        if not pending:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=min(Config.BATCH_MAX_WORKERS, len(pending)))
+        try:
+            futures = {executor.submit(self._batch_item, messages[indexes[0]], deadline, profile): indexes
+                       for indexes in pending}
+            for future in as_completed(futures):
+                result = future.result()
+                for index in futures[future]:
+                    yield index, result
+        finally:
+            # A client that disconnects mid-stream should not keep the queue running
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _batch_item_async(self, user_message: str, deadline: Optional[float] = None,
+                                profile: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of _batch_item"""
+        try:
+            return await self.get_response_async(user_message, deadline=deadline, profile=profile)
+        except RateLimitExceeded as e:
+            return self._fallback_response('server_error' if isinstance(e, UpstreamBusyError) else 'rate_limited')
+
+    async def get_batch_responses_async(self, messages: List[str], deadline: Optional[float] = None,
+                                        profile: Optional[str] = None) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Async variant of get_batch_responses, bounded by a semaphore instead of threads"""
+        answered, pending = await self.run_blocking(self._plan_batch, messages, profile is None)
+        logger.info(f"Processing batch of {len(messages)} questions "
+                    f"({len(answered)} cached, {len(pending)} to answer)")
+        for indexes, result in answered:
+            for index in indexes:
+                yield index, result
+        if not pending:
+            return
+
+        slots = asyncio.Semaphore(Config.BATCH_MAX_WORKERS)
+
+        async def answer(indexes: List[int]) -> Tuple[List[int], Dict[str, Any]]:
+            async with slots:
+                return indexes, await self._batch_item_async(messages[indexes[0]], deadline, profile)
+
+        tasks = [asyncio.ensure_future(answer(indexes)) for indexes in pending]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                indexes, result = await next_done
+                for index in indexes:
+                    yield index, result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stream_response(self, user_message: str, session_id: Optional[str] = None,
+                        deadline: Optional[float] = None, profile: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream response events: 'chunk' events with text, then one 'done' event"""
+        logger.debug(f"Processing streamed user question: {user_message}")
+
+        parts = []
+        source = self.ai_client.source
+        try:
+            early, prompt, chosen = self._prepare(user_message, session_id, profile)
+            if early is not None:
+                yield from self._stream_whole(early)
+                return
+
+            for source, text in self._stream(prompt, deadline, chosen):
+                parts.append(text)
+                yield {'event': 'chunk', 'text': text}
+        except RateLimitExceeded:
+            # Headers are already sent, so answer with the rate-limit message instead of a 429
+            yield from self._stream_whole(self._fallback_response('rate_limited'))
+            return
+        except DeadlineExceeded:
+            logger.warning("⏳ Request deadline passed while streaming")
+            yield from self._stream_failure(parts, 'timeout')
+            return
+        except Exception as e:
+            logger.error(f"Error in streamed response generation: {e}")
+            yield from self._stream_failure(parts)
+            return
+
+        yield from self._stream_finish(user_message, parts, session_id, cache=profile is None, source=source)
+
+    async def stream_response_async(self, user_message: str, session_id: Optional[str] = None,
+                                    deadline: Optional[float] = None,
+                                    profile: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of stream_response for AsyncGeminiClient"""
+        logger.debug(f"Processing streamed user question: {user_message}")
+
+        parts = []
+        source = self.ai_client.source
+        try:
+            early, prompt, chosen = await self.run_blocking(self._prepare, user_message, session_id, profile)
+            if early is not None:
+                for event in self._stream_whole(early):
+                    yield event
+                return
+
+            async for source, text in self._stream_async(prompt, deadline, chosen):
+                parts.append(text)
+                yield {'event': 'chunk', 'text': text}
+        except RateLimitExceeded as e:
+            # Headers are already sent, so answer with the busy message instead of a 429/503
+            source = 'server_error' if isinstance(e, UpstreamBusyError) else 'rate_limited'
+            for event in self._stream_whole(self._fallback_response(source)):
+                yield event
+            return
+        except DeadlineExceeded:
+            logger.warning("⏳ Request deadline passed while streaming")
+            for event in self._stream_failure(parts, 'timeout'):
+                yield event
+            return
+        except Exception as e:
+            logger.error(f"Error in streamed response generation: {e}")
+            for event in self._stream_failure(parts):
+                yield event
+            return
+
+        result = await self.run_blocking(self._finish, user_message, ''.join(parts), session_id,
+                                         profile is None, source)
+        for event in self._stream_done(result, source):
+            yield event
+
+    def _stream_failure(self, parts: list, source: str = 'server_error') -> Iterator[Dict[str, Any]]:
+        """Close a stream that failed, sending the fallback text if nothing was sent yet"""
+        if not parts:
+            yield from self._stream_whole(self._fallback_response(source))
+        else:
+            yield {'event': 'done', 'source': source, 'status': 'error'}
+
+    def _stream_finish(self, user_message: str, parts: list, session_id: Optional[str] = None,
+                       cache: bool = True, source: str = GeminiClient.source) -> Iterator[Dict[str, Any]]:
+        """Close a completed stream, caching the assembled answer"""
+        result = self._finish(user_message, ''.join(parts), session_id, cache, source)
+        yield from self._stream_done(result, source)
+
+    def _stream_done(self, result: Dict[str, Any], source: str) -> Iterator[Dict[str, Any]]:
+        """Final events of a streamed answer, replaced whole when _finish swapped in a fallback"""
+        if result['source'] != source:
+            yield from self._stream_whole(result)
+            return
+        yield {'event': 'done', 'source': result['source'], 'status': result['status']}
+
+    @staticmethod
+    def _stream_whole(result: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Emit a complete response as a single chunk followed by 'done'"""
+        yield {'event': 'chunk', 'text': result['response']}
+        yield {'event': 'done', 'source': result['source'], 'status': result['status']}
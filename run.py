@@ -3,20 +3,21 @@
 Government Helper Application Entry Point - Gemini AI Only
 """
 from dotenv import load_dotenv
-from app import main
-import logging
+from config import Config
+from log_pipeline import configure_logging
 
 # Load environment variables first
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 
 if __name__ == "__main__":
     print("🏛️ Starting Government Helper Application with Gemini AI...")
     print("📱 Visit http://localhost:5000 to use the application")
     print("🤖 Powered by Google Gemini AI")
+    if Config.SERVER_MODE == 'asgi':
+        from async_app import main
+    else:
+        from app import main
     main()
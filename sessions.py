@@ -0,0 +1,319 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+from config import Config
+from prompts import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Rough per-record overhead (object headers, slots, list entries) for memory accounting
+_TURN_OVERHEAD = 120
+_SESSION_OVERHEAD = 240
+
+class Turn:
+    """One question and its (truncated) answer"""
+
+    __slots__ = ('question', 'answer', 'tokens')
+
+    def __init__(self, question: str, answer: str, tokens: Optional[int] = None):
+        self.question = question
+        self.answer = answer
+        self.tokens = tokens if tokens is not None else estimate_tokens(question) + estimate_tokens(answer) + 4
+
+    def size(self) -> int:
+        return len(self.question.encode('utf-8')) + len(self.answer.encode('utf-8')) + _TURN_OVERHEAD
+
+class Session:
+    """Recent turns of one conversation plus a summary of the ones folded away"""
+
+    __slots__ = ('turns', 'summary', 'size', 'updated_at')
+
+    def __init__(self, turns: Optional[List[Turn]] = None, summary: str = '', updated_at: Optional[float] = None):
+        self.turns = turns or []
+        self.summary = summary
+        self.updated_at = updated_at or time.time()
+        self.size = _SESSION_OVERHEAD + len(summary.encode('utf-8')) + sum(turn.size() for turn in self.turns)
+
+    def add(self, question: str, answer: str) -> None:
+        """Append a turn, folding the oldest turns into the summary past SESSION_MAX_TURNS"""
+        turn = Turn(question, answer[:Config.SESSION_MAX_ANSWER_CHARS])
+        self.turns.append(turn)
+        self.size += turn.size()
+        while len(self.turns) > Config.SESSION_MAX_TURNS:
+            oldest = self.turns.pop(0)
+            self.size -= oldest.size() + len(self.summary.encode('utf-8'))
+            self.summary = _fold_summary(self.summary, oldest.question)
+            self.size += len(self.summary.encode('utf-8'))
+        self.updated_at = time.time()
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'summary': self.summary,
+            'turns': [[turn.question, turn.answer] for turn in self.turns]
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str, updated_at: float) -> 'Session':
+        value = json.loads(data)
+        return cls([Turn(question, answer) for question, answer in value['turns']], value['summary'], updated_at)
+
+def _fold_summary(summary: str, question: str) -> str:
+    """Keep earlier questions as a short '; '-separated list, dropping the oldest past the cap"""
+    question = ' '.join(question.split())
+    if len(question) > 80:
+        question = question[:77] + '...'
+    summary = f"{summary}; {question}" if summary else question
+    while len(summary) > Config.SESSION_SUMMARY_CHARS and '; ' in summary:
+        summary = summary.split('; ', 1)[1]
+    return summary[-Config.SESSION_SUMMARY_CHARS:]
+
+def format_history(session: Session, token_budget: int) -> str:
+    """Render the newest turns that fit the token budget; older questions become one summary line"""
+    window: List[Turn] = []
+    used = 0
+    for turn in reversed(session.turns):
+        if used + turn.tokens > token_budget:
+            break
+        window.append(turn)
+        used += turn.tokens
+
+    earlier = [turn.question for turn in session.turns[:len(session.turns) - len(window)]]
+    summary = session.summary
+    for question in earlier:
+        summary = _fold_summary(summary, question)
+
+    lines = []
+    if summary:
+        line = f"Earlier questions: {summary}"
+        remaining = token_budget - used
+        while line and estimate_tokens(line) > remaining:
+            # Drop the oldest summarized questions until the line fits
+            line = f"Earlier questions: {line.split('; ', 1)[1]}" if '; ' in line else ''
+        if line:
+            lines.append(line)
+    for turn in reversed(window):
+        lines.append(f"Q: {turn.question}\nA: {turn.answer}")
+    return '\n'.join(lines)
+
+class DiskSessionBackend:
+    """SQLite-backed sessions so conversations survive restarts and memory eviction"""
+
+    def __init__(self, path: str, ttl_seconds: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS sessions_age ON sessions (updated_at)')
+        conn.commit()
+        return conn
+
+    def reopen(self) -> None:
+        """Open a fresh connection; SQLite connections must not be shared across fork"""
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Load a live session"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data, updated_at FROM sessions WHERE session_id = ?', (session_id,)
+            ).fetchone()
+        if row is None or row[1] < time.time() - self.ttl_seconds:
+            return None
+        return Session.from_json(row[0], row[1])
+
+    def set(self, session_id: str, data: str, updated_at: float) -> None:
+        """Persist a session, pruning expired ones every few hundred writes"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)',
+                (session_id, data, updated_at)
+            )
+            self._writes += 1
+            if self._writes % 500 == 0:
+                self._conn.execute('DELETE FROM sessions WHERE updated_at < ?', (time.time() - self.ttl_seconds,))
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+class SessionStore:
+    """Conversation history per session: LRU in memory under a byte cap, optional SQLite tier
+
+    Under launcher.py the shared store holds the current copy of every
+    session, since consecutive turns may reach different workers; memory
+    then only saves re-parsing it.
+    """
+
+    def __init__(self, max_sessions: int, max_bytes: int, ttl_seconds: int,
+                 disk: Optional[DiskSessionBackend] = None, shared=None):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk = disk
+        self.shared = shared
+        self.total_bytes = 0
+        self.evictions = 0
+        self._sessions: 'OrderedDict[str, Session]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, shared=None) -> Optional['SessionStore']:
+        """Build the store described by Config, or None when sessions are disabled"""
+        if not Config.SESSIONS_ENABLED:
+            return None
+        disk = None
+        if Config.SESSION_DISK_PATH:
+            try:
+                disk = DiskSessionBackend(Config.SESSION_DISK_PATH, Config.SESSION_TTL_SECONDS)
+                logger.info(f"✅ Sessions persisted at {Config.SESSION_DISK_PATH}")
+            except sqlite3.Error as e:
+                logger.error(f"❌ Failed to open session store on disk: {e}")
+        return cls(Config.SESSION_MAX_SESSIONS, Config.SESSION_MAX_BYTES, Config.SESSION_TTL_SECONDS, disk, shared)
+
+    def reopen(self) -> None:
+        """Reopen the disk tier in a freshly forked worker"""
+        if self.disk is not None:
+            self.disk.reopen()
+
+    def _get(self, session_id: str) -> Optional[Session]:
+        """Find a live session in memory; caller holds the lock"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if session.updated_at < time.time() - self.ttl_seconds:
+            del self._sessions[session_id]
+            self.total_bytes -= session.size
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _put(self, session_id: str, session: Session) -> None:
+        """Insert a session and evict idle ones over the limits; caller holds the lock"""
+        self._sessions[session_id] = session
+        self.total_bytes += session.size
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used sessions while over the limits; caller holds the lock"""
+        while self._sessions and (len(self._sessions) > self.max_sessions or self.total_bytes > self.max_bytes):
+            _, evicted = self._sessions.popitem(last=False)
+            self.total_bytes -= evicted.size
+            self.evictions += 1
+
+    def _load_shared(self, session_id: str) -> Optional[Session]:
+        """Replace the memory copy of a session with the one in the shared store"""
+        try:
+            entry = self.shared.get(f"session|{session_id}")
+        except OSError as e:
+            logger.warning(f"Shared session read failed: {e}")
+            return None
+        if entry is None:
+            return None
+        value, _ = entry
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session.updated_at >= value['updated_at']:
+                self._sessions.move_to_end(session_id)
+                return session
+            if session is not None:
+                del self._sessions[session_id]
+                self.total_bytes -= session.size
+            session = Session.from_json(value['data'], value['updated_at'])
+            self._put(session_id, session)
+        return session
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        """Get a session from the shared store or memory, falling back to disk"""
+        if self.shared is not None:
+            session = self._load_shared(session_id)
+            if session is not None:
+                return session
+        with self._lock:
+            session = self._get(session_id)
+        if session is not None or self.disk is None:
+            return session
+        session = self.disk.get(session_id)
+        if session is not None:
+            with self._lock:
+                if session_id not in self._sessions:
+                    self._put(session_id, session)
+                session = self._sessions[session_id]
+        return session
+
+    def history(self, session_id: Optional[str], token_budget: int = Config.SESSION_HISTORY_TOKEN_BUDGET) -> str:
+        """Conversation so far, windowed to the token budget ('' for new sessions)"""
+        if not session_id:
+            return ''
+        session = self._load(session_id)
+        if session is None:
+            return ''
+        with self._lock:
+            return format_history(session, token_budget)
+
+    def recent_questions(self, session_id: Optional[str]) -> List[str]:
+        """Questions of the turns still kept in full, oldest first"""
+        if not session_id:
+            return []
+        session = self._load(session_id)
+        if session is None:
+            return []
+        with self._lock:
+            return [turn.question for turn in session.turns]
+
+    def has_history(self, session_id: Optional[str]) -> bool:
+        """Check if a session already has turns"""
+        return bool(session_id) and self._load(session_id) is not None
+
+    def record(self, session_id: Optional[str], question: str, answer: str) -> None:
+        """Add a turn to a session"""
+        if not session_id:
+            return
+        session = self._load(session_id)
+        with self._lock:
+            if session is None:
+                session = self._sessions.get(session_id)
+                if session is None:
+                    session = Session()
+                    self._put(session_id, session)
+            before = session.size
+            session.add(question, answer)
+            self.total_bytes += session.size - before
+            self._evict()
+            data, updated_at = session.to_json(), session.updated_at
+        if self.shared is not None:
+            try:
+                self.shared.set(f"session|{session_id}", {'data': data, 'updated_at': updated_at},
+                                updated_at + self.ttl_seconds)
+            except OSError as e:
+                logger.warning(f"Shared session write failed: {e}")
+        if self.disk is not None:
+            try:
+                self.disk.set(session_id, data, updated_at)
+            except sqlite3.Error as e:
+                logger.error(f"❌ Failed to persist session: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get session store statistics"""
+        return {
+            'sessions': len(self._sessions),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+            'disk': len(self.disk) if self.disk is not None else None
+        }
@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Optional, Dict, Any, List, Tuple
+from answer_cache import MemoryCacheBackend
+from config import Config
+from rate_limiter import TokenBucket, bucket_for
+
+logger = logging.getLogger(__name__)
+
+# Idle connections kept per client; threaded servers use a new thread per request
+_POOL_SIZE = 16
+_MAX_BUCKETS = 65536
+
+class SharedStoreError(OSError):
+    """Raised when the shared store cannot be reached or rejects a request"""
+
+class SharedStoreServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Key/value entries and token buckets shared by the workers of launcher.py
+
+    Runs in its own process and speaks newline-delimited JSON over a Unix
+    socket. Entries (cached answers and sessions) live in one LRU sized for
+    both; buckets are created on first use with the rate and capacity the
+    caller sends.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: str,
+                 max_entries: int = Config.CACHE_MAX_ENTRIES + Config.SESSION_MAX_SESSIONS,
+                 max_bytes: int = Config.CACHE_MAX_BYTES + Config.SESSION_MAX_BYTES):
+        self.entries = MemoryCacheBackend(max_entries, max_bytes)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _StoreHandler)
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        return self.entries.entry(key)
+
+    def set(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        self.entries.set(key, value, expires_at)
+
+    def take(self, buckets: List[Tuple[str, float, float, float]]) -> float:
+        """Take from every (name, rate, capacity, amount) bucket, or from none and return the wait"""
+        now = time.monotonic()
+        with self._lock:
+            found = []
+            for name, rate, capacity, amount in buckets:
+                bucket = bucket_for(self.buckets, name, rate, capacity, _MAX_BUCKETS, now)
+                # Settings follow the callers, e.g. after a reload with a new quota
+                bucket.rate, bucket.capacity = rate, capacity
+                found.append((bucket, amount))
+            wait = max(bucket.wait_time(amount, now) for bucket, amount in found)
+            if not wait:
+                for bucket, amount in found:
+                    bucket.try_take(amount, now)
+        return wait
+
+    def level(self, buckets: List[Tuple[str, float, float]]) -> float:
+        """Smallest share of capacity available across (name, rate, capacity) buckets, without taking any"""
+        now = time.monotonic()
+        with self._lock:
+            levels = [1.0]
+            for name, rate, capacity in buckets:
+                bucket = self.buckets.get(name)
+                if bucket is not None:
+                    bucket.rate, bucket.capacity = rate, capacity
+                    levels.append(bucket.level(now))
+        return min(levels)
+
+    def stats(self) -> Dict[str, Any]:
+        prefixes: Dict[str, int] = {}
+        with self._lock:
+            for name in self.buckets:
+                prefix = name.split('|', 1)[0]
+                prefixes[prefix] = prefixes.get(prefix, 0) + 1
+        return {
+            'entries': len(self.entries),
+            'bytes': self.entries.total_bytes,
+            'evictions': self.entries.evictions,
+            'buckets': prefixes,
+            'requests': self.requests
+        }
+
+    def dispatch(self, request: Dict[str, Any]) -> Any:
+        """Run one request: get, set, take, level or stats"""
+        self.requests += 1
+        op = request['op']
+        if op == 'get':
+            return self.get(request['key'])
+        if op == 'set':
+            return self.set(request['key'], request['value'], request['expires_at'])
+        if op == 'take':
+            return self.take(request['buckets'])
+        if op == 'level':
+            return self.level(request['buckets'])
+        if op == 'stats':
+            return self.stats()
+        raise ValueError(f"unknown op {op!r}")
+
+class _StoreHandler(socketserver.StreamRequestHandler):
+    """One client connection: a request per line, answered in order"""
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                reply = {'result': self.server.dispatch(json.loads(line))}
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'error': str(e)}
+            self.wfile.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+
+def serve(path: str) -> None:
+    """Run the shared store until the process is terminated"""
+    server = SharedStoreServer(path)
+    logger.info(f"✅ Shared store listening on {path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+class SharedStore:
+    """Client for the shared store, safe to use from threads and across fork"""
+
+    def __init__(self, path: str, timeout: float = 1.0):
+        self.path = path
+        self.timeout = timeout
+        self.errors = 0
+        self._idle: List[Tuple[socket.socket, Any]] = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> Optional['SharedStore']:
+        """Client for the store launcher.py started, or None when running as a single process"""
+        return cls(Config.SHARED_STORE_SOCKET) if Config.SHARED_STORE_SOCKET else None
+
+    def _connection(self) -> Tuple[socket.socket, Any]:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections inherited from the parent process belong to it
+                self._idle, self._pid = [], os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock, sock.makefile('rb')
+
+    def call(self, op: str, **arguments) -> Any:
+        """Send one request and wait for its reply; raises SharedStoreError"""
+        try:
+            connection = self._connection()
+        except OSError as e:
+            self.errors += 1
+            raise SharedStoreError(f"Shared store unavailable: {e}") from e
+        sock, reader = connection
+        try:
+            sock.sendall(json.dumps({'op': op, **arguments}, ensure_ascii=False).encode('utf-8') + b'\n')
+            line = reader.readline()
+            if not line:
+                raise ConnectionError('connection closed')
+        except OSError as e:
+            self.errors += 1
+            reader.close()
+            sock.close()
+            raise SharedStoreError(f"Shared store request failed: {e}") from e
+        with self._lock:
+            if len(self._idle) < _POOL_SIZE and self._pid == os.getpid():
+                self._idle.append(connection)
+                connection = None
+        if connection is not None:
+            reader.close()
+            sock.close()
+
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise SharedStoreError(reply['error'])
+        return reply['result']
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Live entry and its expiry time (time.time())"""
+        entry = self.call('get', key=key)
+        return (entry[0], entry[1]) if entry is not None else None
+
+    def set(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        """Store an entry until expires_at (time.time())"""
+        self.call('set', key=key, value=value, expires_at=expires_at)
+
+    def take(self, buckets: List[Tuple[str, float, float, float]]) -> float:
+        """Take from all (name, rate per second, capacity, amount) buckets at once; 0 or the wait needed"""
+        return self.call('take', buckets=buckets)
+
+    def level(self, buckets: List[Tuple[str, float, float]]) -> float:
+        """Smallest share of capacity left in the (name, rate per second, capacity) buckets; takes nothing"""
+        return self.call('level', buckets=buckets)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store-wide statistics"""
+        return {'path': self.path, 'client_errors': self.errors, **self.call('stats')}
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+class _Call:
+    """An in-flight call that followers wait on"""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Collapses concurrent identical calls from threads into one execution"""
+
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn once per key at a time; concurrent callers share its result or error"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get coalescing statistics"""
+        return {
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._calls)
+        }
+
+class AsyncSingleFlight:
+    """Collapses concurrent identical coroutine calls into one task"""
+
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, 'asyncio.Future[Any]'] = {}
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Await fn once per key at a time; concurrent callers share its result or error
+
+        The shared call runs as its own task, so a caller that is cancelled
+        does not cancel the call for the others.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get coalescing statistics"""
+        return {
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._calls)
+        }
@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import logging
+import re
+from typing import Optional, Dict, Tuple
+from templates import HTMLTemplate
+
+try:
+    import brotli
+except ImportError:  # Brotli variants are optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_PREFIX = '/static/'
+# Fingerprinted assets never change under the same URL
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# The page itself is revalidated on each visit so new fingerprints are picked up
+PAGE_CACHE_CONTROL = 'no-cache'
+
+_STYLE_RE = re.compile(r'<style>(.*?)</style>', re.S)
+_SCRIPT_RE = re.compile(r'<script>(.*?)</script>', re.S)
+
+class StaticAsset:
+    """One static file with precomputed compressed variants"""
+
+    __slots__ = ('content_type', 'cache_control', 'variants')
+
+    def __init__(self, body: bytes, content_type: str, cache_control: str):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        # encoding -> (body, etag); each representation gets its own strong ETag
+        self.variants: Dict[Optional[str], Tuple[bytes, str]] = {None: (body, f'"{digest}"')}
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = (compressed, f'"{digest}-gz"')
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants['br'] = (compressed, f'"{digest}-br"')
+
+    @property
+    def fingerprint(self) -> str:
+        return self.variants[None][1].strip('"')
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[bytes, str, Optional[str]]:
+        """Pick the smallest variant the client accepts: (body, etag, encoding)"""
+        accepted = {token.split(';')[0].strip().lower() for token in (accept_encoding or '').split(',')
+                    if not token.replace(' ', '').endswith(';q=0')}
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                return (*self.variants[encoding], encoding)
+        return (*self.variants[None], None)
+
+class StaticAssets:
+    """Main page and its CSS/JS, rendered once at startup"""
+
+    def __init__(self, template: str = HTMLTemplate.MAIN_TEMPLATE):
+        self.assets: Dict[str, StaticAsset] = {}
+
+        css = '\n'.join(_STYLE_RE.findall(template)).strip().encode('utf-8')
+        js = '\n'.join(_SCRIPT_RE.findall(template)).strip().encode('utf-8')
+        css_name = self._add('app.{}.css', css, 'text/css; charset=utf-8')
+        js_name = self._add('app.{}.js', js, 'application/javascript; charset=utf-8')
+
+        html = _STYLE_RE.sub('', template, count=1)
+        html = html.replace('</head>', f'    <link rel="stylesheet" href="{STATIC_PREFIX}{css_name}">\n</head>', 1)
+        html = _SCRIPT_RE.sub(lambda _: f'<script src="{STATIC_PREFIX}{js_name}"></script>', html, count=1)
+        self.index = StaticAsset(html.strip().encode('utf-8'), 'text/html; charset=utf-8', PAGE_CACHE_CONTROL)
+
+        logger.info(f"✅ Static assets ready: {', '.join(self.assets)} "
+                    f"(brotli {'on' if brotli is not None else 'off'})")
+
+    def _add(self, pattern: str, body: bytes, content_type: str) -> str:
+        """Register a fingerprinted asset and return its file name"""
+        asset = StaticAsset(body, content_type, IMMUTABLE_CACHE_CONTROL)
+        name = pattern.format(asset.fingerprint[:10])
+        self.assets[name] = asset
+        return name
+
+    @staticmethod
+    def respond(asset: StaticAsset, accept_encoding: Optional[str],
+                if_none_match: Optional[str]) -> Tuple[int, bytes, Dict[str, str]]:
+        """Build (status, body, headers) for an asset, answering 304 when the client copy is current"""
+        body, etag, encoding = asset.select(accept_encoding)
+        headers = {
+            'ETag': etag,
+            'Cache-Control': asset.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+        if if_none_match and (if_none_match.strip() == '*' or etag in
+                              [tag.strip().lstrip('W/') for tag in if_none_match.split(',')]):
+            return 304, b'', headers
+
+        headers['Content-Type'] = asset.content_type
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return 200, body, headers
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Sizes of each asset variant in bytes"""
+        return {
+            name: {encoding or 'identity': len(body) for encoding, (body, _) in asset.variants.items()}
+            for name, asset in [('index.html', self.index), *self.assets.items()]
+        }
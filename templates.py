@@ -184,9 +184,25 @@ class HTMLTemplate:
                 this.sendButton = document.getElementById('sendButton');
                 this.loading = document.getElementById('loading');
                 this.status = document.getElementById('status');
+                this.sessionId = this.getSessionId();
                 
                 this.init();
             }
+
+            getSessionId() {
+                // One conversation per browser tab, so follow-up questions keep their context
+                try {
+                    let id = sessionStorage.getItem('sessionId');
+                    if (!id) {
+                        id = (window.crypto && crypto.randomUUID) ? crypto.randomUUID()
+                            : Date.now().toString(36) + Math.random().toString(36).slice(2);
+                        sessionStorage.setItem('sessionId', id);
+                    }
+                    return id;
+                } catch (e) {
+                    return null;
+                }
+            }
             
             init() {
                 // Event listeners
@@ -218,26 +234,11 @@ class HTMLTemplate:
                 this.showStatus('AI సమాధానం తయారు చేస్తోంది...', 'loading');
                 
                 try {
-                    const response = await fetch('/chat', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({ message: message })
-                    });
-                    
-                    if (!response.ok) {
-                        throw new Error(`HTTP error! status: ${response.status}`);
+                    if (window.ReadableStream && window.TextDecoder) {
+                        await this.streamResponse(message);
+                    } else {
+                        await this.fetchResponse(message);
                     }
-                    
-                    const data = await response.json();
-                    
-                    if (data.error) {
-                        throw new Error(data.error);
-                    }
-                    
-                    // Show AI response
-                    this.addMessage(data.response, 'ai');
                     this.showStatus('✅ సమాధానం పూర్తయింది', 'success');
                     
                 } catch (error) {
@@ -252,6 +253,103 @@ class HTMLTemplate:
                 }
             }
             
+            async fetchResponse(message) {
+                const response = await fetch('/chat', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ message: message, session_id: this.sessionId })
+                });
+                
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                
+                const data = await response.json();
+                
+                if (data.error) {
+                    throw new Error(data.error);
+                }
+                
+                // Show AI response
+                this.addMessage(data.response, 'ai');
+            }
+            
+            async streamResponse(message) {
+                const response = await fetch('/chat/stream', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'Accept': 'text/event-stream',
+                    },
+                    body: JSON.stringify({ message: message, session_id: this.sessionId })
+                });
+                
+                if (!response.ok) {
+                    let errorMessage = `HTTP error! status: ${response.status}`;
+                    try {
+                        const data = await response.json();
+                        if (data.error) {
+                            errorMessage = data.error;
+                        }
+                    } catch (e) {
+                        // Non-JSON error body
+                    }
+                    throw new Error(errorMessage);
+                }
+                
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                let text = '';
+                let messageDiv = null;
+                
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) {
+                        break;
+                    }
+                    
+                    buffer += decoder.decode(value, { stream: true });
+                    let boundary = buffer.indexOf('\\n\\n');
+                    while (boundary !== -1) {
+                        const event = this.parseEvent(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                        boundary = buffer.indexOf('\\n\\n');
+                        
+                        if (event.name !== 'chunk') {
+                            continue;
+                        }
+                        
+                        // Render tokens as they arrive
+                        text += event.data.text;
+                        if (!messageDiv) {
+                            this.loading.style.display = 'none';
+                            messageDiv = this.addMessage(text, 'ai');
+                        } else {
+                            this.updateMessage(messageDiv, text);
+                        }
+                    }
+                }
+                
+                if (!messageDiv) {
+                    throw new Error('Empty response');
+                }
+            }
+            
+            parseEvent(raw) {
+                const event = { name: 'message', data: {} };
+                raw.split('\\n').forEach((line) => {
+                    if (line.startsWith('event: ')) {
+                        event.name = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        event.data = JSON.parse(line.slice(6));
+                    }
+                });
+                return event;
+            }
+            
             addMessage(text, type) {
                 const messageDiv = document.createElement('div');
                 messageDiv.className = `message ${type}-message`;
@@ -264,6 +362,12 @@ class HTMLTemplate:
                 
                 this.chatContainer.appendChild(messageDiv);
                 this.chatContainer.scrollTop = this.chatContainer.scrollHeight;
+                return messageDiv;
+            }
+            
+            updateMessage(messageDiv, text) {
+                messageDiv.innerHTML = `<strong>🤖 సర్కారీ సహాయకుడు:</strong><br>${this.formatResponse(text)}`;
+                this.chatContainer.scrollTop = this.chatContainer.scrollHeight;
             }
             
             formatResponse(text) {
@@ -0,0 +1,389 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import Optional, Dict, Any, Iterator, List
+import requests
+from config import Config
+from deadlines import DeadlineExceeded, remaining, upstream_timeout
+from prompts import SystemPrompts
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying on another endpoint
+RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+# Statuses that mean this key is unusable; its circuit opens straight away
+KEY_ERROR_STATUSES = frozenset([401, 403])
+
+class UpstreamError(Exception):
+    """An upstream Gemini call failed"""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        """Network errors, key errors and 429/5xx responses may succeed elsewhere"""
+        return self.status is None or self.status in RETRYABLE_STATUSES or self.status in KEY_ERROR_STATUSES
+
+class UpstreamUnavailableError(UpstreamError):
+    """Every endpoint is rate limited or has an open circuit"""
+
+class Endpoint:
+    """One API key + model pair with its health statistics"""
+
+    def __init__(self, api_key: str, model: str, base_url: str):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url.rstrip('/')
+        self.name = f"{model}@...{api_key[-4:]}"
+        self.session = requests.Session()
+
+        self.ewma_latency = 1.0  # seconds; optimistic start so new endpoints get traffic
+        self.error_rate = 0.0  # EWMA of failures
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.rate_limited_until = 0.0
+        self.circuit_open_until = 0.0
+        self.half_open_probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def circuit_state(self) -> str:
+        """closed, open or half_open"""
+        if self.consecutive_failures < Config.UPSTREAM_CIRCUIT_THRESHOLD:
+            return 'closed'
+        return 'open' if time.time() < self.circuit_open_until else 'half_open'
+
+    def is_available(self, now: float) -> bool:
+        """Check if the endpoint can take a request right now"""
+        if now < self.rate_limited_until:
+            return False
+        state = self.circuit_state
+        if state == 'open':
+            return False
+        # Half-open circuits let a single probe through
+        return state == 'closed' or not self.half_open_probe
+
+    def score(self) -> float:
+        """Lower is healthier: latency penalised by recent error rate"""
+        return self.ewma_latency * (1.0 + 4.0 * self.error_rate)
+
+    def record_success(self, latency: float) -> None:
+        """Update health after a successful call"""
+        alpha = Config.UPSTREAM_EWMA_ALPHA
+        with self._lock:
+            self.requests += 1
+            self.ewma_latency += alpha * (latency - self.ewma_latency)
+            self.error_rate *= (1 - alpha)
+            self.consecutive_failures = 0
+            self.half_open_probe = False
+
+    def record_failure(self, error: UpstreamError) -> None:
+        """Update health after a failed call, opening the circuit if needed"""
+        alpha = Config.UPSTREAM_EWMA_ALPHA
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.error_rate += alpha * (1.0 - self.error_rate)
+            self.half_open_probe = False
+            if error.status == 429:
+                self.rate_limited_until = now + (error.retry_after or Config.UPSTREAM_RATE_LIMIT_COOLDOWN)
+                return
+            self.consecutive_failures += 1
+            if error.status in KEY_ERROR_STATUSES:
+                self.consecutive_failures = max(self.consecutive_failures, Config.UPSTREAM_CIRCUIT_THRESHOLD)
+            if self.consecutive_failures >= Config.UPSTREAM_CIRCUIT_THRESHOLD:
+                self.circuit_open_until = now + Config.UPSTREAM_CIRCUIT_COOLDOWN
+                logger.warning(f"⚡ Circuit opened for upstream {self.name}")
+
+    def _url(self, method: str) -> str:
+        return f"{self.base_url}/v1beta/models/{self.model}:{method}"
+
+    def _request(self, method: str, payload: Dict[str, Any], timeout: float, stream: bool = False,
+                 params: Optional[Dict[str, str]] = None) -> requests.Response:
+        """POST to the Gemini REST API, raising UpstreamError on failure"""
+        try:
+            response = self.session.post(
+                self._url(method),
+                params=params,
+                json=payload,
+                headers={'x-goog-api-key': self.api_key},
+                timeout=timeout,
+                stream=stream
+            )
+        except requests.RequestException as e:
+            raise UpstreamError(f"{self.name}: {e}") from e
+
+        if response.status_code != 200:
+            retry_after = response.headers.get('Retry-After')
+            raise UpstreamError(
+                f"{self.name}: HTTP {response.status_code}",
+                status=response.status_code,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+            )
+        return response
+
+    def generate(self, payload: Dict[str, Any], timeout: float = Config.UPSTREAM_TIMEOUT) -> str:
+        """Run generateContent and return the response text"""
+        response = self._request('generateContent', payload, timeout)
+        return _extract_text(response.json())
+
+    def stream(self, payload: Dict[str, Any], timeout: float = Config.UPSTREAM_TIMEOUT) -> Iterator[str]:
+        """Run streamGenerateContent and yield text chunks"""
+        response = self._request('streamGenerateContent', payload, timeout, stream=True, params={'alt': 'sse'})
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if line and line.startswith('data:'):
+                    text = _extract_text(json.loads(line[5:]))
+                    if text:
+                        yield text
+        except (requests.RequestException, ValueError) as e:
+            raise UpstreamError(f"{self.name}: stream interrupted: {e}") from e
+        finally:
+            response.close()
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get endpoint health for /status"""
+        now = time.time()
+        return {
+            'endpoint': self.name,
+            'circuit': self.circuit_state,
+            'rate_limited': now < self.rate_limited_until,
+            'ewma_latency_ms': round(self.ewma_latency * 1000, 1),
+            'error_rate': round(self.error_rate, 3),
+            'requests': self.requests,
+            'failures': self.failures
+        }
+
+def _extract_text(data: Dict[str, Any]) -> str:
+    """Join the text parts of the first candidate in a Gemini response"""
+    candidates = data.get('candidates') or []
+    if not candidates:
+        return ''
+    parts = candidates[0].get('content', {}).get('parts', [])
+    return ''.join(part.get('text', '') for part in parts)
+
+def build_payload(prompt: str, generation_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a generateContent request body"""
+    return {
+        'systemInstruction': {'parts': [{'text': SystemPrompts.MAIN_SYSTEM_PROMPT}]},
+        'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+        'generationConfig': generation_config
+    }
+
+class UpstreamPool:
+    """Routes Gemini calls across several API keys and models by health"""
+
+    def __init__(self, endpoints: List[Endpoint], hedge: bool = False):
+        if not endpoints:
+            raise ValueError("UpstreamPool needs at least one endpoint")
+        self.endpoints = endpoints
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies: deque = deque(maxlen=256)  # recent successful call latencies, seconds
+        self._lock = threading.Lock()
+        # Hedged calls run both attempts on workers while the caller waits for the first result;
+        # two per async upstream slot so a full ASGI server can hedge every call
+        self._hedge_workers = None
+        if hedge and len(endpoints) > 1:
+            self._hedge_workers = ThreadPoolExecutor(max_workers=2 * Config.ASYNC_MAX_CONCURRENT_UPSTREAM,
+                                                     thread_name_prefix='hedge')
+
+    @classmethod
+    def from_config(cls) -> 'UpstreamPool':
+        """One endpoint per configured key and model"""
+        return cls([
+            Endpoint(api_key, model, Config.GEMINI_API_BASE)
+            for api_key in Config.GEMINI_API_KEYS
+            for model in Config.GEMINI_MODELS
+        ], hedge=Config.HEDGE_ENABLED)
+
+    def choose(self, exclude: Optional[set] = None) -> Endpoint:
+        """Pick the healthiest available endpoint"""
+        now = time.time()
+        candidates = [endpoint for endpoint in self.endpoints
+                      if endpoint.is_available(now) and endpoint not in (exclude or ())]
+        if not candidates:
+            raise UpstreamUnavailableError("No healthy Gemini endpoint available", status=503)
+
+        best = min(endpoint.score() for endpoint in candidates)
+        # Spread load over endpoints within 10% of the best score
+        endpoint = random.choice([e for e in candidates if e.score() <= best * 1.1])
+        if endpoint.circuit_state == 'half_open':
+            endpoint.half_open_probe = True
+        return endpoint
+
+    @staticmethod
+    def _backoff(attempt: int, deadline: Optional[float] = None) -> None:
+        """Sleep with full jitter before the next attempt, never past the deadline"""
+        ceiling = min(Config.UPSTREAM_BACKOFF_MAX, Config.UPSTREAM_BACKOFF_BASE * (2 ** attempt))
+        left = remaining(deadline)
+        time.sleep(random.uniform(0, ceiling if left is None else min(ceiling, left)))
+
+    def hedge_delay(self) -> float:
+        """How long to wait for the first attempt before hedging: the HEDGE_PERCENTILE latency"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < 20:
+            # Too little history yet; assume twice the healthiest endpoint's average
+            estimate = 2 * min(endpoint.ewma_latency for endpoint in self.endpoints)
+        else:
+            estimate = latencies[min(len(latencies) - 1, int(Config.HEDGE_PERCENTILE * len(latencies)))]
+        return max(Config.HEDGE_MIN_DELAY, estimate)
+
+    def _attempt(self, endpoint: Endpoint, payload: Dict[str, Any], deadline: Optional[float]) -> str:
+        """One generateContent call, bounded by the deadline and recorded in the endpoint's health"""
+        start = time.perf_counter()
+        try:
+            text = endpoint.generate(payload, upstream_timeout(deadline))
+        except UpstreamError as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                # Cut short by the caller's deadline, not the endpoint's fault
+                raise DeadlineExceeded("Request deadline exceeded") from e
+            endpoint.record_failure(e)
+            raise
+        latency = time.perf_counter() - start
+        endpoint.record_success(latency)
+        with self._lock:
+            self._latencies.append(latency)
+        return text
+
+    def generate(self, payload: Dict[str, Any], deadline: Optional[float] = None) -> str:
+        """Generate text, failing over to other endpoints on 429/5xx
+
+        Raises DeadlineExceeded when the deadline (a time.monotonic() value) passes first.
+        """
+        if self._hedge_workers is not None:
+            return self._generate_hedged(payload, deadline)
+        return self._generate_with_retries(payload, deadline)
+
+    def _generate_with_retries(self, payload: Dict[str, Any], deadline: Optional[float],
+                               tried: Optional[set] = None) -> str:
+        """Sequential attempts on the healthiest endpoints not tried yet"""
+        tried = tried or set()
+        last_error: Optional[UpstreamError] = None
+        for attempt in range(len(tried), Config.UPSTREAM_MAX_ATTEMPTS):
+            try:
+                endpoint = self.choose(exclude=tried if len(tried) < len(self.endpoints) else None)
+            except UpstreamUnavailableError:
+                if last_error is not None:
+                    raise last_error
+                raise
+
+            try:
+                return self._attempt(endpoint, payload, deadline)
+            except UpstreamError as e:
+                logger.warning(f"Upstream {endpoint.name} failed (attempt {attempt + 1}): {e}")
+                if not e.retryable:
+                    raise
+                last_error = e
+                tried.add(endpoint)
+                self.retries += 1
+                self._backoff(attempt, deadline)
+
+        raise last_error
+
+    def _generate_hedged(self, payload: Dict[str, Any], deadline: Optional[float]) -> str:
+        """Start on the healthiest endpoint; if it runs past the hedge delay, race a second one
+
+        The slower call cannot be aborted mid-request, so it finishes in the
+        background and only updates its endpoint's health.
+        """
+        primary = self.choose()
+        first = self._hedge_workers.submit(self._attempt, primary, payload, deadline)
+        delay = self.hedge_delay()
+        left = remaining(deadline)
+        try:
+            return first.result(timeout=delay if left is None else min(delay, left))
+        except DeadlineExceeded:
+            # Subclasses TimeoutError, as FutureTimeout is on 3.11: the attempt itself ran out of time
+            raise
+        except FutureTimeout:
+            if left is not None and left <= delay:
+                # The deadline, not the hedge delay, ended the wait: no time left for a backup
+                raise DeadlineExceeded("Request deadline exceeded")
+            remaining(deadline)
+        except UpstreamError as e:
+            logger.warning(f"Upstream {primary.name} failed (attempt 1): {e}")
+            if not e.retryable:
+                raise
+            self.retries += 1
+            return self._generate_with_retries(payload, deadline, tried={primary})
+
+        pending = {first}
+        try:
+            backup = self.choose(exclude={primary})
+            pending.add(self._hedge_workers.submit(self._attempt, backup, payload, deadline))
+            self.hedges += 1
+            logger.info(f"⚡ Hedging slow upstream {primary.name} with {backup.name} after {delay * 1000:.0f} ms")
+        except UpstreamUnavailableError:
+            pass
+
+        last_error: Optional[UpstreamError] = None
+        while pending:
+            done, pending = wait(pending, timeout=remaining(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("Request deadline exceeded")
+            for future in done:
+                try:
+                    text = future.result()
+                except UpstreamError as e:
+                    last_error = e
+                    continue
+                if future is not first:
+                    self.hedge_wins += 1
+                return text
+        raise last_error
+
+    def stream(self, payload: Dict[str, Any], deadline: Optional[float] = None) -> Iterator[str]:
+        """Stream text; fails over only if no chunk was sent yet
+
+        Raises DeadlineExceeded, dropping the connection, once the deadline passes.
+        """
+        tried: set = set()
+        for attempt in range(Config.UPSTREAM_MAX_ATTEMPTS):
+            endpoint = self.choose(exclude=tried if len(tried) < len(self.endpoints) else None)
+            start = time.perf_counter()
+            sent = False
+            try:
+                for text in endpoint.stream(payload, upstream_timeout(deadline)):
+                    remaining(deadline)
+                    sent = True
+                    yield text
+            except UpstreamError as e:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise DeadlineExceeded("Request deadline exceeded") from e
+                endpoint.record_failure(e)
+                if sent or not e.retryable or attempt == Config.UPSTREAM_MAX_ATTEMPTS - 1:
+                    raise
+                tried.add(endpoint)
+                self.retries += 1
+                self._backoff(attempt, deadline)
+                continue
+
+            endpoint.record_success(time.perf_counter() - start)
+            return
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get pool state for /status"""
+        now = time.time()
+        return {
+            'endpoints': [endpoint.get_status() for endpoint in self.endpoints],
+            'available': sum(1 for endpoint in self.endpoints if endpoint.is_available(now)),
+            'retries': self.retries,
+            'hedging': {
+                'enabled': self._hedge_workers is not None,
+                'delay_ms': round(self.hedge_delay() * 1000, 1),
+                'hedges': self.hedges,
+                'wins': self.hedge_wins
+            }
+        }
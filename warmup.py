@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Offline warm-up: answer the curated FAQ set with Gemini and write the answer file the app serves from
+
+    python warmup.py                    # answer what is missing for the current content version
+    python warmup.py --force            # regenerate every answer
+    python warmup.py --workers 4 --rpm 30
+
+Questions come from faq/questions.json (FAQ_QUESTIONS_PATH) and answers go to
+faq/answers.bin (FAQ_ANSWERS_PATH). Bump "version" in questions.json whenever
+the questions, prompts or model change: the app ignores answer files built for
+another version, and this command then regenerates every answer.
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+from dotenv import load_dotenv
+
+# Load environment variables before Config is imported
+load_dotenv()
+
+from ai_client import GeminiClient  # noqa: E402
+from config import Config  # noqa: E402
+from faq_store import FAQStore, build_meta, expand_questions, load_questions, record_keys, write_answer_file  # noqa: E402
+from knowledge_base import KnowledgeBase  # noqa: E402
+from log_pipeline import configure_logging  # noqa: E402
+from prompts import SystemPrompts  # noqa: E402
+from rate_limiter import RateLimitExceeded, TokenBucket  # noqa: E402
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+def existing_records(path: str, version: int, entries: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Records of an answer file built for this content version, keyed by slot"""
+    try:
+        store = FAQStore(path)
+    except (OSError, ValueError):
+        return {}
+    try:
+        if store.content_version != version:
+            logger.info(f"FAQ content version changed ({store.content_version} -> {version}), regenerating all answers")
+            return {}
+        records = {}
+        for entry in entries:
+            record = store.get(f"s|{entry['slot']}")
+            if record is not None:
+                records[entry['slot']] = record
+        return records
+    finally:
+        store.close()
+
+class Warmup:
+    """Generates FAQ answers on a thread pool, paced to a request rate"""
+
+    def __init__(self, client: GeminiClient, knowledge_base: Optional[KnowledgeBase], rpm: float, retries: int = 3):
+        self.client = client
+        self.knowledge_base = knowledge_base
+        self.retries = retries
+        self._bucket = TokenBucket(rpm / 60.0, 1.0)
+        self._lock = threading.Lock()
+
+    def _pace(self) -> None:
+        """Wait for the next request slot"""
+        while True:
+            with self._lock:
+                wait = self._bucket.try_take(1.0, time.monotonic())
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def answer(self, entry: Dict[str, Any]) -> Optional[str]:
+        """Answer one FAQ entry the way the app would, with knowledge base notes in the prompt"""
+        passages = []
+        if self.knowledge_base is not None:
+            passages = [hit for hit in self.knowledge_base.search(entry['question'])
+                        if hit['confidence'] >= Config.KB_MIN_CONFIDENCE]
+        prompt = SystemPrompts.create_prompt(entry['question'], passages,
+                                             intent=entry['intent'], language=entry['language'])
+        for _ in range(self.retries):
+            self._pace()
+            try:
+                # Greedy decoding so a rebuild reproduces the same answers
+                return self.client.generate_response(prompt, profile='deterministic')
+            except RateLimitExceeded as e:
+                logger.warning(f"⏳ Quota exhausted, retrying {entry['slot']} in {e.retry_after:.1f}s")
+                time.sleep(e.retry_after)
+        return None
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--force', action='store_true', help='regenerate answers that already exist')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent Gemini calls')
+    parser.add_argument('--rpm', type=float, default=30.0, help='maximum Gemini requests per minute')
+    parser.add_argument('--output', default=Config.FAQ_ANSWERS_PATH)
+    args = parser.parse_args()
+
+    spec = load_questions(Config.FAQ_QUESTIONS_PATH)
+    entries = expand_questions(spec)
+    reused = {} if args.force else existing_records(args.output, spec['version'], entries)
+    pending = [entry for entry in entries if entry['slot'] not in reused]
+    print(f"📚 FAQ content version {spec['version']}: {len(entries)} answers, "
+          f"{len(reused)} up to date, {len(pending)} to generate")
+
+    generated: Dict[str, Dict[str, Any]] = {}
+    if pending:
+        client = GeminiClient(background=False)
+        if not client.is_available():
+            print("❌ Gemini client unavailable; set GEMINI_API_KEY")
+            return 1
+        warmup = Warmup(client, KnowledgeBase.from_config(), args.rpm)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for entry, text in zip(pending, executor.map(warmup.answer, pending)):
+                if text:
+                    generated[entry['slot']] = {'slot': entry['slot'], 'question': entry['question'],
+                                                'response': text.strip()}
+                else:
+                    logger.error(f"❌ No answer for {entry['slot']}")
+        print(f"⚡ Generated {len(generated)}/{len(pending)} answers in {time.perf_counter() - start:.1f}s")
+
+    records = []
+    for entry in entries:
+        record = generated.get(entry['slot']) or reused.get(entry['slot'])
+        if record is not None:
+            records.append((record_keys(entry), record))
+    meta = build_meta(spec, entries, built_at=time.time(), model=Config.GEMINI_MODEL)
+    size = write_answer_file(args.output, spec['version'], records, meta)
+    print(f"✅ Wrote {len(records)} answers ({size} bytes) to {args.output}")
+    return 0 if len(records) == len(entries) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())